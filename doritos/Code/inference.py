@@ -1,5 +1,6 @@
 # Doritos's Final Code
 
+import argparse
 import os
 import pandas as pd
 from dataset import *
@@ -8,6 +9,11 @@ import torchvision.models
 import torch
 from tqdm import tqdm
 
+from export import load_exported
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--model_file', type=str, default=None, help='TorchScript artifact from export.py (CPU, no model class needed)')
+args = parser.parse_args()
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 print("device :", device)
@@ -21,7 +27,13 @@ info_id = list(info_df['ImageID'])
 info_img = os.path.join(eval_dir, 'images')
 img_paths = [os.path.join(info_img, img_id) for img_id in info_id]
 
-dataset = TestDataset(img_paths, ((400, 200)))
+if args.model_file:
+    # export.py 의 TorchScript artifact : ResNet class 없이 읽고, normalize 설정도 artifact 의 것을 씁니다
+    device = torch.device('cpu')
+    best_model, config = load_exported(args.model_file, device)
+    dataset = TestDataset(img_paths, config["resize"], mean=config["mean"], std=config["std"])
+else:
+    dataset = TestDataset(img_paths, ((400, 200)))
 
 
 test_loader = DataLoader(dataset, batch_size = 64, shuffle = False)
@@ -29,8 +41,10 @@ test_loader = DataLoader(dataset, batch_size = 64, shuffle = False)
 # best_model = torchvision.models.resnet18(pretrained=False)
 # best_model.fc = torch.nn.Linear(in_features=512, out_features=18, bias=True)
 
-best_model = torch.load('062_acc_90.0529%_loss_0.393161_f1_0.8278.pt')
-# best_model.load_state_dict(torch.load('021_accuracy_97.83%.ckpt'))
+if not args.model_file:
+    # main2.py 의 CheckpointManager 가 저장한 state_dict (resnet18)
+    best_model = ResNet([2, 2, 2, 2])
+    best_model.load_state_dict(torch.load('best.pth', map_location=device))
 
 best_model.to(device)
 
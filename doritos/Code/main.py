@@ -23,6 +23,8 @@ import shutil
 from torchmetrics import F1Score
 import gc
 
+from checkpoint import CheckpointManager
+
 gc.collect()
 torch.cuda.empty_cache()
 
@@ -149,11 +151,13 @@ def main(args):
 
     n = len(train_loader)
 
+    # epoch 평균 loss 가 좋아질 때마다 background 에서 저장합니다
+    checkpoints = CheckpointManager('.', top_k=0, mode="min", metric_name="loss",
+                                    best_name='custom_best_model.pth')
+
     model.train()
     for epoch in tqdm(range(1, args.epochs+1)):
-        running_loss = 0.0
-        prev_loss = 1000.0
-        best_model = None
+        running_loss = torch.zeros((), device=device)  # step 마다 sync 하지 않도록 device 위에서 누적합니다
 
         for i, data in enumerate(train_loader):
             inputs, labels = data[0].to(device), data[1].to(device)
@@ -164,24 +168,24 @@ def main(args):
             loss.backward()
             optimizer.step()
 
-            running_loss += loss.item()
+            running_loss += loss.detach()
             
             if i % 50 == 0:
                 print(f"epoch {epoch} batch {i} - loss: {loss.data}")
 
-            if loss.data < prev_loss:
-                prev_loss = loss.data
-                torch.save(model, 'custom_best_model.pt')
-                best_model = model
-                print(f"---------------------- Best Model Save! epoch {epoch} - batch {i} : loss {loss.data} ----------------------")
-
-        loss_.append(running_loss / n)
+        epoch_loss = (running_loss / n).item()
+        loss_.append(epoch_loss)
+        if checkpoints.update(model, epoch_loss):
+            print(f"---------------------- Best Model Save! epoch {epoch} : loss {epoch_loss} ----------------------")
 
         if epoch % 5 == 0:
-            print("[{}] loss : {:.3f}".format(epoch, running_loss / n))
+            print("[{}] loss : {:.3f}".format(epoch, epoch_loss))
     #--------------------------------------------------------------------------
     
     # eval---------------------------------------------------------------------
+    checkpoints.close()
+    best_model = checkpoints.load_best(model)
+
     f1 = F1Score(num_classes = 18, average = 'macro').to(device)
 
     correct = 0
@@ -24,6 +24,7 @@ import shutil
 from torchmetrics import F1Score
 import time
 from dataset import *
+from checkpoint import CheckpointManager
 
 def change_age(x):
     x = int(x)
@@ -158,6 +159,9 @@ wandb.init(config={"batch_size": batch_size,
                 "epochs"    : epochs,
                 "criterion_name" : 'cross_entropy'})
 
+# best f1 기준 상위 3 개만 남기고, 저장은 background thread 에서 합니다
+checkpoints = CheckpointManager('.', top_k=3, best_name='best.pth')
+
 for epoch in tqdm(range(epochs)):
     resnet.train()
     running_loss = 0.0
@@ -216,8 +220,8 @@ for epoch in tqdm(range(epochs)):
         
         if (valid_loss < best_val_loss) or (valid_f1 > best_f1):
             print(f"New best model for val loss : {valid_loss:.6f}, val f1 : {valid_f1:.4f} saving the best model..")
-            torch.save(resnet, f"{epoch+1:03}_acc_{valid_acc:.4f}%_loss_{valid_loss:.6f}_f1_{valid_f1:.4f}.pt")
-            
+            checkpoints.update(resnet, valid_f1, tag=f"{epoch+1:03}_acc_{valid_acc:.4f}%_loss_{valid_loss:.6f}")
+
             best_f1 = max(valid_f1, best_f1)
             best_val_loss = min(valid_loss, best_val_loss)
             counter = 0
@@ -240,4 +244,5 @@ for epoch in tqdm(range(epochs)):
     })
 
     print("="*100)
-    #----------------------------------------------------------------------------
\ No newline at end of file
+    #----------------------------------------------------------------------------
+checkpoints.close()
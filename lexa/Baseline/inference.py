@@ -7,6 +7,7 @@ import torch
 from torch.utils.data import DataLoader
 
 from dataset import TestDataset, MaskBaseDataset
+from export import load_exported
 
 
 def load_model(saved_model, num_classes, device):
@@ -33,15 +34,22 @@ def inference(data_dir, model_dir, output_dir, args):
     device = torch.device("cuda" if use_cuda else "cpu")
 
     num_classes = MaskBaseDataset.num_classes  # 18
-    model = load_model(model_dir, num_classes, device).to(device)
-    model.eval()
+    resize, preprocess = args.resize, {}
+    if args.model_file:
+        # export.py 의 TorchScript artifact : model class 없이 읽고, 전처리 설정도 artifact 의 것을 씁니다
+        device = torch.device("cpu")
+        model, config = load_exported(args.model_file, device)
+        resize, preprocess = config["resize"], {"mean": config["mean"], "std": config["std"]}
+    else:
+        model = load_model(model_dir, num_classes, device).to(device)
+        model.eval()
 
     img_root = os.path.join(data_dir, 'images')
     info_path = os.path.join(data_dir, 'info.csv')
     info = pd.read_csv(info_path)
 
     img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
+    dataset = TestDataset(img_paths, resize, **preprocess)
     loader = torch.utils.data.DataLoader(
         dataset,
         batch_size=args.batch_size,
@@ -72,6 +80,7 @@ if __name__ == '__main__':
     parser.add_argument('--batch_size', type=int, default=1000, help='input batch size for validing (default: 1000)')
     parser.add_argument('--resize', type=tuple, default=(96, 128), help='resize size for image when you trained (default: (96, 128))')
     parser.add_argument('--model', type=str, default='BaseModel', help='model type (default: BaseModel)')
+    parser.add_argument('--model_file', type=str, default=None, help='TorchScript artifact from export.py (CPU, ignores --model / --resize)')
 
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_EVAL', '/opt/ml/input/data/eval'))
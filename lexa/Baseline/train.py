@@ -15,6 +15,7 @@ from torch.optim.lr_scheduler import StepLR
 from torch.utils.data import DataLoader
 from torch.utils.tensorboard import SummaryWriter
 
+from codec import decode_multi_class
 from dataset import MaskBaseDataset
 from loss import create_criterion
 
@@ -43,17 +44,16 @@ def grid_image(np_images, gts, preds, n=16, shuffle=False):
     plt.subplots_adjust(top=0.8)               # cautions: hardcoded, 이미지 크기에 따라 top 를 조정해야 할 수 있습니다. T.T
     n_grid = np.ceil(n ** 0.5)
     tasks = ["mask", "gender", "age"]
+    # 고른 n 개의 label 을 한 번에 decode 합니다 -> (n, 3)
+    gt_decoded_labels = np.stack(decode_multi_class(gts[choices].cpu().numpy()), axis=-1)
+    pred_decoded_labels = np.stack(decode_multi_class(preds[choices].cpu().numpy()), axis=-1)
     for idx, choice in enumerate(choices):
-        gt = gts[choice].item()
-        pred = preds[choice].item()
         image = np_images[choice]
         # title = f"gt: {gt}, pred: {pred}"
-        gt_decoded_labels = MaskBaseDataset.decode_multi_class(gt)
-        pred_decoded_labels = MaskBaseDataset.decode_multi_class(pred)
         title = "\n".join([
             f"{task} - gt: {gt_label}, pred: {pred_label}"
             for gt_label, pred_label, task
-            in zip(gt_decoded_labels, pred_decoded_labels, tasks)
+            in zip(gt_decoded_labels[idx], pred_decoded_labels[idx], tasks)
         ])
 
         plt.subplot(n_grid, n_grid, idx + 1, title=title)
@@ -108,6 +108,8 @@ def train(data_dir, model_dir, args):
         std=dataset.std,
     )
     dataset.set_transform(transform)
+    if args.cache_dir:
+        dataset.enable_cache(args.cache_dir)
 
     # -- data_loader
     train_set, val_set = dataset.split_dataset()
@@ -263,6 +265,7 @@ if __name__ == '__main__':
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images'))
     parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_MODEL_DIR', './model'))
+    parser.add_argument('--cache_dir', type=str, default=os.environ.get('SM_CACHE_DIR'), help='decoded image memmap cache dir (default: None, no cache)')
 
     args = parser.parse_args()
     print(args)
@@ -16,6 +16,7 @@ from torchmetrics import F1Score
 
 import numpy as np
 import pandas as pd
+from checkpoint import CheckpointManager
 from Datasets import CustomDataSet
 from torch.utils.data import DataLoader
 from Models import CustomModel
@@ -107,11 +108,15 @@ def main(args):
 
     prev_loss = 1000.0
     f1_best = 0
-    best_model = None
+    # epoch 평균 loss 가 좋아질 때마다 background 에서 저장합니다
+    checkpoints = CheckpointManager(save_model_path, top_k=0, mode="min", metric_name="loss",
+                                    best_name='custom_best_model.pth')
     # training
     for epoch in range(1, args.epochs+1):
 
-        running_loss = 0.0
+        # step 마다 sync 하지 않도록 loss / 예측은 device 위에 모아 두고 epoch 끝에 한 번만 읽습니다
+        running_loss = torch.zeros((), device=device)
+        epoch_preds, epoch_classes = [], []
         for idx, (imgs, classes) in enumerate(train_loader):
             imgs, classes = imgs.to(device), classes.to(device)
 
@@ -125,18 +130,19 @@ def main(args):
             loss.backward()
             optimizer.step()
 
+            running_loss += loss.detach()
+            epoch_preds.append(torch.argmax(pred.detach(), dim=-1))
+            epoch_classes.append(classes)
+
             if idx % 50 == 0:
                 print(f"epoch {epoch} batch {idx} - loss: {loss.data}")
 
-            if loss.data < prev_loss:
-                prev_loss = loss.data
-                torch.save(model, os.path.join(save_model_path, 'custom_best_model.pt'))
-                best_model = model
-
-                outputs = torch.argmax(pred, dim=-1)
-                f1_best = f1_score(outputs, classes)
+        epoch_loss = running_loss / (idx + 1)
+        if checkpoints.update(model, epoch_loss):
+            prev_loss = epoch_loss.item()
+            f1_best = f1_score(torch.cat(epoch_preds), torch.cat(epoch_classes))
 
-                print(f"---------------------- Best Model Save! epoch {epoch} - batch {idx} : loss {loss.data:.5g} / F1 {f1_best:.4g} ----------------------")
+            print(f"---------------------- Best Model Save! epoch {epoch} : loss {prev_loss:.5g} / F1 {f1_best:.4g} ----------------------")
 
         if args.epochs < 100:
             if epoch % 10 == 0:
@@ -146,6 +152,8 @@ def main(args):
                 print(f"epoch {epoch} batch {idx} - loss: {loss.data}")
 
     # validation/test
+    checkpoints.close()
+    best_model = checkpoints.load_best(model)
     best_model.eval()
     f1 = 0
     avg_score = 0
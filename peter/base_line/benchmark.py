@@ -0,0 +1,399 @@
+"""
+데이터 파이프라인 benchmark 모음입니다.
+
+- transport : worker 가 float32 (ToTensor + Normalize) 를 넘길 때와 uint8 을 넘기고 batch 단위로
+              normalize 할 때의 IPC byte 수 / 처리량 비교 (train.py, inference.py 의 loader)
+- draft     : full-size JPEG decode + Resize 와 draft mode (DCT 축소) decode 의 이미지당 시간 비교,
+              pixel 차이 (PSNR) 와 `--model_dir` 가 주어지면 예측 일치율 / 정확도 parity 확인
+- export    : export.py 의 TorchScript artifact (`--model_file`) 와 같은 weight 의 eager model 의
+              출력 parity / batch 크기별 CPU latency 비교
+- suite     : synthetic.py tree (또는 `--data_dir` / `--eval_dir`) 에서 단계별 비용을 따로 재서 `--output` json 으로 저장
+              (MaskBaseDataset.setup cold / warm, augmentation class 별 __getitem__, worker 수별 DataLoader,
+               `--resizes` 마다 model.py 의 모든 model forward / backward, inference.py end to end)
+- compare   : suite 결과 json 두 개 (`--baseline`, `--candidate`) 의 같은 항목을 비교해
+              `--threshold` 이상 느려진 항목을 regression 으로 표시 (있으면 exit code 1)
+
+e.g. SM_CHANNEL_TRAIN=[train image dir] SM_CHANNEL_EVAL=[eval dir] python benchmark.py transport
+     python benchmark.py suite --output before.json && python benchmark.py compare --baseline before.json --candidate after.json
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from importlib import import_module
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+from torchvision.transforms import Resize
+
+from dataset import BaseAugmentation, BatchNormalize, MaskBaseDataset, TestDataset, ToUint8Tensor, open_image
+from export import benchmark, build_model, check_parity, load_exported, time_model
+from manifest import MANIFEST_FILE, build_manifest
+from synthetic import make_tree
+
+
+def time_loader(dataset, normalize, device, args):
+    loader = DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        shuffle=False,
+        pin_memory=device.type == "cuda",
+    )
+
+    n_images = 0
+    n_bytes = 0
+    start = time.perf_counter()
+    for idx, batch in enumerate(loader):
+        images = batch[0] if isinstance(batch, (list, tuple)) else batch
+        n_images += len(images)
+        n_bytes += images.element_size() * images.nelement()
+        normalize(images.to(device))
+        if idx + 1 >= args.num_batches:
+            break
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "images": n_images,
+        "ipc_bytes_per_image": n_bytes / n_images,
+        "images_per_sec": n_images / elapsed,
+    }
+
+
+def print_table(rows):
+    print(f"{'script':<14}{'mode':<10}{'images':>8}{'IPC KB/image':>15}{'images/s':>12}")
+    for script, mode, result in rows:
+        print(f"{script:<14}{mode:<10}{result['images']:>8}"
+              f"{result['ipc_bytes_per_image'] / 1024:>15.1f}{result['images_per_sec']:>12.1f}")
+
+    # float32 -> uint8 변화량
+    for script in dict.fromkeys(script for script, _, _ in rows):
+        results = {mode: result for name, mode, result in rows if name == script}
+        if "float32" in results and "uint8" in results:
+            f32, u8 = results["float32"], results["uint8"]
+            print(f"{script}: IPC bytes x{u8['ipc_bytes_per_image'] / f32['ipc_bytes_per_image']:.2f}, "
+                  f"throughput x{u8['images_per_sec'] / f32['images_per_sec']:.2f}")
+
+
+def bench_transport(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    rows = []
+
+    if args.data_dir:
+        dataset = MaskBaseDataset(data_dir=args.data_dir)
+        normalize = BatchNormalize(dataset.mean, dataset.std, device=device)
+        for uint8 in (False, True):
+            dataset.set_transform(BaseAugmentation(args.resize, dataset.mean, dataset.std, uint8=uint8))
+            rows.append(("train.py", "uint8" if uint8 else "float32", time_loader(dataset, normalize, device, args)))
+
+    if args.eval_dir:
+        info = pd.read_csv(os.path.join(args.eval_dir, 'info.csv'))
+        img_paths = [os.path.join(args.eval_dir, 'images', img_id) for img_id in info.ImageID]
+        for uint8 in (False, True):
+            dataset = TestDataset(img_paths, args.resize, uint8=uint8)
+            normalize = BatchNormalize(dataset.mean, dataset.std, device=device)
+            rows.append(("inference.py", "uint8" if uint8 else "float32", time_loader(dataset, normalize, device, args)))
+
+    print_table(rows)
+
+
+def bench_draft(args):
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dataset = MaskBaseDataset(data_dir=args.data_dir)
+    indices = np.random.RandomState(0).permutation(len(dataset))[:args.num_images]
+    size = tuple(args.resize)
+    resize = Resize(size, Image.BILINEAR)
+
+    def full_decode(index):
+        return resize(Image.open(dataset.image_paths[index]))
+
+    def draft_decode(index):
+        return resize(open_image(dataset.image_paths[index], size))
+
+    timings = {}
+    images = {}
+    for name, decode in (("full", full_decode), ("draft", draft_decode)):
+        start = time.perf_counter()
+        images[name] = [np.asarray(decode(index).convert("RGB")) for index in indices]
+        timings[name] = (time.perf_counter() - start) / len(indices) * 1000
+
+    full = np.stack(images["full"]).astype(np.float64)
+    draft = np.stack(images["draft"]).astype(np.float64)
+    mse = np.mean((full - draft) ** 2)
+    psnr = 10 * np.log10(255 ** 2 / mse) if mse > 0 else float("inf")
+    print(f"decode {size} : full {timings['full']:.2f} ms/image, draft {timings['draft']:.2f} ms/image "
+          f"(x{timings['full'] / timings['draft']:.2f})")
+    print(f"pixel parity : mean abs diff {np.mean(np.abs(full - draft)):.2f}, PSNR {psnr:.1f} dB")
+
+    if args.model_dir:
+        model = getattr(import_module("model"), args.model)(num_classes=dataset.num_classes)
+        model.load_state_dict(torch.load(os.path.join(args.model_dir, 'best.pth'), map_location=device))
+        model.to(device).eval()
+
+        normalize = BatchNormalize(dataset.mean, dataset.std, device=device)
+        to_tensor = ToUint8Tensor()
+        labels = dataset.class_labels[indices]
+
+        preds = {}
+        with torch.no_grad():
+            for name in ("full", "draft"):
+                outs = []
+                for start in range(0, len(indices), args.batch_size):
+                    batch = torch.stack([to_tensor(Image.fromarray(image))
+                                         for image in images[name][start:start + args.batch_size]])
+                    outs.append(model(normalize(batch.to(device))).argmax(dim=-1).cpu().numpy())
+                preds[name] = np.concatenate(outs)
+
+        print(f"prediction agreement : {np.mean(preds['full'] == preds['draft']):.2%}")
+        print(f"accuracy : full {np.mean(preds['full'] == labels):.2%}, draft {np.mean(preds['draft'] == labels):.2%}")
+
+
+def bench_export(args):
+    torch.set_num_threads(args.num_workers)
+    module, config = load_exported(args.model_file)
+    weights = args.weights or (os.path.join(args.model_dir, 'best.pth') if args.model_dir else None)
+    net = build_model(config["module"], config["model"], config["model_kwargs"], weights)
+
+    for name, result in check_parity(net, module, config).items():
+        print(f"[parity] {name}: max abs diff {result['max_abs_diff']:.2e}, argmax agreement {result['argmax_agreement']:.2%}")
+    benchmark(net, module, config, args.batch_sizes, repeats=args.num_batches)
+
+
+def parse_size(size):
+    """ "128x96" -> (128, 96) """
+    height, width = size.split("x")
+    return int(height), int(width)
+
+
+def time_call(fn, repeats=1):
+    """ fn() 한 번의 평균 ms """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def suite_dataset(data_dir):
+    # warm : data_dir 의 manifest 재사용, cold : 임시 경로에 manifest 를 새로 만드는 tree scan (data_dir 의 manifest 는 그대로 둡니다)
+    dataset = MaskBaseDataset(data_dir=data_dir)
+    work_dir = tempfile.mkdtemp(prefix="bench_manifest_")
+    try:
+        manifest_path = os.path.join(work_dir, MANIFEST_FILE)
+        cold_ms = time_call(lambda: dataset.set_rows(build_manifest(data_dir, dataset._file_names, manifest_path)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return dataset, {"dataset/setup": {"images": len(dataset), "cold_ms": cold_ms, "warm_ms": time_call(dataset.setup, 3)}}
+
+
+def suite_getitem(dataset, args):
+    results = {}
+    dataset_module = import_module("dataset")
+    indices = np.random.RandomState(0).permutation(len(dataset))[:args.num_images]
+    for name, cls in inspect.getmembers(dataset_module, inspect.isclass):
+        if not name.endswith("Augmentation") or cls.__module__ != dataset_module.__name__:
+            continue
+        for size in args.resizes:
+            dataset.set_transform(cls(resize=parse_size(size), mean=dataset.mean, std=dataset.std))
+            elapsed = time_call(lambda: [dataset[index] for index in indices])
+            results[f"getitem/{name}/{size}"] = {"ms_per_image": elapsed / len(indices)}
+    return results
+
+
+def suite_loader(dataset, args):
+    results = {}
+    device = torch.device("cpu")
+    dataset.set_transform(BaseAugmentation(parse_size(args.resizes[0]), dataset.mean, dataset.std))
+    normalize = BatchNormalize(dataset.mean, dataset.std, device=device)
+    for num_workers in args.worker_counts:
+        loader_args = argparse.Namespace(**{**vars(args), "num_workers": num_workers})
+        result = time_loader(dataset, normalize, device, loader_args)
+        results[f"loader/workers_{num_workers}"] = {"images": result["images"], "images_per_sec": result["images_per_sec"]}
+    return results
+
+
+def suite_models(args):
+    results = {}
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model_module = import_module("model")
+    for name, cls in inspect.getmembers(model_module, inspect.isclass):
+        if not issubclass(cls, torch.nn.Module) or cls.__module__ != model_module.__name__:
+            continue
+        for size in args.resizes:
+            key = f"model/{name}/{size}"
+            try:
+                model = cls(num_classes=MaskBaseDataset.num_classes).to(device)
+                images = torch.randn(args.model_batch_size, 3, *parse_size(size), device=device)
+                labels = torch.randint(MaskBaseDataset.num_classes, (args.model_batch_size,), device=device)
+                optimizer = torch.optim.SGD(model.parameters(), lr=1e-3)
+
+                def train_step():
+                    optimizer.zero_grad()
+                    torch.nn.functional.cross_entropy(model(images), labels).backward()
+                    optimizer.step()
+                    if device.type == "cuda":
+                        torch.cuda.synchronize()
+
+                model.train()
+                train_step()  # warm up
+                train_ms = time_call(train_step, args.repeats)
+                model.eval()
+                forward_ms = time_model(model, images, repeats=args.repeats, warmup=1)
+            except Exception as e:
+                # e.g. parameter 가 없는 model template
+                results[key] = {"error": f"{type(e).__name__}: {e}"}
+                continue
+            results[key] = {
+                "batch_size": args.model_batch_size,
+                "train_step_ms": train_ms,
+                "forward_ms": forward_ms,
+                "train_images_per_sec": args.model_batch_size / train_ms * 1000,
+            }
+    return results
+
+
+def suite_inference(eval_dir, args):
+    import inference
+
+    work_dir = tempfile.mkdtemp(prefix="bench_inference_")
+    try:
+        model_dir, output_dir = os.path.join(work_dir, "model"), os.path.join(work_dir, "output")
+        os.makedirs(model_dir)
+        os.makedirs(output_dir)
+        model = getattr(import_module("model"), args.model)(num_classes=MaskBaseDataset.num_classes)
+        torch.save(model.state_dict(), os.path.join(model_dir, "best.pth"))
+
+        # inference.py 의 default 인자 그대로
+        inference_args = argparse.Namespace(
+            batch_size=args.batch_size, resize=parse_size(args.resizes[0]), model=args.model, draft_decode=False,
+            tta="orig", tta_reduce="logit_mean", uint8_transport=False, model_file=None, backend="torch",
+            onnx_threads=None,
+        )
+        num_images = len(pd.read_csv(os.path.join(eval_dir, "info.csv")))
+        elapsed = time_call(lambda: inference.inference(eval_dir, model_dir, output_dir, inference_args))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {f"inference/{args.model}": {"images": num_images, "total_ms": elapsed,
+                                        "images_per_sec": num_images / elapsed * 1000}}
+
+
+def bench_suite(args):
+    synthetic_root = None
+    data_dir, eval_dir = args.data_dir, args.eval_dir
+    if not (data_dir and eval_dir):
+        synthetic_root = tempfile.mkdtemp(prefix="bench_synthetic_")
+        data_dir, eval_dir = make_tree(synthetic_root, args.num_profiles)
+        print(f"synthetic tree : {data_dir}, {eval_dir}")
+
+    try:
+        stages = {}
+        dataset, results = suite_dataset(data_dir)
+        stages.update(results)
+        stages.update(suite_getitem(dataset, args))
+        stages.update(suite_loader(dataset, args))
+        stages.update(suite_models(args))
+        stages.update(suite_inference(eval_dir, args))
+    finally:
+        if synthetic_root:
+            shutil.rmtree(synthetic_root, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "cuda": torch.cuda.is_available(),
+            "synthetic": synthetic_root is not None,
+            "args": {k: v for k, v in vars(args).items() if k not in ("baseline", "candidate")},
+        },
+        "stages": stages,
+    }
+    for key, metrics in stages.items():
+        print(f"{key:<40}" + ", ".join(f"{k} {v:.2f}" if isinstance(v, float) else f"{k} {v}" for k, v in metrics.items()))
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=4)
+    print(f"results -> {args.output}")
+
+
+def bench_compare(args):
+    """ _ms 는 작을수록, _per_sec 은 클수록 좋은 metric 으로 보고 threshold 이상 나빠진 항목을 표시합니다. """
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["stages"]
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)["stages"]
+
+    regressions = 0
+    print(f"{'stage':<40}{'metric':<22}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        for metric, before in baseline[key].items():
+            after = candidate[key].get(metric)
+            if not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or before == 0:
+                continue
+            if metric.endswith("_ms") or metric == "ms_per_image":
+                slowdown = after / before - 1
+            elif metric.endswith("_per_sec"):
+                slowdown = before / after - 1 if after else float("inf")
+            else:
+                continue
+            flag = ""
+            if slowdown > args.threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{key:<40}{metric:<22}{before:>12.2f}{after:>12.2f}{slowdown:>+9.1%}{flag}")
+    for key in sorted(baseline.keys() ^ candidate.keys()):
+        print(f"{key:<40}only in {'baseline' if key in baseline else 'candidate'}")
+
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('target', choices=['transport', 'draft', 'export', 'suite', 'compare'], help='benchmark to run')
+    parser.add_argument('--resize', nargs=2, type=int, default=[128, 96], help='resize size (default: 128 96)')
+    parser.add_argument('--batch_size', type=int, default=64, help='loader batch size (default: 64)')
+    parser.add_argument('--num_workers', type=int, default=4, help='loader workers (default: 4)')
+    parser.add_argument('--num_batches', type=int, default=50, help='batches to time per run (default: 50)')
+    parser.add_argument('--num_images', type=int, default=500, help='images to decode for draft (default: 500)')
+    parser.add_argument('--model', type=str, default='BaseModel', help='model type for draft parity (default: BaseModel)')
+    parser.add_argument('--model_file', type=str, default=None, help='export.py artifact for export (e.g. ./model/exp/model.ts)')
+    parser.add_argument('--weights', type=str, default=None, help='eager state_dict for export (default: {model_dir}/best.pth)')
+    parser.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 8, 32], help='batch sizes for export (default: 1 8 32)')
+    parser.add_argument('--resizes', nargs='+', default=['128x96', '512x384'], help='HxW sizes for suite (default: 128x96 512x384)')
+    parser.add_argument('--worker_counts', nargs='+', type=int, default=[0, 2, 4, 8], help='loader workers for suite (default: 0 2 4 8)')
+    parser.add_argument('--model_batch_size', type=int, default=8, help='batch size for suite model timing (default: 8)')
+    parser.add_argument('--repeats', type=int, default=3, help='timed repeats per suite model (default: 3)')
+    parser.add_argument('--num_profiles', type=int, default=20, help='synthetic train profiles for suite (default: 20)')
+    parser.add_argument('--output', type=str, default='./benchmark.json', help='suite result json (default: ./benchmark.json)')
+    parser.add_argument('--baseline', type=str, default=None, help='suite result json to compare against')
+    parser.add_argument('--candidate', type=str, default=None, help='suite result json to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown to flag as regression (default: 0.1)')
+
+    # Container environment
+    parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN'))
+    parser.add_argument('--eval_dir', type=str, default=os.environ.get('SM_CHANNEL_EVAL'))
+    parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_CHANNEL_MODEL'))
+
+    args = parser.parse_args()
+    print(args)
+
+    {
+        'transport': bench_transport,
+        'draft': bench_draft,
+        'export': bench_export,
+        'suite': bench_suite,
+        'compare': bench_compare,
+    }[args.target](args)
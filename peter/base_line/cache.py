@@ -0,0 +1,137 @@
+import fcntl
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+from torchvision.transforms import Resize
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def source_fingerprint(image_paths, *extra):
+    """
+    이미지 경로, 파일 크기, 수정 시각(mtime) 으로 만든 데이터셋 지문(sha1) 을 반환합니다.
+    파일이 추가/삭제/수정되면 지문이 바뀌므로 캐시 무효화 key 로 사용합니다.
+    """
+    digest = hashlib.sha1()
+    for item in extra:
+        digest.update(f"{item}\n".encode())
+    for path, size, mtime in map(file_signature, image_paths):
+        digest.update(f"{path}\0{size}\0{mtime}\n".encode())
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(lock_path):
+    """ 같은 캐시를 동시에 만드는 여러 run 사이의 exclusive lock (POSIX flock) """
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write_json(path, obj):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+def input_size(transform, image_path):
+    """
+    transform 출력을 바꾸지 않고 이미지를 미리 줄여 둘 수 있는 (height, width) 입니다.
+    transform 이 (height, width) Resize 로 시작하면 그 크기, 아니면 (e.g. CenterCrop 을 먼저 하는 augmentation) 원본 크기입니다.
+    """
+    steps = getattr(getattr(transform, "transform", transform), "transforms", ())
+    if steps and isinstance(steps[0], Resize) and isinstance(steps[0].size, (list, tuple)) and len(steps[0].size) == 2:
+        return tuple(steps[0].size)
+    with Image.open(image_path) as image:
+        return image.height, image.width
+
+
+class ImageCache:
+    """
+    모든 이미지를 지정한 해상도로 한 번만 decode 하여 uint8 NHWC `.npy` 하나에 저장하고
+    이후에는 memmap 의 slice 만 읽어 decode 없이 PIL 이미지를 돌려줍니다.
+
+    - index(json) 는 image path -> row 를 가지며, 파일 이름에 (path, size, mtime) 지문이 들어가므로
+      원본 트리가 바뀌면 자동으로 새 캐시를 만듭니다.
+    - 생성은 flock 으로 직렬화하고 임시 파일에 쓴 뒤 os.replace 하므로 동시에 실행된 run 끼리 안전합니다.
+    - memmap 은 프로세스마다 lazy 하게 열기 때문에 DataLoader worker 사이에서 공유해도 안전합니다.
+    """
+
+    def __init__(self, cache_dir, image_paths, size, num_workers=8):
+        self.cache_dir = cache_dir
+        self.size = tuple(int(s) for s in size)  # (height, width)
+        self.num_workers = num_workers
+
+        os.makedirs(cache_dir, exist_ok=True)
+        key = source_fingerprint(sorted(image_paths), *self.size)[:16]
+        name = f"images_{self.size[0]}x{self.size[1]}_{key}"
+        self.array_path = os.path.join(cache_dir, f"{name}.npy")
+        self.index_path = os.path.join(cache_dir, f"{name}.json")
+        self.lock_path = os.path.join(cache_dir, f"{name}.lock")
+
+        if not os.path.exists(self.index_path):
+            with file_lock(self.lock_path):
+                if not os.path.exists(self.index_path):  # 기다리는 동안 다른 run 이 만들었을 수 있습니다
+                    self.build(sorted(image_paths))
+
+        with open(self.index_path, encoding="utf-8") as f:
+            self.index = json.load(f)["rows"]
+        self._array = None
+
+    def build(self, image_paths):
+        print(f"[Cache] decoding {len(image_paths)} images at {self.size} into {self.array_path}")
+        height, width = self.size
+        tmp_path = f"{self.array_path}.tmp.{os.getpid()}.npy"
+        array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                          shape=(len(image_paths), height, width, 3))
+
+        def decode(row):
+            image = Image.open(image_paths[row]).convert("RGB")
+            if image.size != (width, height):
+                image = image.resize((width, height), Image.BILINEAR)
+            array[row] = np.asarray(image)
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            list(executor.map(decode, range(len(image_paths))))
+        array.flush()
+        del array
+
+        os.replace(tmp_path, self.array_path)
+        atomic_write_json(self.index_path, {
+            "size": list(self.size),
+            "rows": {path: row for row, path in enumerate(image_paths)},
+        })
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.load(self.array_path, mmap_mode="r")
+        return self._array
+
+    def __contains__(self, image_path):
+        return image_path in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, image_path):
+        return Image.fromarray(np.array(self.array[self.index[image_path]]))
+
+    def __getstate__(self):
+        # fork / pickle 될 때 memmap 핸들은 넘기지 않고 worker 에서 다시 엽니다
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
+
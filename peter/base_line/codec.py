@@ -0,0 +1,71 @@
+"""
+mask / gender / age label 과 18 class label 사이의 변환을 모아둔 모듈입니다.
+
+모든 함수는 python int, numpy array, torch tensor 를 그대로 받아 같은 종류로 돌려주며,
+원소별 python loop 없이 lookup table indexing / bucketize 한 번으로 계산합니다.
+torch tensor 의 lookup table 은 device 별로 한 번만 만들어 재사용합니다.
+"""
+from functools import lru_cache
+
+import numpy as np
+import torch
+
+NUM_MASK_CLASSES = 3
+NUM_GENDER_CLASSES = 2
+NUM_AGE_CLASSES = 3
+NUM_CLASSES = NUM_MASK_CLASSES * NUM_GENDER_CLASSES * NUM_AGE_CLASSES
+
+AGE_BINS = (30, 60)                                # ~29 / 30~59 / 60~
+TEN_AGE_BINS = (21, 25, 30, 35, 40, 45, 50, 55, 60)  # ~20 / 21~24 / 25~29 / ... / 55~59 / 60~
+TEN_TO_THREE = (0, 0, 0, 1, 1, 1, 1, 1, 1, 2)        # ten age class -> age class
+
+# multi class label -> (mask, gender, age)
+DECODE_TABLE = np.array(
+    [[label // 6 % 3, label // 3 % 2, label % 3] for label in range(NUM_CLASSES)], dtype=np.int64
+)
+
+_TABLES = {
+    "age_bins": AGE_BINS,
+    "ten_age_bins": TEN_AGE_BINS,
+    "ten_to_three": TEN_TO_THREE,
+    "decode": DECODE_TABLE,
+}
+
+
+@lru_cache(maxsize=None)
+def _torch_table(name, device):
+    return torch.as_tensor(np.asarray(_TABLES[name]), dtype=torch.int64, device=device)
+
+
+def _table(name, like):
+    if isinstance(like, torch.Tensor):
+        return _torch_table(name, like.device)
+    return np.asarray(_TABLES[name])
+
+
+def _lookup(name, index):
+    if isinstance(index, torch.Tensor):
+        return _table(name, index)[index.long()]
+    return _table(name, index)[np.asarray(index, dtype=np.int64)]
+
+
+def encode_multi_class(mask_label, gender_label, age_label):
+    return mask_label * 6 + gender_label * 3 + age_label
+
+
+def decode_multi_class(multi_class_label):
+    """ 18 class label -> (mask, gender, age). 입력과 같은 shape 의 값 세 개를 돌려줍니다. """
+    decoded = _lookup("decode", multi_class_label)
+    return decoded[..., 0], decoded[..., 1], decoded[..., 2]
+
+
+def bucketize(ages, bins="age_bins"):
+    """ 나이를 구간 label 로 바꿉니다. bins 는 "age_bins" (3 class) 또는 "ten_age_bins" (10 class) """
+    if isinstance(ages, torch.Tensor):
+        return torch.bucketize(ages, _table(bins, ages).to(ages.dtype), right=True)
+    return np.digitize(ages, _TABLES[bins])
+
+
+def ten_to_three(age_label):
+    """ 10 class age label (TEN_AGE_BINS) -> 3 class age label (AGE_BINS) """
+    return _lookup("ten_to_three", age_label)
@@ -11,6 +11,11 @@ from torch.utils.data import Dataset, Subset, random_split
 from torchvision import transforms
 from torchvision.transforms import *
 
+import codec
+from cache import ImageCache, input_size
+from manifest import PackedPaths, build_manifest
+from stats import STATISTICS_FILE, compute_statistics
+
 IMG_EXTENSIONS = [
     ".jpg", ".JPG", ".jpeg", ".JPEG", ".png",
     ".PNG", ".ppm", ".PPM", ".bmp", ".BMP",
@@ -21,13 +26,65 @@ def is_image_file(filename):
     return any(filename.endswith(extension) for extension in IMG_EXTENSIONS)
 
 
+def open_image(image_path, size=None):
+    """
+    이미지를 엽니다. `size` (height, width) 가 원본의 절반 이하인 JPEG 은 draft mode 로
+    DCT 단계에서 1/2, 1/4, 1/8 로 줄여 decode 합니다. 정확한 크기로의 resize 는 transform 의 Resize 가 합니다.
+    """
+    image = Image.open(image_path)
+    if size is None or image.format != "JPEG":
+        return image
+
+    height, width = size
+    if height * 2 > image.height or width * 2 > image.width:
+        return image
+    image.draft("RGB", (width, height))  # 요청 크기 이상이 되는 가장 작은 scale 을 고릅니다
+    return image
+
+
+class ToUint8Tensor(object):
+    """
+        PIL 이미지를 float 변환 / normalize 없이 uint8 CHW tensor 로 바꿉니다.
+        worker -> main process queue 로 넘어가는 byte 수가 float32 대비 1/4 이 됩니다.
+    """
+
+    def __call__(self, image):
+        return torch.from_numpy(np.array(image.convert("RGB"), dtype=np.uint8)).permute(2, 0, 1).contiguous()
+
+    def __repr__(self):
+        return self.__class__.__name__ + '()'
+
+
+class BatchNormalize(object):
+    """
+        collate 된 uint8 batch 전체를 한 번에 float 변환 + mean / std normalize 합니다.
+        (x / 255 - mean) / std == (x - 255 * mean) / (255 * std)
+        float batch 가 들어오면 (이미 worker 에서 normalize 된 경우) 그대로 돌려줍니다.
+    """
+
+    def __init__(self, mean, std, device="cpu"):
+        self.mean = torch.tensor(mean, dtype=torch.float32, device=device).view(1, -1, 1, 1) * 255
+        self.std = torch.tensor(std, dtype=torch.float32, device=device).view(1, -1, 1, 1) * 255
+
+    def __call__(self, images):
+        if images.dtype != torch.uint8:
+            return images
+        return images.float().sub_(self.mean).div_(self.std)
+
+
 class BaseAugmentation:
-    def __init__(self, resize, mean, std, **args):
-        self.transform = transforms.Compose([
-            Resize(resize, Image.BILINEAR),
-            ToTensor(),
-            Normalize(mean=mean, std=std),
-        ])
+    def __init__(self, resize, mean, std, uint8=False, **args):
+        if uint8:
+            self.transform = transforms.Compose([
+                Resize(resize, Image.BILINEAR),
+                ToUint8Tensor(),
+            ])
+        else:
+            self.transform = transforms.Compose([
+                Resize(resize, Image.BILINEAR),
+                ToTensor(),
+                Normalize(mean=mean, std=std),
+            ])
 
     def __call__(self, image):
         return self.transform(image)
@@ -98,12 +155,11 @@ class AgeLabels(int, Enum):
         except Exception:
             raise ValueError(f"Age value should be numeric, {value}")
 
-        if value < 30:
-            return cls.YOUNG
-        elif value < 60:
-            return cls.MIDDLE
-        else:
-            return cls.OLD
+        return cls(int(codec.bucketize(value, "age_bins")))
+
+    @classmethod
+    def from_numbers(cls, values: np.ndarray) -> np.ndarray:
+        return codec.bucketize(values, "age_bins").astype(np.int8)
 
 
 class MaskBaseDataset(Dataset):
@@ -119,10 +175,7 @@ class MaskBaseDataset(Dataset):
         "normal": MaskLabels.NORMAL
     }
 
-    image_paths = []
-    mask_labels = []
-    gender_labels = []
-    age_labels = []
+    cache = None
 
     def __init__(self, data_dir, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), val_ratio=0.2):
         self.data_dir = data_dir
@@ -131,54 +184,51 @@ class MaskBaseDataset(Dataset):
         self.val_ratio = val_ratio
 
         self.transform = None
+        self.decode_size = None  # (height, width) 를 주면 JPEG draft mode 로 decode 합니다
         self.setup()
         self.calc_statistics()
 
-    def setup(self):
-        profiles = os.listdir(self.data_dir)
-        for profile in profiles:
-            if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
-                continue
+    def load_manifest(self):
+        """ data_dir 의 manifest 를 읽습니다. 새로 생기거나 바뀐 profile 폴더만 다시 scan 합니다. """
+        return build_manifest(self.data_dir, self._file_names)
 
-            img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
-                _file_name, ext = os.path.splitext(file_name)
-                if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
-                    continue
-
-                img_path = os.path.join(self.data_dir, profile, file_name)  # (resized_data, 000004_male_Asian_54, mask1.jpg)
-                mask_label = self._file_names[_file_name]
-
-                id, gender, race, age = profile.split("_")
-                gender_label = GenderLabels.from_str(gender)
-                age_label = AgeLabels.from_number(age)
+    def set_rows(self, manifest, rows=slice(None)):
+        """
+        manifest 의 `rows` 를 instance 단위 numpy column 으로 저장합니다.
+        (int8 label, int32 group id, 하나로 묶은 path buffer) - 여러 번 생성해도 row 가 중복되지 않습니다.
+        """
+        self.image_paths = PackedPaths(manifest["path"][rows], prefix=self.data_dir)
+        self.mask_labels = manifest["mask"][rows]
+        self.gender_labels = manifest["gender"][rows]
+        self.age_labels = AgeLabels.from_numbers(manifest["age"][rows])
+        self.class_labels = manifest["label"][rows]
+        self.groups = np.unique(manifest["profile_id"][rows], return_inverse=True)[1].astype(np.int32)
 
-                self.image_paths.append(img_path)
-                self.mask_labels.append(mask_label)
-                self.gender_labels.append(gender_label)
-                self.age_labels.append(age_label)
+    def setup(self):
+        self.set_rows(self.load_manifest())
 
     def calc_statistics(self):
         has_statistics = self.mean is not None and self.std is not None
         if not has_statistics:
             print("[Warning] Calculating statistics... It can take a long time depending on your CPU machine")
-            sums = []
-            squared = []
-            for image_path in self.image_paths[:3000]:
-                image = np.array(Image.open(image_path)).astype(np.int32)
-                sums.append(image.mean(axis=(0, 1)))
-                squared.append((image ** 2).mean(axis=(0, 1)))
-
-            self.mean = np.mean(sums, axis=0) / 255
-            self.std = (np.mean(squared, axis=0) - self.mean ** 2) ** 0.5 / 255
+            cache_path = os.path.join(self.data_dir, STATISTICS_FILE)
+            self.mean, self.std = compute_statistics(self.image_paths, cache_path=cache_path)
 
     def set_transform(self, transform):
         self.transform = transform
 
+    def enable_cache(self, cache_dir):
+        """
+        이미지를 transform 결과가 같은 크기 (`input_size`) 로 한 번만 decode 해 memmap 캐시에 저장하고,
+        이후 `read_image` 는 JPEG decode 없이 캐시에서 읽습니다. (opt-in, set_transform 뒤에 부릅니다)
+        """
+        assert self.transform is not None, "enable_cache 전에 .set_transform 으로 transform 을 주입해주세요"
+        self.cache = ImageCache(cache_dir, self.image_paths, input_size(self.transform, self.image_paths[0]))
+
     def __getitem__(self, index):
         assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
 
-        image = self.read_image(index)
+        image = self.read_image(index, self.decode_size)
         mask_label = self.get_mask_label(index)
         gender_label = self.get_gender_label(index)
         age_label = self.get_age_label(index)
@@ -191,28 +241,27 @@ class MaskBaseDataset(Dataset):
         return len(self.image_paths)
 
     def get_mask_label(self, index) -> MaskLabels:
-        return self.mask_labels[index]
+        return int(self.mask_labels[index])
 
     def get_gender_label(self, index) -> GenderLabels:
-        return self.gender_labels[index]
+        return int(self.gender_labels[index])
 
     def get_age_label(self, index) -> AgeLabels:
-        return self.age_labels[index]
+        return int(self.age_labels[index])
 
-    def read_image(self, index):
+    def read_image(self, index, size=None):
         image_path = self.image_paths[index]
-        return Image.open(image_path)
+        if self.cache is not None:
+            return self.cache.read(image_path)
+        return open_image(image_path, size)
 
     @staticmethod
     def encode_multi_class(mask_label, gender_label, age_label) -> int:
-        return mask_label * 6 + gender_label * 3 + age_label
+        return codec.encode_multi_class(mask_label, gender_label, age_label)
 
     @staticmethod
     def decode_multi_class(multi_class_label) -> Tuple[MaskLabels, GenderLabels, AgeLabels]:
-        mask_label = (multi_class_label // 6) % 3
-        gender_label = (multi_class_label // 3) % 2
-        age_label = multi_class_label % 3
-        return mask_label, gender_label, age_label
+        return codec.decode_multi_class(multi_class_label)
 
     @staticmethod
     def denormalize_image(image, mean, std):
@@ -261,50 +310,47 @@ class MaskSplitByProfileDataset(MaskBaseDataset):
         }
 
     def setup(self):
-        profiles = os.listdir(self.data_dir)
-        profiles = [profile for profile in profiles if not profile.startswith(".")]
+        manifest = self.load_manifest()
+        profiles = manifest["folders"]
+        profile_index = np.repeat(np.arange(len(profiles)), np.diff(manifest["folder_offsets"]))
         split_profiles = self._split_profile(profiles, self.val_ratio)
 
+        phase_rows = {
+            phase: np.flatnonzero(np.isin(profile_index, list(indices)))
+            for phase, indices in split_profiles.items()
+        }
+        self.set_rows(manifest, np.concatenate(list(phase_rows.values())))
+
         cnt = 0
-        for phase, indices in split_profiles.items():
-            for _idx in indices:
-                profile = profiles[_idx]
-                img_folder = os.path.join(self.data_dir, profile)
-                for file_name in os.listdir(img_folder):
-                    _file_name, ext = os.path.splitext(file_name)
-                    if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
-                        continue
-
-                    img_path = os.path.join(self.data_dir, profile, file_name)  # (resized_data, 000004_male_Asian_54, mask1.jpg)
-                    mask_label = self._file_names[_file_name]
-
-                    id, gender, race, age = profile.split("_")
-                    gender_label = GenderLabels.from_str(gender)
-                    age_label = AgeLabels.from_number(age)
-
-                    self.image_paths.append(img_path)
-                    self.mask_labels.append(mask_label)
-                    self.gender_labels.append(gender_label)
-                    self.age_labels.append(age_label)
-
-                    self.indices[phase].append(cnt)
-                    cnt += 1
+        for phase, rows in phase_rows.items():
+            self.indices[phase] = np.arange(cnt, cnt + len(rows))
+            cnt += len(rows)
 
     def split_dataset(self) -> List[Subset]:
         return [Subset(self, indices) for phase, indices in self.indices.items()]
 
 
 class TestDataset(Dataset):
-    def __init__(self, img_paths, resize, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246)):
+    def __init__(self, img_paths, resize, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), uint8=False,
+                 draft=False):
         self.img_paths = img_paths
-        self.transform = transforms.Compose([
-            Resize(resize, Image.BILINEAR),
-            ToTensor(),
-            Normalize(mean=mean, std=std),
-        ])
+        self.mean = mean
+        self.std = std
+        self.decode_size = tuple(resize) if draft else None
+        if uint8:
+            self.transform = transforms.Compose([
+                Resize(resize, Image.BILINEAR),
+                ToUint8Tensor(),
+            ])
+        else:
+            self.transform = transforms.Compose([
+                Resize(resize, Image.BILINEAR),
+                ToTensor(),
+                Normalize(mean=mean, std=std),
+            ])
 
     def __getitem__(self, index):
-        image = Image.open(self.img_paths[index])
+        image = open_image(self.img_paths[index], self.decode_size)
 
         if self.transform:
             image = self.transform(image)
@@ -0,0 +1,238 @@
+"""
+학습한 model 을 TorchScript artifact 하나로 export 해 model class 없이 CPU inference 할 수 있게 만드는 모듈입니다.
+
+`--module` (default: model) 의 `--model` class 를 만들어 state_dict 를 읽고 example 입력으로 trace 한 뒤
+(`--method script` 면 script), `torch.jit.freeze` 로 weight 를 상수로 접고 `torch.jit.optimize_for_inference` 로
+conv-bn fold 등 CPU inference 용 최적화를 합니다. 전처리 설정 (resize, mean, std, num_classes, ...) 은 artifact 안의
+config.json 으로 같이 저장되어 `load_exported` 한 번으로 model 과 설정을 함께 읽습니다.
+
+export 직후 같은 입력에 대한 eager / export model 의 출력 차이를 확인하고 (parity), batch 크기별 latency 를 비교합니다.
+
+`--format onnx` 면 batch 축이 dynamic 한 ONNX 로 export 하고, `OnnxModel` 이 onnxruntime CPU execution provider 로
+실행합니다 (intra-op thread 수는 주지 않으면 몇 가지를 재 보고 가장 빠른 것으로 고릅니다).
+inference.py / fold ensemble 의 `--backend onnxruntime` 은 `onnx_backend` 로 export -> parity 확인 -> 실행을 합니다.
+
+e.g. python export.py --model BaseModel --weights ./model/exp/best.pth --resize 96 128 --output ./model/exp/model.ts
+     python export.py --module Models --model MobileNet --weights best.pth --output mobilenet.ts
+     python export.py --module dataset --model ResNet --model_kwargs "num_blocks=[2,2,2,2]" --resize 350 250 --weights best.pth
+     python export.py --model BaseModel --weights ./model/exp/best.pth --format onnx --output ./model/exp/model.onnx
+"""
+import argparse
+import copy
+import inspect
+import json
+import os
+import time
+from importlib import import_module
+
+import torch
+
+CONFIG_NAME = "config.json"
+
+
+def build_model(module, model, model_kwargs, weights=None):
+    """ eager model. weights 는 state_dict (또는 torch.save(model) 로 통째로 저장한 module) 파일입니다. """
+    cls = getattr(import_module(module), model)
+    if weights and "pretrained" in inspect.signature(cls).parameters:
+        # 학습한 weight 로 덮어쓰므로 ImageNet weight 는 읽지 않습니다 (local weight 가 없는 serving 환경)
+        model_kwargs = {"pretrained": False, **model_kwargs}
+    net = cls(**model_kwargs)
+    if weights:
+        state = torch.load(weights, map_location="cpu")
+        net.load_state_dict(state if isinstance(state, dict) else state.state_dict())
+    return net.eval()
+
+
+def export(net, config, method="trace"):
+    """ eager model -> frozen / optimized ScriptModule """
+    with torch.no_grad():
+        if method == "trace":
+            # dict 를 돌려주는 multi-head model 도 trace 할 수 있도록 strict=False
+            module = torch.jit.trace(net, torch.randn(1, 3, *config["resize"]), strict=False)
+        else:
+            module = torch.jit.script(net)
+        module = torch.jit.freeze(module.eval())
+        return torch.jit.optimize_for_inference(module)
+
+
+def save_exported(module, config, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.jit.save(module, path, _extra_files={CONFIG_NAME: json.dumps(config)})
+
+
+def load_exported(path, device="cpu"):
+    """ artifact -> (ScriptModule, 전처리 config) """
+    extra_files = {CONFIG_NAME: ""}
+    module = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+    return module.eval(), json.loads(extra_files[CONFIG_NAME])
+
+
+def export_onnx(net, path, input_size, opset=13):
+    """ eager model -> batch 축이 dynamic 한 ONNX. net 은 그대로 두고 CPU 복사본을 export 해 돌려줍니다. """
+    net = copy.deepcopy(net).cpu().eval()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            net, torch.randn(1, 3, *input_size), path, opset_version=opset,
+            input_names=["images"], output_names=["logits"],
+            dynamic_axes={"images": {0: "batch"}, "logits": {0: "batch"}},
+        )
+    return net
+
+
+class OnnxModel:
+    """
+    ONNX model 을 onnxruntime CPU execution provider 로 실행하는 callable 입니다.
+    torch tensor 를 받아 torch tensor 를 돌려주므로 eager model 자리 (TTA, inference loop) 에 그대로 씁니다.
+    """
+
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort  # --backend onnxruntime / --format onnx 에서만 필요한 optional dependency
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or os.cpu_count()
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.threads = options.intra_op_num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @classmethod
+    def tuned(cls, path, images, candidates=None):
+        """ intra-op thread 수별로 `images` forward 시간을 재서 가장 빠른 session 을 돌려줍니다. """
+        cpu_count = os.cpu_count() or 1
+        candidates = candidates or sorted({1, 2, 4, 8, 16, cpu_count // 2 or 1, cpu_count} & set(range(1, cpu_count + 1)))
+        timings = {threads: time_model(cls(path, threads), images, repeats=3, warmup=1) for threads in candidates}
+        best = min(timings, key=timings.get)
+        print("onnxruntime intra-op threads : " + ", ".join(
+            f"{threads}{'*' if threads == best else ''} {ms:.1f}ms" for threads, ms in timings.items()))
+        return cls(path, best)
+
+    def __call__(self, images):
+        outputs = self.session.run(None, {self.input_name: images.detach().cpu().float().contiguous().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+
+def onnx_backend(net, path, input_size, threads=None, tune_batch_size=32):
+    """ net 을 path 로 ONNX export 하고 PyTorch 출력과 parity 를 확인한 OnnxModel (threads 가 없으면 tune) """
+    cpu_net = export_onnx(net, path, input_size)
+    if threads:
+        model = OnnxModel(path, threads)
+    else:
+        model = OnnxModel.tuned(path, torch.randn(tune_batch_size, 3, *input_size))
+    for name, result in check_parity(cpu_net, model, {"resize": list(input_size)}).items():
+        print(f"[onnx parity] {name}: max abs diff {result['max_abs_diff']:.2e}, "
+              f"argmax agreement {result['argmax_agreement']:.2%}")
+    return model
+
+
+def _outputs(outputs):
+    return outputs if isinstance(outputs, dict) else {"output": outputs}
+
+
+@torch.no_grad()
+def check_parity(net, module, config, batch_size=8, atol=1e-3, rtol=1e-3):
+    """ 같은 random 입력에서 eager / export 출력의 최대 차이와 argmax 일치율. 허용 오차를 넘으면 AssertionError """
+    images = torch.randn(batch_size, 3, *config["resize"])
+    expected, actual = _outputs(net(images)), _outputs(module(images))
+    result = {}
+    for name, value in expected.items():
+        max_diff = (value - actual[name]).abs().max().item()
+        agreement = (value.argmax(dim=-1) == actual[name].argmax(dim=-1)).float().mean().item()
+        assert max_diff <= atol + rtol * value.abs().max().item(), f"{name}: max abs diff {max_diff:.2e}"
+        result[name] = {"max_abs_diff": max_diff, "argmax_agreement": agreement}
+    return result
+
+
+@torch.no_grad()
+def time_model(net, images, repeats=10, warmup=2):
+    """ forward 한 번의 평균 ms """
+    for _ in range(warmup):
+        net(images)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        net(images)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def benchmark(net, module, config, batch_sizes=(1, 8, 32), repeats=10):
+    print(f"{'batch':>6}{'eager ms':>12}{'export ms':>12}{'speedup':>10}")
+    rows = []
+    for batch_size in batch_sizes:
+        images = torch.randn(batch_size, 3, *config["resize"])
+        eager_ms, export_ms = time_model(net, images, repeats), time_model(module, images, repeats)
+        print(f"{batch_size:>6}{eager_ms:>12.2f}{export_ms:>12.2f}{eager_ms / export_ms:>9.2f}x")
+        rows.append({"batch_size": batch_size, "eager_ms": eager_ms, "export_ms": export_ms})
+    return rows
+
+
+def parse_kwargs(items):
+    """ ["version=18", "num_blocks=[2,2,2,2]", "backbone=resnet18"] -> {"version": 18, "num_blocks": [2, 2, 2, 2], ...} """
+    kwargs = {}
+    for item in items:
+        key, value = item.split("=", 1)
+        try:
+            value = json.loads(value)  # 숫자, list, true / false
+        except ValueError:
+            pass  # 그 외는 문자열
+        kwargs[key] = value
+    return kwargs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', type=str, default='model', help='python module defining the model (default: model)')
+    parser.add_argument('--model', type=str, default='BaseModel', help='model type (default: BaseModel)')
+    parser.add_argument('--model_kwargs', nargs='*', default=[], metavar='KEY=VALUE',
+                        help='extra model constructor arguments, e.g. version=18')
+    parser.add_argument('--num_classes', type=int, default=18)
+    parser.add_argument('--weights', type=str, default=None, help='trained state_dict (e.g. ./model/exp/best.pth)')
+    parser.add_argument('--resize', nargs=2, type=int, default=[96, 128], help='input size (default: 96 128)')
+    parser.add_argument('--mean', nargs=3, type=float, default=[0.548, 0.504, 0.479])
+    parser.add_argument('--std', nargs=3, type=float, default=[0.237, 0.247, 0.246])
+    parser.add_argument('--method', type=str, default='trace', choices=['trace', 'script'])
+    parser.add_argument('--format', type=str, default='torchscript', choices=['torchscript', 'onnx'])
+    parser.add_argument('--onnx_threads', type=int, default=None, help='onnxruntime intra-op threads (default: tune)')
+    parser.add_argument('--output', type=str, default='./model/model.ts')
+    parser.add_argument('--batch_sizes', nargs='*', type=int, default=[1, 8, 32],
+                        help='batch sizes for the eager vs export latency table (default: 1 8 32, none to skip)')
+    parser.add_argument('--threads', type=int, default=None, help='torch CPU threads (default: torch default)')
+
+    args = parser.parse_args()
+    print(args)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    config = {
+        "module": args.module,
+        "model": args.model,
+        "model_kwargs": {"num_classes": args.num_classes, **parse_kwargs(args.model_kwargs)},
+        "num_classes": args.num_classes,
+        "resize": args.resize,
+        "mean": args.mean,
+        "std": args.std,
+        "method": args.method,
+    }
+    net = build_model(args.module, args.model, config["model_kwargs"], args.weights)
+    if args.format == 'onnx':
+        # ONNX 는 전처리 설정을 옆의 .json 에 저장하고, onnx_backend 가 export 뒤 parity 를 확인합니다
+        module = onnx_backend(net, args.output, args.resize, args.onnx_threads)
+        with open(f"{os.path.splitext(args.output)[0]}.json", 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=4)
+        print(f"exported {args.model} -> {args.output} (onnxruntime, {module.threads} threads)")
+    else:
+        save_exported(export(net, config, args.method), config, args.output)
+        print(f"exported {args.model} -> {args.output}")
+
+        # 저장한 artifact 를 다시 읽어 확인합니다
+        module, config = load_exported(args.output)
+        for name, result in check_parity(net, module, config).items():
+            print(f"[parity] {name}: max abs diff {result['max_abs_diff']:.2e}, "
+                  f"argmax agreement {result['argmax_agreement']:.2%}")
+    if args.batch_sizes:
+        benchmark(net, module, config, args.batch_sizes)
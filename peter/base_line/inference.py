@@ -6,11 +6,13 @@ import pandas as pd
 import torch
 from torch.utils.data import DataLoader
 
-from dataset import TestDataset, MaskBaseDataset
+from dataset import BatchNormalize, TestDataset, MaskBaseDataset
+from export import load_exported, onnx_backend
+from tta import TTA
 
 
-def load_model(saved_model, num_classes, device):
-    model_cls = getattr(import_module("model"), args.model)
+def load_model(saved_model, num_classes, device, model_name=None):
+    model_cls = getattr(import_module("model"), model_name or args.model)
     model = model_cls(
         num_classes=num_classes
     )
@@ -33,32 +35,48 @@ def inference(data_dir, model_dir, output_dir, args):
     device = torch.device("cuda" if use_cuda else "cpu")
 
     num_classes = MaskBaseDataset.num_classes  # 18
-    model = load_model(model_dir, num_classes, device).to(device)
-    model.eval()
+    resize, preprocess = args.resize, {}
+    if args.model_file:
+        # export.py 의 TorchScript artifact : model class 없이 읽고, 전처리 설정도 artifact 의 것을 씁니다
+        device = torch.device("cpu")
+        model, config = load_exported(args.model_file, device)
+        resize, preprocess = config["resize"], {"mean": config["mean"], "std": config["std"]}
+    elif args.backend == 'onnxruntime':
+        # best.pth 를 ONNX 로 export 해 PyTorch 와 parity 를 확인하고 onnxruntime CPU 로 돌립니다
+        device = torch.device("cpu")
+        model = load_model(model_dir, num_classes, device, args.model).eval()
+        model = onnx_backend(model, os.path.join(model_dir, 'best.onnx'), resize, args.onnx_threads)
+    else:
+        model = load_model(model_dir, num_classes, device, args.model).to(device)
+        model.eval()
 
     img_root = os.path.join(data_dir, 'images')
     info_path = os.path.join(data_dir, 'info.csv')
     info = pd.read_csv(info_path)
 
     img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
+    dataset = TestDataset(img_paths, resize, **preprocess, uint8=args.uint8_transport, draft=args.draft_decode)
+    normalize = BatchNormalize(dataset.mean, dataset.std, device=device)
     loader = torch.utils.data.DataLoader(
         dataset,
         batch_size=args.batch_size,
         num_workers=8,
         shuffle=False,
-        pin_memory=use_cuda,
+        pin_memory=device.type == 'cuda',
         drop_last=False,
     )
 
     print("Calculating inference results..")
+    tta = TTA(args.tta, args.tta_reduce)
     preds = []
     with torch.no_grad():
         for idx, images in enumerate(loader):
-            images = images.to(device)
-            pred = model(images)
+            images = normalize(images.to(device))
+            pred = tta(model, images)
             pred = pred.argmax(dim=-1)
             preds.extend(pred.cpu().numpy())
+    views_per_sec, images_per_sec = tta.report()
+    print(f"{tta} : {views_per_sec:.1f} views/s, {images_per_sec:.1f} images/s")
 
     info['ans'] = preds
     info.to_csv(os.path.join(output_dir, f'output.csv'), index=False)
@@ -72,6 +90,13 @@ if __name__ == '__main__':
     parser.add_argument('--batch_size', type=int, default=1000, help='input batch size for validing (default: 1000)')
     parser.add_argument('--resize', type=tuple, default=(96, 128), help='resize size for image when you trained (default: (96, 128))')
     parser.add_argument('--model', type=str, default='BaseModel', help='model type (default: BaseModel)')
+    parser.add_argument('--draft_decode', action='store_true', help='decode JPEGs at reduced scale (draft mode) when resize <= half size')
+    parser.add_argument('--tta', type=str, default='orig', help='test time augmentation views, e.g. orig,hflip,crop:0.9 (default: orig)')
+    parser.add_argument('--tta_reduce', type=str, default='logit_mean', choices=['mean', 'max', 'logit_mean'], help='how to combine TTA views per image (default: logit_mean)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnxruntime'], help='inference backend (default: torch)')
+    parser.add_argument('--onnx_threads', type=int, default=None, help='onnxruntime intra-op threads (default: tune)')
+    parser.add_argument('--model_file', type=str, default=None, help='TorchScript artifact from export.py (CPU, ignores --model / --resize)')
+    parser.add_argument('--uint8_transport', action='store_true', help='workers return uint8 tensors, normalize once per batch on device')
 
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_EVAL', '/opt/ml/input/data/eval'))
@@ -0,0 +1,118 @@
+"""
+server.py 에 동시 요청을 보내 p50 / p99 latency 와 처리량을 재는 load generator 입니다.
+
+`--url` 을 주면 떠 있는 server 를 치고, 주지 않으면 `--max_batch_sizes` 마다 server 를 이 process 안에 (CPU) 띄워
+같은 부하로 재면서 batch 크기에 따른 latency / 처리량 표를 출력합니다.
+
+e.g. SM_CHANNEL_EVAL=[eval dir] SM_CHANNEL_MODEL=[model saved dir] python loadgen.py --max_batch_sizes 1 4 16 32
+"""
+import argparse
+import os
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+
+def load_images(eval_dir, num_images):
+    info = pd.read_csv(os.path.join(eval_dir, 'info.csv'))
+    bodies = []
+    for img_id in info.ImageID[:num_images]:
+        with open(os.path.join(eval_dir, 'images', img_id), 'rb') as f:
+            bodies.append(f.read())
+    return bodies
+
+
+def run_load(url, bodies, concurrency, num_requests):
+    """ `concurrency` 개의 client thread 가 합쳐서 `num_requests` 번 요청합니다. """
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(num_requests))
+
+    def client():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            request = urllib.request.Request(f"{url}/predict", data=bodies[index % len(bodies)], method="POST")
+            start = time.perf_counter()
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies)
+    return {
+        "requests": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "requests_per_sec": len(latencies) / elapsed,
+    }
+
+
+def serve_in_process(args, max_batch_size):
+    from server import build_server, get_parser
+
+    server_args = get_parser().parse_args([
+        '--port', '0', '--max_batch_size', str(max_batch_size), '--max_wait_ms', str(args.max_wait_ms),
+        '--resize', *map(str, args.resize), '--model', args.model, '--model_dir', args.model_dir,
+    ])
+    server = build_server(server_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def print_table(rows):
+    print(f"{'max batch':>10}{'mean batch':>12}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for max_batch_size, result in rows:
+        mean_batch = result.get("mean_batch_size", float("nan"))
+        print(f"{str(max_batch_size):>10}{mean_batch:>12.2f}{result['p50_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['requests_per_sec']:>10.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default=None, help='running server url (default: start one per batch size)')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients (default: 32)')
+    parser.add_argument('--num_requests', type=int, default=1000, help='requests per run (default: 1000)')
+    parser.add_argument('--num_images', type=int, default=200, help='eval images to cycle through (default: 200)')
+    parser.add_argument('--max_batch_sizes', nargs='+', type=int, default=[1, 4, 16, 32])
+    parser.add_argument('--max_wait_ms', type=float, default=5.)
+    parser.add_argument('--resize', nargs=2, type=int, default=[96, 128])
+    parser.add_argument('--model', type=str, default='BaseModel')
+
+    # Container environment
+    parser.add_argument('--eval_dir', type=str, default=os.environ.get('SM_CHANNEL_EVAL', '/opt/ml/input/data/eval'))
+    parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_CHANNEL_MODEL', './model'))
+
+    args = parser.parse_args()
+    print(args)
+
+    bodies = load_images(args.eval_dir, args.num_images)
+    rows = []
+    if args.url:
+        rows.append(("server", run_load(args.url, bodies, args.concurrency, args.num_requests)))
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''  # batch 크기에 따른 CPU latency 를 잽니다
+        for max_batch_size in args.max_batch_sizes:
+            server, url = serve_in_process(args, max_batch_size)
+            run_load(url, bodies, args.concurrency, min(args.num_requests, 50))  # warm up
+            server.batcher.reset()
+            result = run_load(url, bodies, args.concurrency, args.num_requests)
+            result["mean_batch_size"] = server.batcher.summary()["mean_batch_size"]
+            rows.append((max_batch_size, result))
+            server.shutdown()
+            server.batcher.close()  # worker thread 와 model 도 놓습니다
+            server.server_close()
+    print_table(rows)
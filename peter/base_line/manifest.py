@@ -0,0 +1,163 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import codec
+
+MANIFEST_FILE = ".manifest.npz"
+
+GENDERS = {"male": 0, "female": 1}
+
+
+def scan_profile(data_dir, profile, file_names):
+    """
+    profile 폴더 하나 (e.g. 000004_male_Asian_54) 를 읽어 manifest row 들을 만듭니다.
+    파일 이름은 정렬하여 manifest 의 row 순서가 os.listdir 순서에 의존하지 않도록 합니다.
+    """
+    id, gender, race, age = profile.split("_")
+    gender = gender.lower()
+    if gender not in GENDERS:
+        raise ValueError(f"Gender value should be either 'male' or 'female', {gender}")
+    try:
+        age = int(age)
+    except ValueError:
+        raise ValueError(f"Age value should be numeric, {age}")
+
+    rows = []
+    for file_name in sorted(os.listdir(os.path.join(data_dir, profile))):
+        _file_name, ext = os.path.splitext(file_name)
+        if _file_name not in file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
+            continue
+        rows.append((f"{profile}/{file_name}", id, GENDERS[gender], race, age, int(file_names[_file_name])))
+    return rows
+
+
+def _columns(rows):
+    paths, ids, genders, races, ages, masks = zip(*rows) if rows else ([],) * 6
+    genders = np.array(genders, dtype=np.int8)
+    ages = np.array(ages, dtype=np.int16)
+    masks = np.array(masks, dtype=np.int8)
+    return {
+        "path": np.array(paths, dtype=str),
+        "profile_id": np.array(ids, dtype=str),
+        "gender": genders,
+        "race": np.array(races, dtype=str),
+        "age": ages,
+        "mask": masks,
+        "label": codec.encode_multi_class(masks, genders, codec.bucketize(ages, "age_bins")).astype(np.int8),
+    }
+
+
+def _concat(parts):
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def load_manifest(manifest_path):
+    with np.load(manifest_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = f"{manifest_path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **manifest)
+    os.replace(tmp_path, manifest_path)
+
+
+def build_manifest(data_dir, file_names, manifest_path=None, num_workers=16):
+    """
+    학습 이미지 트리의 columnar manifest 를 만들거나 갱신하여 돌려줍니다.
+
+    columns: path (data_dir 기준 상대 경로), profile_id, gender, race, age, mask, label (18 class)
+    profile 폴더별 mtime 을 함께 저장하므로, 다음 실행에서는 새로 생기거나 바뀐 폴더만 thread pool 로 다시 읽고
+    나머지 row 는 그대로 재사용합니다. 변경이 없으면 파일을 다시 쓰지 않습니다.
+    """
+    manifest_path = manifest_path or os.path.join(data_dir, MANIFEST_FILE)
+    file_names_key = np.array(sorted(file_names), dtype=str)
+
+    with os.scandir(data_dir) as entries:
+        folders = {
+            entry.name: entry.stat().st_mtime_ns
+            for entry in entries if entry.is_dir() and not entry.name.startswith(".")
+        }
+    folder_names = sorted(folders)
+    folder_mtimes = np.array([folders[name] for name in folder_names], dtype=np.int64)
+
+    previous = {}
+    if os.path.exists(manifest_path):
+        manifest = load_manifest(manifest_path)
+        if np.array_equal(manifest["file_names"], file_names_key):
+            offsets = manifest["folder_offsets"]
+            previous = {
+                name: (mtime, offsets[i], offsets[i + 1])
+                for i, (name, mtime) in enumerate(zip(manifest["folders"].tolist(), manifest["folder_mtimes"].tolist()))
+            }
+            if list(previous) == folder_names and np.array_equal(manifest["folder_mtimes"], folder_mtimes):
+                return manifest
+
+    stale = [name for name in folder_names if name not in previous or previous[name][0] != folders[name]]
+    print(f"[Manifest] scanning {len(stale)} / {len(folder_names)} profile folders in {data_dir}")
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        scanned = dict(zip(stale, executor.map(lambda name: scan_profile(data_dir, name, file_names), stale)))
+
+    # 재사용 row 와 새로 읽은 row 를 합친 뒤 폴더 순서(rank) 로 stable sort 합니다
+    ranks = {name: rank for rank, name in enumerate(folder_names)}
+    reused = [name for name in folder_names if name not in scanned]
+    starts = np.array([previous[name][1] for name in reused], dtype=np.int64)
+    lengths = np.array([previous[name][2] - previous[name][1] for name in reused], dtype=np.int64)
+    reuse_index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    rows = [row for name in stale for row in scanned[name]]
+    columns = _columns(rows)
+    if len(reuse_index):
+        columns = _concat([{key: manifest[key][reuse_index] for key in columns}, columns])
+    row_ranks = np.concatenate([
+        np.repeat(np.array([ranks[name] for name in reused], dtype=np.int64), lengths),
+        np.array([ranks[name] for name in stale for _ in scanned[name]], dtype=np.int64),
+    ])
+    order = np.argsort(row_ranks, kind="stable")
+    manifest = {key: column[order] for key, column in columns.items()}
+    counts = np.bincount(row_ranks, minlength=len(folder_names))
+
+    manifest["folders"] = np.array(folder_names, dtype=str)
+    manifest["folder_mtimes"] = folder_mtimes
+    manifest["folder_offsets"] = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+    manifest["file_names"] = file_names_key
+
+    try:
+        save_manifest(manifest_path, manifest)
+    except OSError as e:
+        print(f"[Warning] could not save manifest to {manifest_path}: {e}")
+    return manifest
+
+
+class PackedPaths:
+    """
+    경로 문자열들을 하나의 uint8 buffer 와 int64 offsets 로 보관합니다.
+    python str 객체 list 와 달리 DataLoader worker 로 fork / pickle 될 때 numpy array 두 개만 넘어가고,
+    refcount 변경으로 인한 copy-on-write 도 일어나지 않습니다.
+    """
+
+    def __init__(self, paths, prefix=""):
+        encoded = [path.encode() for path in np.asarray(paths, dtype=str).tolist()]
+        self.prefix = prefix
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(path) for path in encoded], out=self.offsets[1:])
+        self.buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            path = self.buffer[self.offsets[index]:self.offsets[index + 1]].tobytes().decode()
+            return os.path.join(self.prefix, path)
+        return [self[i] for i in np.arange(len(self))[index]]
+
+    def __iter__(self):
+        data = self.buffer.tobytes()
+        for start, end in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist()):
+            yield os.path.join(self.prefix, data[start:end].decode())
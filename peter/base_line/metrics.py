@@ -0,0 +1,87 @@
+import bisect
+import threading
+import time
+
+import torch
+
+
+class StepTimer:
+    """
+    log_interval 사이의 평균 step 시간을 잽니다.
+    step 마다는 counter 만 올리고, `read` 할 때 한 번만 cuda synchronize 하므로 측정 때문에 sync 가 늘지 않습니다.
+    """
+
+    def __init__(self, device=None):
+        self.device = torch.device(device) if device is not None else None
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.start = time.perf_counter()
+
+    def step(self):
+        self.steps += 1
+
+    def read(self):
+        """ 마지막 reset 이후 step 당 평균 시간 (ms) 을 돌려주고 다시 시작합니다. """
+        if self.device is not None and self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        elapsed = time.perf_counter() - self.start
+        step_time = elapsed / max(self.steps, 1) * 1000
+        self.reset()
+        return step_time
+
+
+class LatencyHistogram:
+    """
+    latency (ms) 를 고정된 log scale bucket 에 세는 thread-safe histogram 입니다.
+    sample 을 저장하지 않으므로 오래 떠 있는 server 에서도 메모리가 늘지 않고,
+    분위수는 해당 bucket 의 상한으로 근사합니다. 마지막 bound 를 넘는 값은 overflow bucket 에 세고
+    분위수는 관측한 최댓값으로 답하므로 summary 는 항상 유한한 값 (valid JSON) 입니다.
+    """
+
+    BOUNDS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = [0] * (len(self.BOUNDS) + 1)  # 마지막은 overflow bucket
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, ms):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.BOUNDS, ms)] += 1
+            self.total += ms
+            self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        with self.lock:
+            counts = list(self.counts)
+            max_ms = self.max
+        n = sum(counts)
+        if n == 0:
+            return 0.
+        rank = q / 100 * n
+        seen = 0
+        for bound, count in zip(self.BOUNDS, counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, max_ms)
+        return max_ms
+
+    def summary(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.total
+            max_ms = self.max
+        n = sum(counts)
+        buckets = {f"le_{bound}": count for bound, count in zip(self.BOUNDS, counts)}
+        buckets[f"gt_{self.BOUNDS[-1]}"] = counts[-1]
+        return {
+            "count": n,
+            "mean_ms": total / n if n else 0.,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "max_ms": max_ms,
+            "buckets": buckets,
+        }
@@ -0,0 +1,235 @@
+"""
+inference.py 와 같은 model (`best.pth`) / TestDataset 전처리로 이미지 한 장씩 예측하는 local HTTP server 입니다.
+
+동시에 들어온 요청은 `MicroBatcher` 가 `--max_batch_size` 장 또는 `--max_wait_ms` 까지 모아 forward 한 번으로 처리합니다.
+decode / resize 는 요청 thread 에서 병렬로 하고, batch 는 uint8 로 쌓아 device 에서 한 번에 normalize 합니다.
+
+- POST /predict : body 에 이미지 파일 (jpg, png) bytes -> {"ans": class, "latency_ms": ...}
+- GET  /metrics : 요청 / batch latency histogram, batch 크기, 처리량
+- GET  /health
+
+e.g. SM_CHANNEL_MODEL=[model saved dir] python server.py --port 8000
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+from dataset import BatchNormalize, MaskBaseDataset, TestDataset, open_image
+from export import load_exported
+from inference import load_model
+from metrics import LatencyHistogram
+
+
+class MicroBatcher:
+    """
+    요청 queue 를 하나의 thread 가 비우며 micro batch 단위로 forward 합니다.
+    첫 요청이 도착한 뒤 `max_wait_ms` 가 지나거나 `max_batch_size` 가 차면 batch 를 닫습니다.
+    `close` 는 queue 에 sentinel (None) 을 넣어 이미 들어온 요청까지 처리한 뒤 worker thread 를 끝냅니다.
+    """
+
+    def __init__(self, model, normalize, device, max_batch_size=32, max_wait_ms=5.):
+        self.model = model
+        self.normalize = normalize
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self.queue = queue.Queue()
+        self.closed = False
+        self.reset()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def reset(self):
+        """ 통계를 비웁니다. (e.g. warm up 이후) """
+        self.batch_latency = LatencyHistogram()
+        self.batch_sizes = [0] * (self.max_batch_size + 1)
+        self.images = 0
+        self.started = time.perf_counter()
+
+    def submit(self, image):
+        """ uint8 CHW tensor 하나를 넣고 예측 class 를 받을 Future 를 돌려줍니다. """
+        if self.closed:
+            raise RuntimeError("MicroBatcher is already closed")
+        future = Future()
+        self.queue.put((image, future))
+        return future
+
+    def close(self):
+        """ worker thread 를 끝내고 model 을 놓습니다. """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self._thread.join()
+        self.model = None
+
+    def _collect(self):
+        """ (batch, sentinel 을 받았는지) """
+        item = self.queue.get()
+        if item is None:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _worker(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if batch:
+                self._run(batch)
+
+    def _run(self, batch):
+        start = time.perf_counter()
+        try:
+            images = torch.stack([image for image, _ in batch]).to(self.device)
+            with torch.no_grad():
+                preds = self.model(self.normalize(images)).argmax(dim=-1).cpu().tolist()
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.batch_latency.record((time.perf_counter() - start) * 1000)
+        self.batch_sizes[len(batch)] += 1
+        self.images += len(batch)
+        for (_, future), pred in zip(batch, preds):
+            future.set_result(pred)
+
+    def summary(self):
+        batches = sum(self.batch_sizes)
+        elapsed = time.perf_counter() - self.started
+        return {
+            "images": self.images,
+            "batches": batches,
+            "mean_batch_size": self.images / batches if batches else 0.,
+            "batch_size_counts": {size: count for size, count in enumerate(self.batch_sizes) if count},
+            "images_per_sec": self.images / elapsed if elapsed > 0 else 0.,
+            "batch_latency": self.batch_latency.summary(),
+        }
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    # server 에 build_server 가 dataset / batcher / request_latency 를 붙여둡니다
+
+    def _reply(self, code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            summary = self.server.batcher.summary()
+            summary["request_latency"] = self.server.request_latency.summary()
+            self._reply(200, summary)
+        else:
+            self._reply(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._reply(404, {"error": f"unknown path {self.path}"})
+            return
+
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            dataset = self.server.dataset
+            image = dataset.transform(open_image(io.BytesIO(body), dataset.decode_size))
+        except Exception as e:
+            self._reply(400, {"error": f"could not decode image: {e}"})
+            return
+
+        try:
+            pred = self.server.batcher.submit(image).result()
+        except Exception as e:
+            # batch 의 forward 가 실패하면 그 batch 의 모든 요청에 500 으로 답합니다
+            self._reply(500, {"error": f"inference failed: {e}"})
+            return
+        latency = (time.perf_counter() - start) * 1000
+        self.server.request_latency.record(latency)
+        self._reply(200, {"ans": pred, "latency_ms": latency})
+
+    def log_message(self, format, *args):
+        pass  # 요청마다 stderr 에 찍지 않습니다 (latency 는 /metrics 로 봅니다)
+
+
+def build_server(args):
+    use_cuda = torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+
+    resize, preprocess = args.resize, {}
+    if args.model_file:
+        # export.py 의 TorchScript artifact 는 CPU 에서 전처리 설정과 함께 읽습니다
+        device = torch.device("cpu")
+        model, config = load_exported(args.model_file, device)
+        resize, preprocess = config["resize"], {"mean": config["mean"], "std": config["std"]}
+    else:
+        model = load_model(args.model_dir, MaskBaseDataset.num_classes, device, args.model).to(device)
+        model.eval()
+
+    # inference.py 와 같은 전처리 (uint8 로 받아 batch 단위로 normalize)
+    dataset = TestDataset([], resize, **preprocess, uint8=True, draft=args.draft_decode)
+
+    server = ThreadingHTTPServer((args.host, args.port), PredictHandler)
+    server.daemon_threads = True
+    server.dataset = dataset
+    server.batcher = MicroBatcher(
+        model, BatchNormalize(dataset.mean, dataset.std, device=device), device,
+        max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+    )
+    server.request_latency = LatencyHistogram()
+    return server
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch_size', type=int, default=32, help='max images per forward (default: 32)')
+    parser.add_argument('--max_wait_ms', type=float, default=5., help='max time to wait for a batch to fill (default: 5)')
+    parser.add_argument('--resize', nargs=2, type=int, default=[96, 128], help='resize size for image when you trained (default: 96 128)')
+    parser.add_argument('--model', type=str, default='BaseModel', help='model type (default: BaseModel)')
+    parser.add_argument('--model_file', type=str, default=None, help='TorchScript artifact from export.py (CPU, ignores --model / --resize)')
+    parser.add_argument('--draft_decode', action='store_true', help='decode JPEGs at reduced scale (draft mode) when resize <= half size')
+
+    # Container environment
+    parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_CHANNEL_MODEL', './model'))
+    return parser
+
+
+if __name__ == '__main__':
+    args = get_parser().parse_args()
+    print(args)
+
+    server = build_server(args)
+    print(f"Serving on http://{args.host}:{args.port} (POST /predict, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.batcher.close()
+        server.server_close()
@@ -0,0 +1,61 @@
+"""
+실제 데이터와 같은 폴더 구조의 synthetic train / eval tree 를 만드는 모듈입니다. (benchmark.py suite)
+
+    {root}/train/images/{id}_{gender}_{race}_{age}/mask1..5.jpg, incorrect_mask.jpg, normal.jpg
+    {root}/eval/images/{ImageID}.jpg, {root}/eval/info.csv (ImageID, ans)
+
+이미지는 저해상도 random noise 를 원본 크기 (512x384) 로 키운 부드러운 JPEG 이라 decode 비용이 실제 사진과 비슷합니다.
+
+e.g. python synthetic.py --root /tmp/synthetic --num_profiles 50
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+FILE_NAMES = ("mask1", "mask2", "mask3", "mask4", "mask5", "incorrect_mask", "normal")
+IMAGE_SIZE = (384, 512)  # (width, height)
+
+
+def random_image(rng, size=IMAGE_SIZE):
+    small = rng.randint(0, 256, size=(16, 12, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize(size, Image.BILINEAR)
+    noise = rng.randint(-8, 9, size=(size[1], size[0], 3))
+    return Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + noise, 0, 255).astype(np.uint8))
+
+
+def make_tree(root, num_profiles=50, num_eval=None, seed=0):
+    """ root 아래 train / eval tree 를 만들고 (train image dir, eval dir) 를 돌려줍니다. """
+    rng = np.random.RandomState(seed)
+    train_dir = os.path.join(root, "train", "images")
+    eval_dir = os.path.join(root, "eval")
+    os.makedirs(train_dir, exist_ok=True)
+    os.makedirs(os.path.join(eval_dir, "images"), exist_ok=True)
+
+    for profile in range(num_profiles):
+        gender = ("male", "female")[rng.randint(2)]
+        age = rng.randint(18, 75)
+        profile_dir = os.path.join(train_dir, f"{profile:06d}_{gender}_Asian_{age}")
+        os.makedirs(profile_dir, exist_ok=True)
+        for name in FILE_NAMES:
+            random_image(rng).save(os.path.join(profile_dir, f"{name}.jpg"), quality=90)
+
+    num_eval = num_profiles * len(FILE_NAMES) if num_eval is None else num_eval
+    image_ids = [f"{index:08x}.jpg" for index in range(num_eval)]
+    for image_id in image_ids:
+        random_image(rng).save(os.path.join(eval_dir, "images", image_id), quality=90)
+    pd.DataFrame({"ImageID": image_ids, "ans": 0}).to_csv(os.path.join(eval_dir, "info.csv"), index=False)
+    return train_dir, eval_dir
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, required=True)
+    parser.add_argument('--num_profiles', type=int, default=50, help='train profiles, 7 images each (default: 50)')
+    parser.add_argument('--num_eval', type=int, default=None, help='eval images (default: same as train)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(make_tree(args.root, args.num_profiles, args.num_eval, args.seed))
@@ -0,0 +1,46 @@
+"""
+export.py 의 eager / export model parity 테스트입니다.
+
+e.g. python -m pytest test_export.py
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from export import build_model, check_parity, export, load_exported, parse_kwargs, save_exported  # noqa: E402
+
+
+def make_config(method):
+    return {
+        "module": "model",
+        "model": "BaseModel",
+        "model_kwargs": {"num_classes": 18},
+        "num_classes": 18,
+        "resize": [64, 48],
+        "mean": [0.548, 0.504, 0.479],
+        "std": [0.237, 0.247, 0.246],
+        "method": method,
+    }
+
+
+@pytest.mark.parametrize("method", ["trace", "script"])
+def test_base_model_parity(tmp_path, method):
+    torch.manual_seed(0)
+    config = make_config(method)
+    net = build_model(config["module"], config["model"], config["model_kwargs"])
+    path = str(tmp_path / "model.ts")
+    save_exported(export(net, config, method), config, path)
+
+    module, loaded = load_exported(path)
+    assert loaded == config
+
+    images = torch.randn(4, 3, *config["resize"])
+    with torch.no_grad():
+        torch.testing.assert_close(module(images), net(images), atol=1e-4, rtol=1e-4)
+    assert "output" in check_parity(net, module, config)  # 허용 오차를 넘으면 AssertionError
+
+
+def test_parse_kwargs():
+    assert parse_kwargs(["version=18", "alpha=0.5", "num_blocks=[2,2,2,2]", "backbone=resnet18"]) == {
+        "version": 18, "alpha": 0.5, "num_blocks": [2, 2, 2, 2], "backbone": "resnet18",
+    }
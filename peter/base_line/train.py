@@ -15,8 +15,11 @@ from torch.optim.lr_scheduler import StepLR
 from torch.utils.data import DataLoader
 from torch.utils.tensorboard import SummaryWriter
 
-from dataset import MaskBaseDataset
+from cache import input_size
+from codec import decode_multi_class
+from dataset import BatchNormalize, MaskBaseDataset
 from loss import create_criterion
+from metrics import StepTimer
 
 
 def seed_everything(seed):
@@ -43,17 +46,16 @@ def grid_image(np_images, gts, preds, n=16, shuffle=False):
     plt.subplots_adjust(top=0.8)               # cautions: hardcoded, 이미지 크기에 따라 top 를 조정해야 할 수 있습니다. T.T
     n_grid = np.ceil(n ** 0.5)
     tasks = ["mask", "gender", "age"]
+    # 고른 n 개의 label 을 한 번에 decode 합니다 -> (n, 3)
+    gt_decoded_labels = np.stack(decode_multi_class(gts[choices].cpu().numpy()), axis=-1)
+    pred_decoded_labels = np.stack(decode_multi_class(preds[choices].cpu().numpy()), axis=-1)
     for idx, choice in enumerate(choices):
-        gt = gts[choice].item()
-        pred = preds[choice].item()
         image = np_images[choice]
         # title = f"gt: {gt}, pred: {pred}"
-        gt_decoded_labels = MaskBaseDataset.decode_multi_class(gt)
-        pred_decoded_labels = MaskBaseDataset.decode_multi_class(pred)
         title = "\n".join([
             f"{task} - gt: {gt_label}, pred: {pred_label}"
             for gt_label, pred_label, task
-            in zip(gt_decoded_labels, pred_decoded_labels, tasks)
+            in zip(gt_decoded_labels[idx], pred_decoded_labels[idx], tasks)
         ])
 
         plt.subplot(n_grid, n_grid, idx + 1, title=title)
@@ -105,8 +107,14 @@ def train(data_dir, model_dir, args):
         resize=args.resize,
         mean=dataset.mean,
         std=dataset.std,
+        uint8=args.uint8_transport,
     )
     dataset.set_transform(transform)
+    if args.draft_decode:
+        dataset.decode_size = input_size(transform, dataset.image_paths[0])  # crop 을 먼저 하는 transform 은 원본 크기
+    normalize = BatchNormalize(dataset.mean, dataset.std, device=device)  # uint8 batch 일 때만 동작
+    if args.cache_dir:
+        dataset.enable_cache(args.cache_dir)
 
     # -- data_loader
     train_set, val_set = dataset.split_dataset()
@@ -156,11 +164,13 @@ def train(data_dir, model_dir, args):
     for epoch in range(args.epochs):
         # train loop
         model.train()
-        loss_value = 0
-        matches = 0
+        # step 마다 .item() 으로 sync 하지 않도록 device 위에서 누적하고 log_interval 에서만 읽습니다
+        loss_value = torch.zeros((), device=device)
+        matches = torch.zeros((), dtype=torch.int64, device=device)
+        step_timer = StepTimer(device)
         for idx, train_batch in enumerate(train_loader):
             inputs, labels = train_batch
-            inputs = inputs.to(device)
+            inputs = normalize(inputs.to(device))
             labels = labels.to(device)
 
             optimizer.zero_grad()
@@ -172,21 +182,25 @@ def train(data_dir, model_dir, args):
             loss.backward()
             optimizer.step()
 
-            loss_value += loss.item()
-            matches += (preds == labels).sum().item()
+            loss_value += loss.detach()
+            matches += (preds == labels).sum()
+            step_timer.step()
             if (idx + 1) % args.log_interval == 0:
-                train_loss = loss_value / args.log_interval
-                train_acc = matches / args.batch_size / args.log_interval
+                step_time = step_timer.read()
+                train_loss = loss_value.item() / args.log_interval
+                train_acc = matches.item() / args.batch_size / args.log_interval
                 current_lr = get_lr(optimizer)
                 print(
                     f"Epoch[{epoch}/{args.epochs}]({idx + 1}/{len(train_loader)}) || "
-                    f"training loss {train_loss:4.4} || training accuracy {train_acc:4.2%} || lr {current_lr}"
+                    f"training loss {train_loss:4.4} || training accuracy {train_acc:4.2%} || lr {current_lr} || "
+                    f"step time {step_time:4.1f}ms"
                 )
                 logger.add_scalar("Train/loss", train_loss, epoch * len(train_loader) + idx)
                 logger.add_scalar("Train/accuracy", train_acc, epoch * len(train_loader) + idx)
+                logger.add_scalar("Train/step_time_ms", step_time, epoch * len(train_loader) + idx)
 
-                loss_value = 0
-                matches = 0
+                loss_value.zero_()
+                matches.zero_()
 
         scheduler.step()
 
@@ -199,7 +213,7 @@ def train(data_dir, model_dir, args):
             figure = None
             for val_batch in val_loader:
                 inputs, labels = val_batch
-                inputs = inputs.to(device)
+                inputs = normalize(inputs.to(device))
                 labels = labels.to(device)
 
                 outs = model(inputs)
@@ -256,12 +270,15 @@ if __name__ == '__main__':
     parser.add_argument('--val_ratio', type=float, default=0.2, help='ratio for validaton (default: 0.2)')
     parser.add_argument('--criterion', type=str, default='cross_entropy', help='criterion type (default: cross_entropy)')
     parser.add_argument('--lr_decay_step', type=int, default=20, help='learning rate scheduler deacy step (default: 20)')
+    parser.add_argument('--draft_decode', action='store_true', help='decode JPEGs at reduced scale (draft mode) when resize <= half size')
+    parser.add_argument('--uint8_transport', action='store_true', help='workers return uint8 tensors, normalize once per batch on device')
     parser.add_argument('--log_interval', type=int, default=20, help='how many batches to wait before logging training status')
     parser.add_argument('--name', default='exp', help='model save at {SM_MODEL_DIR}/{name}')
 
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images'))
     parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_MODEL_DIR', './model'))
+    parser.add_argument('--cache_dir', type=str, default=os.environ.get('SM_CACHE_DIR'), help='decoded image memmap cache dir (default: None, no cache)')
 
     args = parser.parse_args()
     print(args)
@@ -1,5 +1,7 @@
+import numpy as np
 import torch
 import torch.nn as nn
+import torchvision.models
 
 
 class CustomModel(nn.Module):
@@ -157,3 +159,58 @@ class MobileNet(nn.Module):
                 nn.init.normal_(m.weight, 0, 0.01)
                 nn.init.constant_(m.bias, 0)
 
+
+TASKS = ("mask", "gender", "age")
+
+
+def compose_logits(mask, gender, age):
+    """
+    task 별 logit 을 18 class (mask * 6 + gender * 3 + age) log-probability 로 합칩니다.
+    세 task 가 독립이라고 보고 log_softmax 를 더하므로 argmax 는 task 별 argmax 를 encode 한 것과 같습니다.
+    """
+    joint = (mask.log_softmax(dim=-1)[:, :, None, None]
+             + gender.log_softmax(dim=-1)[:, None, :, None]
+             + age.log_softmax(dim=-1)[:, None, None, :])
+    return joint.flatten(1)
+
+
+class MultiHeadModel(nn.Module):
+    """
+    backbone 하나를 mask / gender / age head 셋이 공유하는 multi-task model 입니다.
+    step 마다 backbone forward / backward 가 한 번뿐이므로 task 별 network 셋을 따로 학습하는 것의 약 1/3 입니다.
+    forward 는 task 별 logit 과 합성한 18 class logit ("multi") 을 dict 로 돌려줍니다.
+    """
+
+    def __init__(self, backbone="resnet18", pretrained=False, num_classes=(3, 2, 3)):
+        super(MultiHeadModel, self).__init__()
+        self.backbone = getattr(torchvision.models, backbone)(pretrained=pretrained)
+        in_features = self.backbone.fc.in_features
+        self.backbone.fc = nn.Identity()
+
+        stdv = 1 / np.sqrt(in_features)
+        self.heads = nn.ModuleDict()
+        for task, n in zip(TASKS, num_classes):
+            head = nn.Linear(in_features=in_features, out_features=n, bias=True)
+            torch.nn.init.xavier_uniform_(head.weight)
+            head.bias.data.uniform_(-stdv, stdv)
+            self.heads[task] = head
+
+    def forward(self, x):
+        features = self.backbone(x)
+        outputs = {task: head(features) for task, head in self.heads.items()}
+        outputs["multi"] = compose_logits(outputs["mask"], outputs["gender"], outputs["age"])
+        return outputs
+
+
+class MultiTaskLoss(nn.Module):
+    """ task 별 loss 의 가중합. (total loss, task 별 loss dict) 를 돌려줍니다. """
+
+    def __init__(self, weights=(1., 1., 1.), criterion=None):
+        super(MultiTaskLoss, self).__init__()
+        self.weights = dict(zip(TASKS, weights))
+        self.criterion = criterion or nn.CrossEntropyLoss()
+
+    def forward(self, outputs, labels):
+        losses = {task: self.criterion(outputs[task], labels[task]) for task in TASKS}
+        total = sum(self.weights[task] * losses[task] for task in TASKS)
+        return total, losses
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from Datasets import CustomDataSet
+
+
+def argmax_predict(outputs):
+    """ model output -> class label. (MultiHeadModel 처럼 dict 를 돌려주면 18 class "multi" logit 을 씁니다) """
+    if isinstance(outputs, dict):
+        outputs = outputs["multi"]
+    return torch.argmax(outputs, dim=-1)
+
+
+class InferenceEngine:
+    """
+    eval 폴더의 info.csv 순서대로 이미지를 큰 batch 로 흘려보내며 예측하는 inference engine 입니다.
+
+    - decode / transform 은 DataLoader worker 들이 병렬로 하고, forward 는 `torch.inference_mode` 로 돌립니다.
+    - 예측은 batch 가 끝날 때마다 submission CSV 에 ImageID 순서대로 이어 쓰므로 결과 전체를 메모리에 모으지 않습니다.
+    - 끝나면 images/s 를 출력하고 돌려줍니다.
+    """
+
+    def __init__(self, model, device, transform, batch_size=128, num_workers=None, predict=argmax_predict):
+        self.model = model
+        self.device = torch.device(device)
+        self.transform = transform
+        self.batch_size = batch_size
+        self.num_workers = multiprocessing.cpu_count() // 2 if num_workers is None else num_workers
+        self.predict = predict
+
+    def loader(self, img_paths):
+        dataset = CustomDataSet(img_paths, train=False, transform=self.transform)
+        return DataLoader(
+            dataset,
+            batch_size=self.batch_size,
+            shuffle=False,
+            num_workers=self.num_workers,
+            pin_memory=self.device.type == 'cuda',
+        )
+
+    def run(self, info_path, img_dir, output_path):
+        submission = pd.read_csv(info_path)
+        img_paths = [os.path.join(img_dir, img) for img in submission.ImageID.values]
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+        self.model.eval()
+        n_images = 0
+        start = time.perf_counter()
+        with open(output_path, 'w', newline='') as f, torch.inference_mode():
+            for images in self.loader(img_paths):
+                images = images.to(self.device, non_blocking=True)
+                preds = self.predict(self.model(images)).cpu().numpy()
+
+                rows = submission.iloc[n_images:n_images + len(preds)].assign(ans=preds)
+                rows.to_csv(f, header=n_images == 0, index=False)
+                n_images += len(preds)
+        elapsed = time.perf_counter() - start
+
+        images_per_sec = n_images / elapsed if elapsed > 0 else 0.
+        print(f"Inference done : {n_images} images, {images_per_sec:.1f} images/s -> {output_path}")
+        return images_per_sec
@@ -12,13 +12,14 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.functional as F
-from torchmetrics import F1Score
 
 import numpy as np
 import pandas as pd
 from Datasets import EnsembleDataSet, CustomDataSet
 from torch.utils.data import DataLoader
-from Models import CustomModel
+from metrics import ConfusionMatrix
+from Models import CustomModel, MultiHeadModel, MultiTaskLoss
+from engine import InferenceEngine
 
 from sklearn.model_selection import train_test_split
 
@@ -32,118 +33,72 @@ def train(args, data_loaders):
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     print(f'Use Device : {device}')
 
-    # model load
-    model_age = torchvision.models.resnet18(pretrained=False)
-    model_gender = torchvision.models.resnet18(pretrained=False)
-    model_mask = torchvision.models.resnet18(pretrained=False)
-    models = [model_age, model_gender, model_age]
-
-    # per-trained model settings
-    stdv = 1 / np.sqrt(512)
-
-    for model in models:
-        model.fc = torch.nn.Linear(in_features=512, out_features=3, bias=True)
-        torch.nn.init.xavier_uniform_(model.fc.weight)
-        model.fc.bias.data.uniform_(-stdv, stdv)
-        model.to(device)
+    # model load : backbone 하나 + mask / gender / age head
+    model = MultiHeadModel("resnet18", pretrained=False).to(device)
 
     # optimizer, loss setting
-    age_optimizer = optim.Adam(params=model_age.parameters(), lr=args.learning_rate)
-    gender_optimizer = optim.Adam(params=model_gender.parameters(), lr=args.learning_rate)
-    mask_optimizer = optim.Adam(params=model_mask.parameters(), lr=args.learning_rate)
-    optimizers = [age_optimizer, gender_optimizer, mask_optimizer]
+    optimizer = optim.Adam(params=model.parameters(), lr=args.learning_rate)
+    criterion = MultiTaskLoss(args.task_weights, nn.CrossEntropyLoss()).to(device)
 
-    criterion = nn.CrossEntropyLoss().to(device)
-    f1_score = F1Score(num_classes=18).to(device)
-
-    best_models = [None, None, None]
-    prev_val_losses = [1000.0, 1000.0, 1000.0]
-    f1_bests = 1000.0
+    best_state = None
+    prev_val_loss = 1000.0
 
     print("Train Start!")
 
     # training
     for epoch in range(1, args.epochs + 1):
-        for model in models:
-            model.train()
+        model.train()
+        train_metric = ConfusionMatrix(18, device=device)
 
         for idx, data in enumerate(train_loader):
             img, gender, age, mask = data[0].to(device), data[1].to(device), data[2].to(device), data[3].to(device)
             classes = data[4].to(device)
 
-            labels = [age, gender, mask]
-            preds = [None, None, None]
-
-            for optimizer in optimizers:
-                optimizer.zero_grad()
+            optimizer.zero_grad()
 
-            for idx, model in enumerate(models):
-                output = model(img)
-                pred = torch.argmax(output, dim=-1)
-                preds[idx] = pred
-                loss = criterion(output, labels[idx])
-                loss.backward()
-                optimizers[idx].step()
+            outputs = model(img)
+            loss, losses = criterion(outputs, {"mask": mask, "gender": gender, "age": age})
+            loss.backward()
+            optimizer.step()
 
-            pred_classes = preds[2] * 6 + preds[1] * 3 + preds[0]
-            f1 = f1_score(pred_classes, classes)
+            train_metric.update(torch.argmax(outputs["multi"], dim=-1), classes)
 
             if idx % 100 == 99:
-                print(f"Epoch {epoch} Batch {idx+1} - F1 score : {f1:.4g} | age loss : {age_loss:.4g} | gender loss : {gender_loss:.4g} | mask loss : {mask_loss:.4g}")
+                print(f"Epoch {epoch} Batch {idx+1} - F1 score : {train_metric.f1():.4g} | age loss : {losses['age']:.4g} | gender loss : {losses['gender']:.4g} | mask loss : {losses['mask']:.4g}")
 
-        val_loss = [0.0, 0.0, 0.0]
-        avg_val_loss = 0.0
-        val_f1 = 0.0
+        val_loss = 0.0
+        val_metric = ConfusionMatrix(18, device=device)
 
         # validation check
+        model.eval()
         with torch.no_grad():
             for k, data in enumerate(val_loader):
                 img, gender, age, mask = data[0].to(device), data[1].to(device), data[2].to(device), data[3].to(device)
                 classes = data[4].to(device)
 
-                age_output = model_age(img)
-                age_pred = torch.argmax(age_output, dim=-1)
-                gender_output = model_gender(img)
-                gender_pred = torch.argmax(gender_output, dim=-1)
-                mask_output = model_mask(img)
-                mask_pred = torch.argmax(mask_output, dim=-1)
-
-                age_loss = criterion(age_output, age)
-                gender_loss = criterion(gender_output, gender)
-                mask_loss = criterion(mask_output, mask)
-
-                val_loss[0] = val_loss[0] + age_loss
-                val_loss[1] = val_loss[1] + gender_loss
-                val_loss[2] = val_loss[2] + mask_loss
-
-                pred_classes = mask_pred * 6 + gender_pred * 3 + age_pred
-                val_f1 += f1_score(pred_classes, classes)
+                outputs = model(img)
+                loss, _ = criterion(outputs, {"mask": mask, "gender": gender, "age": age})
+                val_loss += loss
 
-            val_loss = [val/len(val_loader.dataset) for val in val_loss]
-            val_f1 = val_f1/len(val_loader.dataset)
+                val_metric.update(torch.argmax(outputs["multi"], dim=-1), classes)
 
-            print(f"Epoch {epoch} - Avg Models Validation loss : {val_loss.sum():.6g} | Avg F1 Score : {val_f1:.4g}")
+            val_loss = val_loss.item() / len(val_loader)
+            val_f1 = val_metric.f1()
 
-            # age model
-            if prev_val_losses[0] > val_loss[0]:
-                best_models[0] = model_age
-                prev_val_losses[0] = val_loss[0]
+            print(f"Epoch {epoch} - Multi-task Validation loss : {val_loss:.6g} | F1 Score : {val_f1:.4g}")
 
-            # gender model
-            if prev_val_losses[1] > val_loss[1]:
-                best_models[1] = model_gender
-                prev_val_losses[1] = val_loss[0]
+            if prev_val_loss > val_loss:
+                best_state = {key: value.detach().cpu().clone() for key, value in model.state_dict().items()}
+                prev_val_loss = val_loss
 
-            # mask model
-            if prev_val_losses[2] > val_loss[2]:
-                best_models[2] = model_age
-                prev_val_losses[2] = val_loss[2]
+    if best_state is not None:
+        model.load_state_dict(best_state)
 
     if args.mode == "test":
-        test(best_models, device)
+        test(model, device)
 
 
-def test(models, device):
+def test(model, device):
     current_time = datetime.now(pytz.timezone('Asia/Seoul'))
 
     base_dir = '/opt/ml'
@@ -151,39 +106,15 @@ def test(models, device):
     test_df_dir = base_dir + '/input/data/eval/info.csv'
     output_path = base_dir + f'/outputs/submissions/submission_\{current_time.month}{current_time.day}{current_time.hour}{current_time.minute}.csv'
 
-    submission = pd.read_csv(test_df_dir)
-    test_img_list = [test_img_dir + '/' + img for img in submission.ImageID.values]
-
     transform = transforms.Compose([
         Resize((512, 284), Image.BILINEAR),
         ToTensor(),
         Normalize(mean=(0.5, 0.5, 0.5), std=(0.2, 0.2, 0.2))
     ])
 
-    test_dataset = CustomDataSet(test_img_list, train=False, transform=transform)
-    test_loader = DataLoader(test_dataset, shuffle=False)
-
-    preds = []
-
+    engine = InferenceEngine(model, device, transform)
     print("Start Test")
-    with torch.no_grad():
-        for img in test_loader:
-            img = img.to(device)
-
-            age_output = models[0](img)
-            age_pred = torch.argmax(age_output, dim=-1)
-            gender_output = models[1](img)
-            gender_pred = torch.argmax(gender_output, dim=-1)
-            mask_output = models[2](img)
-            mask_pred = torch.argmax(mask_output, dim=-1)
-
-            pred = mask_pred * 6 + gender_pred * 3 + age_pred
-            pred = pred.cpu().numpy()[0]
-            preds.append(pred)
-
-    submission['ans'] = preds
-
-    submission.to_csv(output_path, index=False)
+    engine.run(test_df_dir, test_img_dir, output_path)
 
 
 def main(args):
@@ -9,12 +9,13 @@ from PIL import Image
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torchmetrics import F1Score
 
 import numpy as np
 import pandas as pd
 from Datasets import CustomDataSet, CustomDataSet2
+from engine import InferenceEngine
 from torch.utils.data import DataLoader
+from metrics import ConfusionMatrix
 from Models import CustomModel, MobileNet
 
 from sklearn.model_selection import train_test_split
@@ -91,7 +92,6 @@ def main(args):
     # optimizer, loss setting
     optimizer = optim.Adam(params=model.parameters(), lr=args.learning_rate)
     criterion = nn.CrossEntropyLoss().to(device)
-    f1_score = F1Score(num_classes=18, average="macro").to(device)
 
     train_loss_history = []
     val_loss_history = []
@@ -105,7 +105,7 @@ def main(args):
     for epoch in range(1, args.epochs+1):
         model.train()
         epoch_loss = 0.0
-        epoch_f1 = 0.0
+        train_metric = ConfusionMatrix(18, device=device)
         count = 0
         for idx, (imgs, classes) in enumerate(train_loader):
             imgs, classes = imgs.to(device), classes.to(device)
@@ -115,23 +115,22 @@ def main(args):
             output = model(imgs)
             loss = criterion(output, classes)
             pred = torch.argmax(output, dim=-1)
-            f1 = f1_score(pred, classes)
+            train_metric.update(pred, classes)
 
             loss.backward()
             optimizer.step()
 
             epoch_loss += loss.item()
-            epoch_f1 += f1
             count += 1
 
             if idx % 100 == 99:
-                print(f"Epoch {epoch+0:03} Batch {idx+1} - Train loss : {loss:.5f} | F1 score : {f1:.4f}")
+                print(f"Epoch {epoch+0:03} Batch {idx+1} - Train loss : {loss:.5f} | F1 score : {train_metric.f1():.4f}")
         train_loss = epoch_loss / count
-        train_f1 = epoch_f1 / count
+        train_f1 = train_metric.f1()
 
         model.eval()
         val_loss = 0.0
-        val_f1 = 0.0
+        val_metric = ConfusionMatrix(18, device=device)
 
         # validation check
         with torch.no_grad():
@@ -144,12 +143,12 @@ def main(args):
                 pred = torch.argmax(output, dim=-1)
 
                 val_loss += loss
-                val_f1 += f1_score(pred, label)
+                val_metric.update(pred, label)
                 count += 1
 
             val_loss = val_loss/count
-            val_f1 = val_f1/count
-            print(f"Epoch {epoch+0:03} - Avg Validation loss : {val_loss:.5f} | Avg F1 Score : {val_f1:.4f}")
+            val_f1 = val_metric.f1()
+            print(f"Epoch {epoch+0:03} - Avg Validation loss : {val_loss:.5f} | F1 Score : {val_f1:.4f}")
 
             # check best validation model
             if prev_val_loss > val_loss:
@@ -176,9 +175,6 @@ def test(best_model, device):
     output_path = base_dir + f'/outputs/submissions/submission_{current_time.year}_{current_time.month}' \
                              f'_{current_time.day}_{current_time.hour}{current_time.minute}.csv'
 
-    submission = pd.read_csv(test_df_dir)
-    test_img_list = [test_img_dir+'/'+img for img in submission.ImageID.values]
-
     pre_transform = transforms.Compose([
         Resize((512 // 3, 284 // 3)),
     ])
@@ -188,25 +184,9 @@ def test(best_model, device):
         Normalize(mean=(0.5, 0.5, 0.5), std=(0.2, 0.2, 0.2))
     ])
 
-    test_dataset = CustomDataSet2(test_img_list, train=False, pre_transform=pre_transform, transform=transform)
-    test_loader = DataLoader(test_dataset, shuffle=False)
-
-    preds = []
-
+    engine = InferenceEngine(best_model, device, transforms.Compose([pre_transform, transform]))
     print("Start Test")
-    with torch.no_grad():
-        for img in test_loader:
-            img = img.to(device)
-
-            output = best_model(img)
-            pred = torch.argmax(output, dim=-1)
-            # print(pred)
-            pred = pred.cpu().numpy()[0]
-            preds.append(pred)
-
-    submission['ans'] = preds
-
-    submission.to_csv(output_path, index=False)
+    engine.run(test_df_dir, test_img_dir, output_path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+import time
+
+import numpy as np
+import torch
+
+
+class ConfusionMatrix:
+    """
+    batch 마다 confusion matrix 를 누적하는 metric 입니다.
+
+    `update` 는 (label, pred) 쌍을 미리 잡아 둔 (C, C) matrix 에 `index_add_` 로 더하며, matrix 는 pred 와 같은 device 에
+    있으므로 batch 마다 GPU -> CPU 복사나 sync 가 일어나지 않습니다. (CUDA `bincount` 는 출력 크기를 정하려고 sync 합니다)
+    accuracy / f1 은 누적된 (C, C) matrix 만으로 언제든 O(C^2) 에 계산합니다. macro f1 은 sklearn `f1_score(average="macro")` 와 같이
+    label 이나 pred 에 한 번이라도 나온 class 들에 대해서만 평균합니다.
+    """
+
+    def __init__(self, num_classes, device=None):
+        self.num_classes = num_classes
+        self.matrix = torch.zeros(num_classes, num_classes, dtype=torch.int64, device=device)
+
+    def reset(self):
+        self.matrix.zero_()
+
+    @torch.no_grad()
+    def update(self, preds, labels):
+        preds = torch.as_tensor(preds).reshape(-1)
+        labels = torch.as_tensor(labels).reshape(-1)
+        if self.matrix.device != preds.device:
+            self.matrix = self.matrix.to(preds.device)
+
+        index = labels.to(preds.device).long() * self.num_classes + preds.long()
+        self.matrix.view(-1).index_add_(0, index, torch.ones_like(index))
+
+    def numpy(self):
+        """ 행은 label, 열은 pred 인 (C, C) int64 matrix """
+        return self.matrix.cpu().numpy()
+
+    def __len__(self):
+        return int(self.matrix.sum())
+
+    def accuracy(self):
+        matrix = self.numpy()
+        total = matrix.sum()
+        return float(np.trace(matrix) / total) if total else 0.
+
+    def f1_per_class(self):
+        matrix = self.numpy()
+        tp = np.diag(matrix)
+        denominator = matrix.sum(axis=0) + matrix.sum(axis=1)  # 2tp + fp + fn
+        return np.divide(2 * tp, denominator, out=np.zeros(self.num_classes), where=denominator > 0)
+
+    def f1(self):
+        matrix = self.numpy()
+        present = (matrix.sum(axis=0) + matrix.sum(axis=1)) > 0
+        return float(self.f1_per_class()[present].mean()) if present.any() else 0.
+
+    def expand(self):
+        """ 누적된 matrix 를 (labels, preds) array 로 되돌립니다. (e.g. wandb.plot.confusion_matrix) """
+        counts = self.numpy().reshape(-1)
+        pairs = np.repeat(np.arange(counts.size), counts)
+        return pairs // self.num_classes, pairs % self.num_classes
+
+
+class StepTimer:
+    """
+    log_interval 사이의 평균 step 시간을 잽니다.
+    step 마다는 counter 만 올리고, `read` 할 때 한 번만 cuda synchronize 하므로 측정 때문에 sync 가 늘지 않습니다.
+    """
+
+    def __init__(self, device=None):
+        self.device = torch.device(device) if device is not None else None
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.start = time.perf_counter()
+
+    def step(self):
+        self.steps += 1
+
+    def read(self):
+        """ 마지막 reset 이후 step 당 평균 시간 (ms) 을 돌려주고 다시 시작합니다. """
+        if self.device is not None and self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        elapsed = time.perf_counter() - self.start
+        step_time = elapsed / max(self.steps, 1) * 1000
+        self.reset()
+        return step_time
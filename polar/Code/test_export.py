@@ -0,0 +1,35 @@
+"""
+export.py 로 export 한 MobileNet 의 eager / export model parity 테스트입니다.
+
+e.g. python -m pytest test_export.py
+"""
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from export import build_model, check_parity, export, load_exported, save_exported  # noqa: E402
+
+
+def test_mobilenet_parity(tmp_path):
+    torch.manual_seed(0)
+    config = {
+        "module": "Models",
+        "model": "MobileNet",
+        "model_kwargs": {"num_classes": 18, "alpha": 0.25},
+        "num_classes": 18,
+        "resize": [128, 96],
+        "mean": [0.548, 0.504, 0.479],
+        "std": [0.237, 0.247, 0.246],
+        "method": "trace",
+    }
+    net = build_model(config["module"], config["model"], config["model_kwargs"])
+    path = str(tmp_path / "mobilenet.ts")
+    save_exported(export(net, config), config, path)
+
+    module, loaded = load_exported(path)
+    assert loaded == config
+
+    images = torch.randn(4, 3, *config["resize"])
+    with torch.no_grad():
+        torch.testing.assert_close(module(images), net(images), atol=1e-4, rtol=1e-4)
+    assert "output" in check_parity(net, module, config)  # 허용 오차를 넘으면 AssertionError
@@ -5,6 +5,8 @@ import pandas as pd
 import argparse
 import re
 
+from codec import bucketize, encode_multi_class
+
 
 def args_getter():
     parser = argparse.ArgumentParser()
@@ -16,6 +18,8 @@ def args_getter():
     parser.add_argument("-n", "--name", default="ResNet18", help="Model name (if you use pre-trained, \
                                                                             write pre-trained model name)")
     parser.add_argument("-s", "--save", default="false", help="Save the experiments")
+    parser.add_argument("-tw", "--task_weights", nargs=3, default=[1., 1., 1.], type=float,
+                        help="mask / gender / age loss weights of the multi-head model (default=1 1 1)")
     # parser.add_argument("--m", required=False, default=None, type=float, help="momentum (default=0.9)")
 
     args = parser.parse_args()
@@ -47,7 +51,7 @@ def make_img_path_df(path, output_dir=None, train=True):
                 gender = 0 if row['gender'] == "male" else 1
                 data = {
                     'path': os.path.join(path, row['path'], file),
-                    'class':mask*6 + gender*3 + min(2, row['age']//30)
+                    'class': int(encode_multi_class(mask, gender, bucketize(row['age'])))
                 }
                 df = df.append(data, ignore_index=True)
 
@@ -75,7 +79,7 @@ def make_info_df(img_path_df, output_dir=None):
         new_data = {
             'id': user_id,
             'gender': 0 if gender == "male" else 1,
-            'age': age//30,
+            'age': int(bucketize(age)),
             'types': mask_type,
             'path': path,
             'class': data['class']
@@ -0,0 +1,126 @@
+"""
+따로 학습한 mask / gender / age expert 의 저장된 fold 확률을 18 class 답으로 합치는 composer 입니다.
+
+expert 마다 logits.py store 에서 "run/model" glob 으로 고른 fold 확률을 평균한 뒤, 전체 test set 을 한 번에 합칩니다.
+
+- product : 결합 확률 p(mask) * p(gender) * p(age) (N, 18) 의 argmax.
+            main_age.py 의 10 class (TenAgeLabels) 확률은 3 class 로 합산한 뒤 곱합니다.
+- argmax  : task 별 argmax 를 mask * 6 + gender * 3 + age 로 합칩니다.
+            10 class age 는 argmax 뒤 encode_original_age 로 3 class 로 바꿉니다.
+
+세 expert 의 out-of-fold logit 이 모두 있으면 두 방식의 OOF f1 을 같이 출력합니다.
+
+e.g. python compose.py --mask "mask_exp/*" --gender "gender_exp/*" --age "age_exp/ResNet18" --mode product
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import codec
+from logits import LogitStore, combine
+
+PARTS = ("mask", "gender", "age")
+MODES = ("product", "argmax")
+
+
+def ten_to_three_probs(probs):
+    """ 10 class age 확률 -> 3 class age 확률 """
+    groups = np.asarray(codec.TEN_TO_THREE)
+    return np.stack([probs[:, groups == age].sum(axis=1) for age in range(codec.NUM_AGE_CLASSES)], axis=1)
+
+
+def joint_probs(mask, gender, age):
+    """ (N, 3), (N, 2), (N, 3 or 10) 확률 -> (N, 18) 결합 확률. class 순서는 mask * 6 + gender * 3 + age 입니다. """
+    if age.shape[1] != codec.NUM_AGE_CLASSES:
+        age = ten_to_three_probs(age)
+    return np.einsum("nm,ng,na->nmga", mask, gender, age).reshape(len(mask), codec.NUM_CLASSES)
+
+
+def compose(mask, gender, age, mode="product"):
+    """ expert 확률 세 개 -> 18 class label (N,) """
+    assert mode in MODES, f"mode should be one of {MODES}, {mode}"
+    if mode == "product":
+        return joint_probs(mask, gender, age).argmax(axis=1)
+    age_labels = age.argmax(axis=1)
+    if age.shape[1] != codec.NUM_AGE_CLASSES:
+        age_labels = codec.ten_to_three(age_labels)
+    return codec.encode_multi_class(mask.argmax(axis=1), gender.argmax(axis=1), age_labels)
+
+
+def compose_labels(mask_labels, gender_labels, age_labels, age_classes):
+    """ expert label -> 18 class label. (10 class age label 은 3 class 로 바꿉니다) """
+    if age_classes != codec.NUM_AGE_CLASSES:
+        age_labels = codec.ten_to_three(np.maximum(age_labels, 0))
+    return codec.encode_multi_class(mask_labels, gender_labels, age_labels)
+
+
+def macro_f1(preds, labels, num_classes):
+    confusion = np.bincount(labels * num_classes + preds, minlength=num_classes ** 2).reshape(num_classes, num_classes)
+    tp = np.diag(confusion)
+    denominator = confusion.sum(axis=0) + confusion.sum(axis=1)
+    f1 = np.divide(2 * tp, denominator, out=np.zeros(num_classes), where=denominator > 0)
+    return f1.mean()
+
+
+def expert_keys(store, spec, task, folds=None):
+    """ "run/model" glob (model 생략 시 *) 에 맞는 task 의 key 들 """
+    run, _, model = spec.partition("/")
+    keys = store.keys(run, model or "*", task, folds)
+    if not keys:
+        raise FileNotFoundError(f"no {task} logits in {store.root} for {spec}")
+    return keys
+
+
+def main(args):
+    store = LogitStore(args.logit_dir)
+    keys = {task: expert_keys(store, getattr(args, task), task, args.folds) for task in PARTS}
+    for task in PARTS:
+        print(f"[{task}] " + ", ".join(f"{key.run}/{key.model}/fold{key.fold}" for key in keys[task]))
+
+    experts = [combine(store, keys[task], split="test", reduce=args.reduce)[0] for task in PARTS]
+    preds = compose(*experts, mode=args.mode)
+
+    if all(store.has(key, "oof") for task in PARTS for key in keys[task]):
+        oof = [combine(store, keys[task], split="oof", reduce=args.reduce) for task in PARTS]
+        size = min(len(probs) for probs, _, _ in oof)
+        (mask, mask_labels, mask_covered), (gender, gender_labels, gender_covered), (age, age_labels, age_covered) = [
+            tuple(value[:size] for value in result) for result in oof
+        ]
+        covered = mask_covered & gender_covered & age_covered
+        labels = compose_labels(mask_labels, gender_labels, age_labels, age.shape[1])[covered]
+        for mode in MODES:
+            oof_preds = compose(mask[covered], gender[covered], age[covered], mode=mode)
+            print(f"[OOF] {mode}: f1 {macro_f1(oof_preds, labels, codec.NUM_CLASSES):4.4f}, "
+                  f"acc {(oof_preds == labels).mean():4.2%} ({covered.sum()} images)")
+
+    submission = pd.read_csv(os.path.join(args.test_data_dir, 'info.csv'))
+    assert len(submission) == len(preds), f"{len(preds)} predictions for {len(submission)} test images"
+    submission['ans'] = preds
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    submission.to_csv(args.output, index=False)
+    if args.probs_output:
+        np.save(args.probs_output, joint_probs(*experts).astype(np.float32))
+    print(f"{args.mode} composition -> {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mask', type=str, default='*', help='mask expert "run/model" glob (default: *)')
+    parser.add_argument('--gender', type=str, default='*', help='gender expert "run/model" glob (default: *)')
+    parser.add_argument('--age', type=str, default='*', help='age expert "run/model" glob (default: *)')
+    parser.add_argument('--folds', nargs='+', type=int, default=None, help='fold numbers to use (default: all)')
+    parser.add_argument('--mode', type=str, default='product', choices=MODES,
+                        help='argmax of the joint 18 class probability, or per-task argmax (default: product)')
+    parser.add_argument('--reduce', type=str, default='mean', choices=['mean', 'logit_mean'],
+                        help='average fold softmax probabilities or logits per expert (default: mean)')
+    parser.add_argument('--logit_dir', type=str, default=os.environ.get('SM_LOGIT_DIR', './logits'))
+    parser.add_argument('--test_data_dir', type=str, default=os.environ.get('SM_CHANNEL_TEST'))
+    parser.add_argument('--output', type=str, default='./outputs/composed_submission.csv')
+    parser.add_argument('--probs_output', type=str, default=None, help='also save the (N, 18) joint probabilities as .npy')
+
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
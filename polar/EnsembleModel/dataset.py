@@ -16,6 +16,12 @@ from torchvision.transforms import *
 
 from pandas_streaming.df import train_test_apart_stratify
 
+import codec
+from cache import ImageCache, TensorStore, input_size
+from folds import FOLDS_DIR, fold_assignment, k_fold_indices
+from manifest import PackedPaths, build_manifest
+from stats import STATISTICS_FILE, compute_statistics
+
 
 IMG_EXTENSIONS = [
     ".jpg", ".JPG", ".jpeg", ".JPEG", ".png",
@@ -104,16 +110,16 @@ class AgeLabels(int, Enum):
         except Exception:
             raise ValueError(f"Age value should be numeric, {value}")
 
-        if value < 30:
-            return cls.YOUNG
-        elif value < 60:
-            return cls.MIDDLE
-        else:
-            return cls.OLD
+        return cls(int(codec.bucketize(value, "age_bins")))
+
+    @classmethod
+    def from_numbers(cls, values: np.ndarray) -> np.ndarray:
+        return codec.bucketize(values, "age_bins").astype(np.int8)
 
 
 class MaskBaseDataset(Dataset):
     num_classes = 3 * 2 * 3
+    stratify = "class_labels"  # k_fold_split 의 층화 기준 label
 
     _file_names = {
         "mask1": MaskLabels.MASK,
@@ -125,10 +131,7 @@ class MaskBaseDataset(Dataset):
         "normal": MaskLabels.NORMAL
     }
 
-    image_paths = []
-    mask_labels = []
-    gender_labels = []
-    age_labels = []
+    cache = None
 
     def __init__(self, data_dir, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), val_ratio=0.2):
         self.data_dir = data_dir
@@ -140,49 +143,43 @@ class MaskBaseDataset(Dataset):
         self.setup()
         self.calc_statistics()
 
+    def load_manifest(self):
+        """ data_dir 의 manifest 를 읽습니다. 새로 생기거나 바뀐 profile 폴더만 다시 scan 합니다. """
+        return build_manifest(self.data_dir, self._file_names)
+
+    def set_rows(self, manifest, rows=slice(None)):
+        """
+        manifest 의 `rows` 를 instance 단위 numpy column 으로 저장합니다.
+        (int8 label, int32 group id, 하나로 묶은 path buffer) - 여러 번 생성해도 row 가 중복되지 않습니다.
+        """
+        self.image_paths = PackedPaths(manifest["path"][rows], prefix=self.data_dir)
+        self.mask_labels = manifest["mask"][rows]
+        self.gender_labels = manifest["gender"][rows]
+        self.age_labels = AgeLabels.from_numbers(manifest["age"][rows])
+        self.class_labels = manifest["label"][rows]
+        self.groups = np.unique(manifest["profile_id"][rows], return_inverse=True)[1].astype(np.int32)
+
     def setup(self):
-        profiles = os.listdir(self.data_dir)
-        print(len(profiles))
-        for profile in profiles:
-            if profile.startswith("."):  # "." 로 시작하는 파일은 무시합니다
-                continue
-
-            img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
-                _file_name, ext = os.path.splitext(file_name)
-                if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
-                    continue
-
-                img_path = os.path.join(self.data_dir, profile,
-                                        file_name)  # (resized_data, 000004_male_Asian_54, mask1.jpg)
-                mask_label = self._file_names[_file_name]
-
-                id, gender, race, age = profile.split("_")
-                gender_label = GenderLabels.from_str(gender)
-                age_label = AgeLabels.from_number(age)
-
-                self.image_paths.append(img_path)
-                self.mask_labels.append(mask_label)
-                self.gender_labels.append(gender_label)
-                self.age_labels.append(age_label)
+        self.set_rows(self.load_manifest())
 
     def calc_statistics(self):
         has_statistics = self.mean is not None and self.std is not None
         if not has_statistics:
             print("[Warning] Calculating statistics... It can take a long time depending on your CPU machine")
-            sums = []
-            squared = []
-            for image_path in self.image_paths[:3000]:
-                image = np.array(Image.open(image_path)).astype(np.int32)
-                sums.append(image.mean(axis=(0, 1)))
-                squared.append((image ** 2).mean(axis=(0, 1)))
-
-            self.mean = np.mean(sums, axis=0) / 255
-            self.std = (np.mean(squared, axis=0) - self.mean ** 2) ** 0.5 / 255
+            cache_path = os.path.join(self.data_dir, STATISTICS_FILE)
+            self.mean, self.std = compute_statistics(self.image_paths, cache_path=cache_path)
 
     def set_transform(self, transform):
         self.transform = transform
 
+    def enable_cache(self, cache_dir):
+        """
+        이미지를 transform 결과가 같은 크기 (`input_size`) 로 한 번만 decode 해 memmap 캐시에 저장하고,
+        이후 `read_image` 는 JPEG decode 없이 캐시에서 읽습니다. (opt-in, set_transform 뒤에 부릅니다)
+        """
+        assert self.transform is not None, "enable_cache 전에 .set_transform 으로 transform 을 주입해주세요"
+        self.cache = ImageCache(cache_dir, self.image_paths, input_size(self.transform, self.image_paths[0]))
+
     def __getitem__(self, index):
         assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
 
@@ -199,28 +196,27 @@ class MaskBaseDataset(Dataset):
         return len(self.image_paths)
 
     def get_mask_label(self, index) -> MaskLabels:
-        return self.mask_labels[index]
+        return int(self.mask_labels[index])
 
     def get_gender_label(self, index) -> GenderLabels:
-        return self.gender_labels[index]
+        return int(self.gender_labels[index])
 
     def get_age_label(self, index) -> AgeLabels:
-        return self.age_labels[index]
+        return int(self.age_labels[index])
 
     def read_image(self, index):
         image_path = self.image_paths[index]
+        if self.cache is not None:
+            return self.cache.read(image_path)
         return Image.open(image_path)
 
     @staticmethod
     def encode_multi_class(mask_label, gender_label, age_label) -> int:
-        return mask_label * 6 + gender_label * 3 + age_label
+        return codec.encode_multi_class(mask_label, gender_label, age_label)
 
     @staticmethod
     def decode_multi_class(multi_class_label) -> Tuple[MaskLabels, GenderLabels, AgeLabels]:
-        mask_label = (multi_class_label // 6) % 3
-        gender_label = (multi_class_label // 3) % 2
-        age_label = multi_class_label % 3
-        return mask_label, gender_label, age_label
+        return codec.decode_multi_class(multi_class_label)
 
     @staticmethod
     def denormalize_image(image, mean, std):
@@ -231,6 +227,17 @@ class MaskBaseDataset(Dataset):
         img_cp = np.clip(img_cp, 0, 255).astype(np.uint8)
         return img_cp
 
+    def k_fold_split(self, n_splits=5, seed=42) -> List[List[Subset[Any]]]:
+        """
+        사람(profile) 단위로 묶고 `stratify` label 로 층화한 K-fold 를 [[train, valid], ...] Subset 으로 돌려줍니다.
+        fold 배정은 data_dir/.folds 에 (seed, 경로 manifest) 기준으로 저장되어 재실행 / 병렬 fold job 에서 그대로 재사용됩니다.
+        """
+        folds = fold_assignment(
+            self.groups, getattr(self, self.stratify), n_splits, seed,
+            cache_dir=os.path.join(self.data_dir, FOLDS_DIR), key=self.image_paths.buffer.tobytes(),
+        )
+        return [[Subset(self, train), Subset(self, valid)] for train, valid in k_fold_indices(folds, n_splits)]
+
     def split_dataset(self) -> Tuple[Subset, Subset]:
         """
         데이터셋을 train 과 val 로 나눕니다,
@@ -270,35 +277,21 @@ class MaskSplitByProfileDataset(MaskBaseDataset):
         }
 
     def setup(self):
-        profiles = os.listdir(self.data_dir)
-        profiles = [profile for profile in profiles if not profile.startswith(".")]
+        manifest = self.load_manifest()
+        profiles = manifest["folders"]
+        profile_index = np.repeat(np.arange(len(profiles)), np.diff(manifest["folder_offsets"]))
         split_profiles = self._split_profile(profiles, self.val_ratio)
 
+        phase_rows = {
+            phase: np.flatnonzero(np.isin(profile_index, list(indices)))
+            for phase, indices in split_profiles.items()
+        }
+        self.set_rows(manifest, np.concatenate(list(phase_rows.values())))
+
         cnt = 0
-        for phase, indices in split_profiles.items():
-            for _idx in indices:
-                profile = profiles[_idx]
-                img_folder = os.path.join(self.data_dir, profile)
-                for file_name in os.listdir(img_folder):
-                    _file_name, ext = os.path.splitext(file_name)
-                    if _file_name not in self._file_names:  # "." 로 시작하는 파일 및 invalid 한 파일들은 무시합니다
-                        continue
-
-                    img_path = os.path.join(self.data_dir, profile,
-                                            file_name)  # (resized_data, 000004_male_Asian_54, mask1.jpg)
-                    mask_label = self._file_names[_file_name]
-
-                    id, gender, race, age = profile.split("_")
-                    gender_label = GenderLabels.from_str(gender)
-                    age_label = AgeLabels.from_number(age)
-
-                    self.image_paths.append(img_path)
-                    self.mask_labels.append(mask_label)
-                    self.gender_labels.append(gender_label)
-                    self.age_labels.append(age_label)
-
-                    self.indices[phase].append(cnt)
-                    cnt += 1
+        for phase, rows in phase_rows.items():
+            self.indices[phase] = np.arange(cnt, cnt + len(rows))
+            cnt += len(rows)
 
     def split_dataset(self) -> List[Subset]:
         print("intset")
@@ -315,72 +308,29 @@ class TenAgeLabels(int, Enum):
         except ValueError:
             raise ValueError(f"Age value should be numeric, {value}")
 
-        if 0 < value <= 20:
-            return cls.ZERO
-        elif 21 <= value < 25:
-            return cls.ONE
-        elif 25 <= value < 30:
-            return cls.TWO
-        elif 30 <= value < 35:
-            return cls.THREE
-        elif 35 <= value < 40:
-            return cls.FOUR
-        elif 40 <= value < 45:
-            return cls.FIVE
-        elif 45 <= value < 50:
-            return cls.SIX
-        elif 50 <= value < 55:
-            return cls.SEVEN
-        elif 55 <= value < 60:
-            return cls.EIGHT
-        elif 60 <= value:
-            return cls.NINE
+        return cls(int(codec.bucketize(value, "ten_age_bins")))
+
+    @classmethod
+    def from_ages(cls, values: np.ndarray) -> np.ndarray:
+        return codec.bucketize(values, "ten_age_bins").astype(np.int8)
 
 
 class AgeBaseDataset(MaskBaseDataset):
     num_classes = 10
-    origin_age_labels = []
-    indices = []
-    class_labels = []
-    groups = []
+    stratify = "age_labels"
 
     def __init__(self, data_dir, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), val_ratio=0.2):
         super(AgeBaseDataset, self).__init__(data_dir, mean, std, val_ratio)
 
     def setup(self):
-        cnt = 0
-        profiles = os.listdir(self.data_dir)
-        for profile in profiles:
-            if profile.startswith("."):
-                continue
-
-            img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
-                _file_name, ext = os.path.splitext(file_name)
-                if _file_name not in self._file_names:
-                    continue
-
-                img_path = os.path.join(self.data_dir, profile, file_name)
-                mask_label = self._file_names[_file_name]
-
-                id, gender, race, age = profile.split("_")
-                gender_label = GenderLabels.from_str(gender)
-                origin_age_label = AgeLabels.from_number(age)
-                age_label = TenAgeLabels.from_age(age)
-
-                self.image_paths.append(img_path)
-                self.mask_labels.append(mask_label)
-                self.gender_labels.append(gender_label)
-                self.origin_age_labels.append(origin_age_label)
-                self.age_labels.append(age_label)
-                self.class_labels.append(self.encode_multi_class(mask_label, gender_label, origin_age_label))
-
-                self.indices.append(cnt)
-                self.groups.append(id)
-                cnt += 1
+        manifest = self.load_manifest()
+        self.set_rows(manifest)
+        self.origin_age_labels = self.age_labels
+        self.age_labels = TenAgeLabels.from_ages(manifest["age"])
+        self.indices = np.arange(len(self.age_labels), dtype=np.int32)
 
     def get_age_label(self, index):
-        return self.origin_age_labels[index], self.age_labels[index]
+        return int(self.origin_age_labels[index]), int(self.age_labels[index])
 
     def __getitem__(self, index):
         assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
@@ -401,83 +351,22 @@ class AgeBaseDataset(MaskBaseDataset):
 
     @staticmethod
     def encode_original_age(age_label) -> int:
-        original_age_label = torch.zeros_like(age_label)
-        for ind, age in enumerate(age_label):
-            if age <= 2:
-                original_age_label[ind] = 0
-            elif age <= 8:
-                original_age_label[ind] = 1
-            else:
-                original_age_label[ind] = 2
-        return original_age_label
-
-    def k_fold_split(self) -> List[List[Subset[Any]]]:
-        df = pd.DataFrame({"indices": self.indices, "group": self.groups, "labels": self.age_labels})
-
-        # k-fold 5
-        train, valid1 = train_test_apart_stratify(df, group='group', stratify='labels', test_size=self.val_ratio)
-        train, valid2 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=0.25)
-        train, valid3 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/3)
-        valid4, valid5 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/2)
-
-        val1_idx = valid1['indices'].tolist()
-        val2_idx = valid2['indices'].tolist()
-        val3_idx = valid3['indices'].tolist()
-        val4_idx = valid4['indices'].tolist()
-        val5_idx = valid5['indices'].tolist()
-
-        train1_idx = val2_idx + val3_idx + val4_idx + val5_idx
-        train2_idx = val1_idx + val3_idx + val4_idx + val5_idx
-        train3_idx = val1_idx + val2_idx + val4_idx + val5_idx
-        train4_idx = val1_idx + val2_idx + val3_idx + val5_idx
-        train5_idx = val1_idx + val2_idx + val3_idx + val4_idx
-
-        return [
-            [Subset(self, train1_idx), Subset(self, val1_idx)], [Subset(self, train2_idx), Subset(self, val2_idx)],
-            [Subset(self, train3_idx), Subset(self, val3_idx)], [Subset(self, train4_idx), Subset(self, val4_idx)],
-            [Subset(self, train5_idx), Subset(self, val5_idx)]
-        ]
+        """ 10 class age label 을 3 class age label 로 바꿉니다. (tensor 는 device 위에서 한 번에 lookup) """
+        return codec.ten_to_three(age_label)
 
 
 class MaskOnlyBaseDataset(MaskBaseDataset):
     num_classes = 3
-    indices = []
-    class_labels = []
-    groups = []
+    stratify = "mask_labels"
 
     def __init__(self, data_dir, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), val_ratio=0.2):
         super(MaskOnlyBaseDataset, self).__init__(data_dir, mean, std, val_ratio)
 
     def setup(self):
-        cnt = 0
-        profiles = os.listdir(self.data_dir)
-        for profile in profiles:
-            if profile.startswith("."):
-                continue
-
-            img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
-                _file_name, ext = os.path.splitext(file_name)
-                if _file_name not in self._file_names:
-                    continue
-
-                img_path = os.path.join(self.data_dir, profile, file_name)
-                mask_label = self._file_names[_file_name]
-
-                id, gender, race, age = profile.split("_")
-                gender_label = GenderLabels.from_str(gender)
-                origin_age_label = AgeLabels.from_number(age)
-                age_label = TenAgeLabels.from_age(age)
-
-                self.image_paths.append(img_path)
-                self.mask_labels.append(mask_label)
-                self.gender_labels.append(gender_label)
-                self.age_labels.append(age_label)
-                self.class_labels.append(self.encode_multi_class(mask_label, gender_label, origin_age_label))
-
-                self.indices.append(cnt)
-                self.groups.append(id)
-                cnt += 1
+        manifest = self.load_manifest()
+        self.set_rows(manifest)
+        self.age_labels = TenAgeLabels.from_ages(manifest["age"])
+        self.indices = np.arange(len(self.age_labels), dtype=np.int32)
 
     def __getitem__(self, index):
         assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
@@ -485,7 +374,7 @@ class MaskOnlyBaseDataset(MaskBaseDataset):
         image = self.read_image(index)
 
         image_transform = self.transform(image)
-        return image_transform, self.mask_labels[index]
+        return image_transform, int(self.mask_labels[index])
 
     def split_dataset(self) -> List[Subset[Any]]:
         df = pd.DataFrame({"indices": self.indices, "group": self.groups, "labels":self.mask_labels})
@@ -495,73 +384,19 @@ class MaskOnlyBaseDataset(MaskBaseDataset):
 
         return [Subset(self, train_index), Subset(self, valid_index)]
 
-    def k_fold_split(self) -> List[List[Subset[Any]]]:
-        df = pd.DataFrame({"indices": self.indices, "group": self.groups, "labels": self.mask_labels})
-
-        # k-fold 5
-        train, valid1 = train_test_apart_stratify(df, group='group', stratify='labels', test_size=self.val_ratio)
-        train, valid2 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=0.25)
-        train, valid3 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/3)
-        valid4, valid5 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/2)
-
-        val1_idx = valid1['indices'].tolist()
-        val2_idx = valid2['indices'].tolist()
-        val3_idx = valid3['indices'].tolist()
-        val4_idx = valid4['indices'].tolist()
-        val5_idx = valid5['indices'].tolist()
-
-        train1_idx = val2_idx + val3_idx + val4_idx + val5_idx
-        train2_idx = val1_idx + val3_idx + val4_idx + val5_idx
-        train3_idx = val1_idx + val2_idx + val4_idx + val5_idx
-        train4_idx = val1_idx + val2_idx + val3_idx + val5_idx
-        train5_idx = val1_idx + val2_idx + val3_idx + val4_idx
-
-        return [
-            [Subset(self, train1_idx), Subset(self, val1_idx)], [Subset(self, train2_idx), Subset(self, val2_idx)],
-            [Subset(self, train3_idx), Subset(self, val3_idx)], [Subset(self, train4_idx), Subset(self, val4_idx)],
-            [Subset(self, train5_idx), Subset(self, val5_idx)]
-        ]
-
 
 class GenderBaseDataset(MaskBaseDataset):
     num_classes = 2
-    indices = []
-    class_labels = []
-    groups = []
+    stratify = "gender_labels"
 
     def __init__(self, data_dir, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), val_ratio=0.2):
         super(GenderBaseDataset, self).__init__(data_dir, mean, std, val_ratio)
 
     def setup(self):
-        cnt = 0
-        profiles = os.listdir(self.data_dir)
-        for profile in profiles:
-            if profile.startswith("."):
-                continue
-
-            img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
-                _file_name, ext = os.path.splitext(file_name)
-                if _file_name not in self._file_names:
-                    continue
-
-                img_path = os.path.join(self.data_dir, profile, file_name)
-                mask_label = self._file_names[_file_name]
-
-                id, gender, race, age = profile.split("_")
-                gender_label = GenderLabels.from_str(gender)
-                origin_age_label = AgeLabels.from_number(age)
-                age_label = TenAgeLabels.from_age(age)
-
-                self.image_paths.append(img_path)
-                self.mask_labels.append(mask_label)
-                self.gender_labels.append(gender_label)
-                self.age_labels.append(age_label)
-                self.class_labels.append(self.encode_multi_class(mask_label, gender_label, origin_age_label))
-
-                self.indices.append(cnt)
-                self.groups.append(id)
-                cnt += 1
+        manifest = self.load_manifest()
+        self.set_rows(manifest)
+        self.age_labels = TenAgeLabels.from_ages(manifest["age"])
+        self.indices = np.arange(len(self.age_labels), dtype=np.int32)
 
     def __getitem__(self, index):
         assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
@@ -569,7 +404,7 @@ class GenderBaseDataset(MaskBaseDataset):
         image = self.read_image(index)
 
         image_transform = self.transform(image)
-        return image_transform, self.gender_labels[index]
+        return image_transform, int(self.gender_labels[index])
 
     def split_dataset(self) -> List[Subset[Any]]:
         df = pd.DataFrame({"indices": self.indices, "group": self.groups, "labels":self.gender_labels})
@@ -579,74 +414,18 @@ class GenderBaseDataset(MaskBaseDataset):
 
         return [Subset(self, train_index), Subset(self, valid_index)]
 
-    def k_fold_split(self) -> List[List[Subset[Any]]]:
-        df = pd.DataFrame({"indices": self.indices, "group": self.groups, "labels": self.gender_labels})
-
-        # k-fold 5
-        train, valid1 = train_test_apart_stratify(df, group='group', stratify='labels', test_size=self.val_ratio)
-        train, valid2 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=0.25)
-        train, valid3 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/3)
-        valid4, valid5 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/2)
-
-        val1_idx = valid1['indices'].tolist()
-        val2_idx = valid2['indices'].tolist()
-        val3_idx = valid3['indices'].tolist()
-        val4_idx = valid4['indices'].tolist()
-        val5_idx = valid5['indices'].tolist()
-
-        train1_idx = val2_idx + val3_idx + val4_idx + val5_idx
-        train2_idx = val1_idx + val3_idx + val4_idx + val5_idx
-        train3_idx = val1_idx + val2_idx + val4_idx + val5_idx
-        train4_idx = val1_idx + val2_idx + val3_idx + val5_idx
-        train5_idx = val1_idx + val2_idx + val3_idx + val4_idx
-
-        return [
-            [Subset(self, train1_idx), Subset(self, val1_idx)], [Subset(self, train2_idx), Subset(self, val2_idx)],
-            [Subset(self, train3_idx), Subset(self, val3_idx)], [Subset(self, train4_idx), Subset(self, val4_idx)],
-            [Subset(self, train5_idx), Subset(self, val5_idx)]
-        ]
-
 
 class ClassKFoldDataset(MaskBaseDataset):
     num_classes = 18
-    indexes = []
-    class_labels = []
-    groups = []
 
     def __init__(self, data_dir, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246), val_ratio=0.2):
         super(ClassKFoldDataset, self).__init__(data_dir, mean, std, val_ratio)
 
     def setup(self):
-        cnt = 0
-        profiles = os.listdir(self.data_dir)
-        for profile in profiles:
-            if profile.startswith("."):
-                continue
-
-            img_folder = os.path.join(self.data_dir, profile)
-            for file_name in os.listdir(img_folder):
-                _file_name, ext = os.path.splitext(file_name)
-                if _file_name not in self._file_names:
-                    continue
-
-                img_path = os.path.join(self.data_dir, profile, file_name)
-                mask_label = self._file_names[_file_name]
-
-                id, gender, race, age = profile.split("_")
-                gender_label = GenderLabels.from_str(gender)
-                origin_age_label = AgeLabels.from_number(age)
-                age_label = TenAgeLabels.from_age(age)
-
-                self.image_paths.append(img_path)
-                self.mask_labels.append(mask_label)
-                self.gender_labels.append(gender_label)
-                self.age_labels.append(age_label)
-                self.class_labels.append(self.encode_multi_class(mask_label, gender_label, origin_age_label))
-
-                self.indexes.append(cnt)
-                self.groups.append(id)
-                cnt += 1
-        self.class_labels = torch.tensor(self.class_labels)
+        manifest = self.load_manifest()
+        self.set_rows(manifest)
+        self.age_labels = TenAgeLabels.from_ages(manifest["age"])
+        self.indexes = np.arange(len(self.age_labels), dtype=np.int32)
 
     def __getitem__(self, index):
         assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
@@ -654,7 +433,7 @@ class ClassKFoldDataset(MaskBaseDataset):
         image = self.read_image(index)
 
         image_transform = self.transform(image)
-        return image_transform, self.class_labels[index]
+        return image_transform, int(self.class_labels[index])
 
     def split_dataset(self) -> List[Subset[Any]]:
         df = pd.DataFrame({"indices": self.indexes, "group": self.groups, "labels":self.class_labels})
@@ -664,32 +443,34 @@ class ClassKFoldDataset(MaskBaseDataset):
 
         return [Subset(self, train_index), Subset(self, valid_index)]
 
-    def k_fold_split(self) -> List[List[Subset[Any]]]:
-        df = pd.DataFrame({"indices": self.indexes, "group": self.groups, "labels": self.class_labels})
 
-        # k-fold 5
-        train, valid1 = train_test_apart_stratify(df, group='group', stratify='labels', test_size=self.val_ratio)
-        train, valid2 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=0.25)
-        train, valid3 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/3)
-        valid4, valid5 = train_test_apart_stratify(train, group='group', stratify='labels', test_size=1/2)
+class MultiTaskDataset(MaskBaseDataset):
+    """
+    이미지 한 장에 모든 label 을 dict 로 붙여 돌려주는 dataset 입니다. (main_multi.py)
+    mask / gender / age (10 class) / origin_age (3 class) / class (18 class)
+    """
+    num_classes = 18
+
+    def setup(self):
+        manifest = self.load_manifest()
+        self.set_rows(manifest)
+        self.origin_age_labels = self.age_labels
+        self.age_labels = TenAgeLabels.from_ages(manifest["age"])
 
-        val1_idx = valid1['indices'].tolist()
-        val2_idx = valid2['indices'].tolist()
-        val3_idx = valid3['indices'].tolist()
-        val4_idx = valid4['indices'].tolist()
-        val5_idx = valid5['indices'].tolist()
+    def get_labels(self, index):
+        return {
+            "mask": int(self.mask_labels[index]),
+            "gender": int(self.gender_labels[index]),
+            "age": int(self.age_labels[index]),
+            "origin_age": int(self.origin_age_labels[index]),
+            "class": int(self.class_labels[index]),
+        }
 
-        train1_idx = val2_idx + val3_idx + val4_idx + val5_idx
-        train2_idx = val1_idx + val3_idx + val4_idx + val5_idx
-        train3_idx = val1_idx + val2_idx + val4_idx + val5_idx
-        train4_idx = val1_idx + val2_idx + val3_idx + val5_idx
-        train5_idx = val1_idx + val2_idx + val3_idx + val4_idx
+    def __getitem__(self, index):
+        assert self.transform is not None, ".set_tranform 메소드를 이용하여 transform 을 주입해주세요"
 
-        return [
-            [Subset(self, train1_idx), Subset(self, val1_idx)], [Subset(self, train2_idx), Subset(self, val2_idx)],
-            [Subset(self, train3_idx), Subset(self, val3_idx)], [Subset(self, train4_idx), Subset(self, val4_idx)],
-            [Subset(self, train5_idx), Subset(self, val5_idx)]
-        ]
+        image_transform = self.transform(self.read_image(index))
+        return image_transform, self.get_labels(index)
 
 
 class Sampler(ImbalancedDatasetSampler):
@@ -711,18 +492,27 @@ class Sampler(ImbalancedDatasetSampler):
             raise NotImplementedError
 
 
-
 class TestDataset(Dataset):
     def __init__(self, img_paths, resize, mean=(0.548, 0.504, 0.479), std=(0.237, 0.247, 0.246)):
         div = 512/resize[0]
         self.img_paths = img_paths
-        self.transform = transforms.Compose([
+        self.mean = mean
+        self.std = std
+        self.pre_transform = transforms.Compose([
             Resize(resize, Image.BILINEAR),
             CenterCrop((400/div, 200/div)),
+        ])
+        self.transform = transforms.Compose([
+            self.pre_transform,
             ToTensor(),
             Normalize(mean=mean, std=std),
         ])
 
+    def store(self, cache_dir=None):
+        """ test set 을 한 번만 decode + pre_transform 해 둔 TensorStore. 모든 fold / task 의 inference 가 같이 씁니다. """
+        return TensorStore(self.img_paths, self.pre_transform, self.mean, self.std,
+                           cache_dir=cache_dir, key=repr(self.pre_transform))
+
     def __getitem__(self, index):
         image = Image.open(self.img_paths[index])
 
@@ -0,0 +1,116 @@
+"""
+logits.py 의 store 에 저장된 fold 별 logit 을 골라 model 없이 submission 을 만드는 ensemble CLI 입니다.
+
+run / model 은 glob pattern 으로, fold 는 번호로 고르고 `--weights PATTERN=W` 로 "run/model/task/fold{k}" 에
+맞는 logit 의 가중치를 줍니다. (처음 맞는 pattern 을 쓰고, 없으면 1)
+task 안에서는 softmax 확률을 (`--reduce logit_mean` 이면 logit 을) 가중 평균하고, 18 class submission 은
+"all" task 의 확률과 compose.py 의 mask x gender x age 결합 확률을 평균해 만듭니다.
+고른 logit 에 out-of-fold logit 이 모두 있으면 같은 조합의 OOF f1 도 출력하므로 가중치를 model 없이 비교할 수 있습니다.
+
+e.g. python ensemble.py --runs "exp*" --models ResNet18 EfficientNet4 --weights "*/EfficientNet4/*=2" --output ./outputs/ensemble.csv
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from compose import PARTS, compose_labels, joint_probs, macro_f1
+from logits import LogitStore, combine, key_weight
+
+
+def multi_class(results):
+    """ task 별 combine 결과 -> 18 class (probs, labels, covered) """
+    estimates = []
+    if "all" in results:
+        estimates.append(results["all"])
+    if all(task in results for task in PARTS):
+        size = min(len(results[task][0]) for task in PARTS)
+        (mask, mask_labels, mask_covered), (gender, gender_labels, gender_covered), (age, age_labels, age_covered) = [
+            tuple(None if value is None else value[:size] for value in results[task]) for task in PARTS
+        ]
+        probs = joint_probs(mask, gender, age)
+        labels = None if mask_labels is None else compose_labels(mask_labels, gender_labels, age_labels, age.shape[1])
+        estimates.append((probs, labels, mask_covered & gender_covered & age_covered))
+    if not estimates:
+        raise ValueError("18 class submission needs 'all' logits or all of mask / gender / age logits")
+
+    size = min(len(probs) for probs, _, _ in estimates)
+    probs = np.mean([probs[:size] for probs, _, _ in estimates], axis=0)
+    labels = estimates[0][1]
+    covered = np.logical_and.reduce([covered[:size] for _, _, covered in estimates])
+    return probs, None if labels is None else labels[:size], covered
+
+
+def report_oof(name, result):
+    probs, labels, covered = result
+    preds = probs[covered].argmax(axis=1)
+    f1 = macro_f1(preds, labels[covered], probs.shape[1])
+    acc = (preds == labels[covered]).mean()
+    print(f"[OOF] {name}: f1 {f1:4.4f}, acc {acc:4.2%} ({covered.sum()} images)")
+
+
+def main(args):
+    store = LogitStore(args.logit_dir)
+    weights = []
+    for item in args.weights:
+        pattern, weight = item.rsplit("=", 1)
+        weights.append((pattern, float(weight)))
+
+    tasks = ("all", *PARTS) if args.task == "all" else (args.task,)
+    keys = sorted({
+        key
+        for run in args.runs for model in args.models
+        for key in store.keys(run, model, folds=args.folds)
+        if key.task in tasks
+    })
+    if not keys:
+        raise FileNotFoundError(f"no logits in {args.logit_dir} for runs {args.runs} / models {args.models}")
+    for key in keys:
+        print(f"{key.run}/{key.model}/{key.task}/fold{key.fold} : weight {key_weight(key, weights)}")
+
+    by_task = {task: [key for key in keys if key.task == task] for task in tasks}
+    by_task = {task: task_keys for task, task_keys in by_task.items() if task_keys}
+    test = {task: combine(store, task_keys, weights, "test", args.reduce) for task, task_keys in by_task.items()}
+    oof = {
+        task: combine(store, task_keys, weights, "oof", args.reduce)
+        for task, task_keys in by_task.items()
+        if all(store.has(key, "oof") for key in task_keys)
+    }
+    for task, result in oof.items():
+        report_oof(task, result)
+
+    if args.task == "all":
+        probs = multi_class(test)[0]
+        if oof.keys() >= {"all"} or oof.keys() >= set(PARTS):
+            report_oof("18 class", multi_class(oof))
+    else:
+        probs = test[args.task][0]
+
+    submission = pd.read_csv(os.path.join(args.test_data_dir, 'info.csv'))
+    assert len(submission) == len(probs), f"{len(probs)} logits for {len(submission)} test images"
+    submission['ans'] = np.argmax(probs, axis=1)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    submission.to_csv(args.output, index=False)
+    print(f"{len(keys)} logits -> {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', nargs='+', default=['*'], help='run name glob patterns (default: *)')
+    parser.add_argument('--models', nargs='+', default=['*'], help='model name glob patterns, e.g. ResNet18 (default: *)')
+    parser.add_argument('--folds', nargs='+', type=int, default=None, help='fold numbers to use (default: all)')
+    parser.add_argument('--task', type=str, default='all', choices=['all', *PARTS],
+                        help='all: 18 class submission, or a single task submission (default: all)')
+    parser.add_argument('--weights', nargs='*', default=[], metavar='PATTERN=W',
+                        help='weight for logits matching "run/model/task/fold{k}" (default: 1)')
+    parser.add_argument('--reduce', type=str, default='mean', choices=['mean', 'logit_mean'],
+                        help='average softmax probabilities or logits within a task (default: mean)')
+    parser.add_argument('--logit_dir', type=str, default=os.environ.get('SM_LOGIT_DIR', './logits'))
+    parser.add_argument('--test_data_dir', type=str, default=os.environ.get('SM_CHANNEL_TEST'))
+    parser.add_argument('--output', type=str, default='./outputs/ensemble_submission.csv')
+
+    args = parser.parse_args()
+    print(args)
+
+    main(args)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+
+import numpy as np
+
+FOLDS_DIR = ".folds"
+
+
+def group_stratified_folds(groups, labels, n_splits=5, seed=42):
+    """
+    같은 group (사람) 의 row 는 같은 fold 에 들어가도록 하면서 label 분포를 fold 사이에 고르게 맞춥니다.
+    sklearn StratifiedGroupKFold 와 같은 greedy 방식으로, group 을 seed 로 섞은 뒤 label 분포가 치우친 group 부터
+    "넣었을 때 fold 별 label 비율의 표준편차가 가장 작아지는 fold" 에 배정합니다. (동률이면 row 수가 적은 fold)
+
+    return: row 별 fold 번호 (int8)
+    """
+    groups = np.unique(np.asarray(groups), return_inverse=True)[1]
+    labels = np.unique(np.asarray(labels), return_inverse=True)[1]
+    n_groups, n_labels = groups.max() + 1, labels.max() + 1
+
+    # (group, label) 별 row 수
+    counts = np.bincount(groups * n_labels + labels, minlength=n_groups * n_labels).reshape(n_groups, n_labels)
+    label_totals = counts.sum(axis=0)
+
+    order = np.random.RandomState(seed).permutation(n_groups)
+    order = order[np.argsort(-np.std(counts[order], axis=1), kind="stable")]
+
+    fold_counts = np.zeros((n_splits, n_labels), dtype=np.int64)
+    group_folds = np.empty(n_groups, dtype=np.int8)
+    candidates = np.eye(n_splits, dtype=np.int64)[:, :, None]  # (K candidate, K fold, 1)
+    for group in order:
+        trial = fold_counts[None] + candidates * counts[group]  # (K, K, L)
+        spread = np.std(trial / label_totals, axis=1).mean(axis=1)
+        best = np.flatnonzero(np.isclose(spread, spread.min()))
+        fold = best[np.argmin(fold_counts[best].sum(axis=1))]
+        fold_counts[fold] += counts[group]
+        group_folds[group] = fold
+
+    return group_folds[groups]
+
+
+def fold_assignment(groups, labels, n_splits=5, seed=42, cache_dir=None, key=b""):
+    """
+    `group_stratified_folds` 의 결과를 (n_splits, seed, key, groups, labels) 의 hash 로 `cache_dir` 에 저장하고
+    다음 실행이나 동시에 도는 fold job 에서는 계산 없이 그대로 읽어 같은 split 을 씁니다.
+    key 에는 manifest 의 경로 column 처럼 데이터셋을 식별하는 bytes 를 넘깁니다.
+    """
+    groups = np.ascontiguousarray(groups)
+    labels = np.ascontiguousarray(labels)
+
+    digest = hashlib.sha1(f"{n_splits}\0{seed}\0".encode())
+    for item in (key, groups.tobytes(), labels.tobytes()):
+        digest.update(item)
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, f"folds_k{n_splits}_seed{seed}_{digest.hexdigest()[:16]}.npy")
+        if os.path.exists(path):
+            return np.load(path)
+
+    folds = group_stratified_folds(groups, labels, n_splits, seed)
+
+    if path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp.{os.getpid()}.npy"
+            np.save(tmp_path, folds)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"[Warning] could not save fold assignment to {path}: {e}")
+    return folds
+
+
+def k_fold_indices(folds, n_splits):
+    """ fold 번호 array -> [(train index, valid index), ...] (numpy int64) """
+    return [(np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)) for fold in range(n_splits)]
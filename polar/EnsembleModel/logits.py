@@ -0,0 +1,159 @@
+"""
+fold 별 test / out-of-fold (OOF) logit 을 run / model / task / fold 단위로 저장하는 store 입니다.
+
+    {root}/{run}/{model}/{task}/fold{k}_test.npy       (N_test, K)  best model 의 test logit
+                                fold{k}_oof.npy        (N_valid, K) best model 의 validation logit
+                                fold{k}_oof_index.npy  (N_valid,)   train dataset 에서의 index
+                                fold{k}_oof_label.npy  (N_valid,)   정답 label
+
+logit 은 TTA 를 거친 값 그대로 (--tta_reduce mean / max 면 softmax 확률) 저장하고, 어느 쪽인지는
+fold{k}_meta.json 의 "kind" ("logits" / "probs") 에 남깁니다. (meta 가 없으면 logits 로 봅니다)
+파일은 모두 .npy 라 `load` 는 memmap 으로 열고, 쓰기는 tmp 파일 + os.replace 로 원자적으로 합니다.
+`combine` 은 고른 key 들의 logit 을 가중 평균하며, ensemble.py / compose.py 가 model 없이 이를 써서 submission 을 만듭니다.
+"""
+import json
+import os
+from collections import namedtuple
+from fnmatch import fnmatch
+
+import numpy as np
+
+SPLITS = ("test", "oof", "oof_index", "oof_label")
+KINDS = ("logits", "probs")
+
+LogitKey = namedtuple("LogitKey", ["run", "model", "task", "fold"])
+
+
+def model_name(args):
+    """ store 의 model 이름. e.g. ResNet18 """
+    return f"{args.model}{args.version}"
+
+
+class LogitStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key, split="test"):
+        return os.path.join(self.root, key.run, key.model, key.task, f"fold{key.fold}_{split}.npy")
+
+    def meta_path(self, key):
+        return os.path.join(self.root, key.run, key.model, key.task, f"fold{key.fold}_meta.json")
+
+    def save(self, key, kind="logits", **arrays):
+        """
+        `save(key, kind, test=..., oof=..., oof_index=..., oof_label=...)`. None 인 split 은 건너뜁니다.
+        kind 는 test / oof 가 logit 인지 softmax 확률인지 입니다. (e.g. TTA.output_kind)
+        """
+        assert kind in KINDS, f"kind should be one of {KINDS}, {kind}"
+        os.makedirs(os.path.dirname(self.meta_path(key)), exist_ok=True)
+        tmp_path = f"{self.meta_path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"kind": kind}, f)
+        os.replace(tmp_path, self.meta_path(key))
+        for split, array in arrays.items():
+            assert split in SPLITS, f"split should be one of {SPLITS}, {split}"
+            if array is None:
+                continue
+            path = self.path(key, split)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp_path, path)
+
+    def load(self, key, split="test"):
+        return np.load(self.path(key, split), mmap_mode="r")
+
+    def kind(self, key):
+        """ 저장된 값이 "logits" 인지 "probs" 인지. meta 가 없는 예전 store 는 logits 입니다. """
+        if not os.path.exists(self.meta_path(key)):
+            return "logits"
+        with open(self.meta_path(key), encoding="utf-8") as f:
+            return json.load(f)["kind"]
+
+    def has(self, key, split="test"):
+        return os.path.exists(self.path(key, split))
+
+    def keys(self, run="*", model="*", task="*", folds=None):
+        """ 저장된 test logit 의 key 목록. run / model / task 는 glob pattern, folds 는 fold 번호 list 입니다. """
+        keys = []
+        if not os.path.isdir(self.root):
+            return keys
+        for run_name in sorted(os.listdir(self.root)):
+            if not fnmatch(run_name, run):
+                continue
+            for model_dir in sorted(os.listdir(os.path.join(self.root, run_name))):
+                if not fnmatch(model_dir, model):
+                    continue
+                for task_name in sorted(os.listdir(os.path.join(self.root, run_name, model_dir))):
+                    if not fnmatch(task_name, task):
+                        continue
+                    for file_name in sorted(os.listdir(os.path.join(self.root, run_name, model_dir, task_name))):
+                        if not (file_name.startswith("fold") and file_name.endswith("_test.npy")):
+                            continue
+                        fold = int(file_name[len("fold"):-len("_test.npy")])
+                        if folds is None or fold in folds:
+                            keys.append(LogitKey(run_name, model_dir, task_name, fold))
+        return keys
+
+
+def softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def as_probs(values, kind="logits"):
+    """ logit 은 softmax 하고, 확률은 (e.g. TTA max 처럼 합이 1 이 아니어도) 합이 1 이 되게만 맞춥니다. """
+    if kind == "probs":
+        return values / np.maximum(values.sum(axis=-1, keepdims=True), 1e-12)
+    return softmax(values)
+
+
+def as_logits(values, kind="logits"):
+    """ 확률은 log 확률로 바꿉니다. (softmax 하면 같은 확률이 되는 logit) """
+    return np.log(np.maximum(as_probs(values, kind), 1e-12)) if kind == "probs" else values
+
+
+def key_weight(key, weights=()):
+    """ "run/model/task/fold{k}" 에 처음 맞는 (pattern, weight) 의 weight. 없으면 1 """
+    name = f"{key.run}/{key.model}/{key.task}/fold{key.fold}"
+    for pattern, weight in weights:
+        if fnmatch(name, pattern):
+            return weight
+    return 1.
+
+
+def combine(store, keys, weights=(), split="test", reduce="mean"):
+    """
+    keys 의 logit 을 가중 평균한 확률 (N, K) 과 label, 값이 있는 row mask 를 돌려줍니다.
+    reduce="mean" 은 softmax 확률을, "logit_mean" 은 logit 을 평균한 뒤 softmax 합니다.
+    확률로 저장된 key (store.kind) 는 softmax 를 다시 하지 않고, logit_mean 에서는 log 확률로 평균합니다.
+    split="oof" 면 fold 마다 다른 validation row 를 train dataset index 자리에 모읍니다. (test 는 label 이 None)
+    """
+    if split == "test":
+        indices = [np.arange(len(store.load(key, "test"))) for key in keys]
+    else:
+        indices = [np.asarray(store.load(key, "oof_index")) for key in keys]
+    size = max(int(index.max()) + 1 for index in indices)
+
+    total, weight_sum = None, np.zeros(size)
+    labels = None if split == "test" else np.full(size, -1, dtype=np.int64)
+    for key, index in zip(keys, indices):
+        logits = np.asarray(store.load(key, split), dtype=np.float64)
+        if total is None:
+            total = np.zeros((size, logits.shape[1]))
+        assert logits.shape[1] == total.shape[1], f"{key} has {logits.shape[1]} classes, expected {total.shape[1]}"
+
+        weight = key_weight(key, weights)
+        kind = store.kind(key)
+        total[index] += weight * (as_logits(logits, kind) if reduce == "logit_mean" else as_probs(logits, kind))
+        weight_sum[index] += weight
+        if labels is not None:
+            labels[index] = store.load(key, "oof_label")
+
+    covered = weight_sum > 0
+    probs = total / np.maximum(weight_sum, 1e-12)[:, None]
+    if reduce == "logit_mean":
+        probs = softmax(probs)
+    return probs, labels, covered
@@ -6,7 +6,6 @@ from importlib import import_module
 import pandas as pd
 import wandb
 from adamp import AdamP
-from sklearn.metrics import f1_score
 from torch.utils.data import DataLoader
 from torch.utils.tensorboard import SummaryWriter
 from torchvision import transforms
@@ -15,7 +14,13 @@ from torchvision.transforms import Normalize, ToPILImage
 from utils import *
 
 from dataset import AgeBaseDataset, TestDataset
+from checkpoint import CheckpointManager
+from parallel import run_folds
+from tta import TTA
+from logits import LogitKey, LogitStore, model_name
+from export import onnx_backend
 from loss import *
+from metrics import ConfusionMatrix, StepTimer
 
 
 def get_lr(optimizer):
@@ -32,20 +37,251 @@ def get_num_classes(task):
         return 3
 
 
-def main(args):
-    if args.wandb:
-        log_list = ['epochs', 'lr', 'batch_size', 'criterion', 'optimizer', 'scheduler',
-                    'augmentation']  # if add log hyperparameter args, add at this list
-        config = {k: v for k, v in vars(args).items() if k in log_list}
-        wandb.init(project='Ensembles', entity='kbp0237', name=args.name, config=config)
+def init_wandb(args, name=None):
+    log_list = ['epochs', 'lr', 'batch_size', 'criterion', 'optimizer', 'scheduler',
+                'augmentation']  # if add log hyperparameter args, add at this list
+    config = {k: v for k, v in vars(args).items() if k in log_list}
+    wandb.init(project='Ensembles', entity='kbp0237', name=name or args.name, config=config)
 
-    seed_everything(args.seed)
-    save_dir = increment_path(os.path.join(args.model_dir, args.name), args)
 
-    # --settings
+def train_fold(args, fold, train_set, val_set, test_store, num_classes, save_dir, num_workers=None):
+    """ fold 하나를 학습하고 best model 의 test logit 과 fold 의 best 기록을 돌려줍니다. (parallel.run_folds) """
+    if args.fold_workers > 1:
+        # fold 마다 따로 뜬 process 이므로 seed / wandb run 을 fold 별로 잡습니다
+        seed_everything(args.seed + fold)
+        if args.wandb:
+            init_wandb(args, name=f"{args.name}_fold{fold + 1}")
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count() // 2
+
     use_cuda = torch.cuda.is_available()
     device = torch.device('cuda' if use_cuda else 'cpu')
 
+    train_loader = DataLoader(
+        train_set,
+        batch_size=args.batch_size,
+        num_workers=num_workers,
+        shuffle=True,
+        pin_memory=use_cuda,
+        drop_last=True
+    )
+    val_loader = DataLoader(
+        val_set,
+        batch_size=args.valid_batch_size,
+        num_workers=num_workers,
+        shuffle=True,
+        pin_memory=use_cuda,
+        drop_last=True
+    )
+
+    model_module = getattr(import_module('model'), args.model)
+    model = model_module(num_classes=num_classes, version=args.version).to(device)
+
+    # -- criterion / optimizer
+    criterion = create_criterion(args.criterion)
+    # opt_module = getattr(import_module('torch.optim'), args.optimizer)
+    optimizer = AdamP(
+        params=model.parameters(),
+        lr=args.lr,
+        weight_decay=1e-5
+    )
+    sch_module = getattr(import_module('torch.optim.lr_scheduler'), args.scheduler)
+    scheduler = sch_module(
+        optimizer,
+        **args.sch_params
+    )
+
+    # -- logging
+    logger = SummaryWriter(log_dir=save_dir)
+    with open(os.path.join(save_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(vars(args), f, ensure_ascii=True, indent=4)
+
+    if args.wandb:
+        wandb.watch(model, log='all', log_freq=args.log_interval,
+                    log_graph=False)
+
+    best_val_acc = 0
+    best_val_loss = np.inf
+    best_val_f1 = 0
+    checkpoints = CheckpointManager(save_dir, top_k=args.save_top_k, best_name=f"fold{fold}_best.pth")
+    patience = 10
+    counter = 0
+    real_use = 0
+
+    print(f"Fold {fold + 1} Start!")
+    for epoch in range(args.epochs):
+        model.train()
+        # step 마다 .item() 으로 sync 하지 않도록 device 위에서 누적하고 log_interval 에서만 읽습니다
+        loss_value = torch.zeros((), device=device)
+        matches = torch.zeros((), dtype=torch.int64, device=device)
+        origin_matches = torch.zeros((), dtype=torch.int64, device=device)
+
+        train_metric = ConfusionMatrix(num_classes, device=device)
+        origin_metric = ConfusionMatrix(3, device=device)
+
+        train_f1 = 0
+        origin_f1 = 0
+        avg_train_loss = torch.zeros((), device=device)
+        step_timer = StepTimer(device)
+        for idx, batch in enumerate(train_loader):
+            inputs, origin_age, age = batch
+            inputs, origin_age, age = inputs.to(device), origin_age.to(device), age.to(device)
+
+            optimizer.zero_grad()
+
+            outputs = model(inputs)
+            preds = torch.argmax(outputs, dim=-1)
+            real_preds = AgeBaseDataset.encode_original_age(preds)
+
+            train_metric.update(preds, age)
+            origin_metric.update(real_preds, origin_age)
+
+            loss = criterion(outputs, age)
+
+            loss.backward()
+            optimizer.step()
+
+            avg_train_loss += loss.detach()
+            loss_value += loss.detach()
+            matches += (preds == age).sum()
+            origin_matches += (origin_age == real_preds).sum()
+
+            step_timer.step()
+
+            if (idx + 1) % args.log_interval == 0:
+                step_time = step_timer.read()
+                train_loss = loss_value.item() / args.log_interval
+                train_acc = matches.item() / args.batch_size / args.log_interval
+                real_acc = origin_matches.item() / args.batch_size / args.log_interval
+                train_f1 = train_metric.f1()
+                origin_f1 = origin_metric.f1()
+                current_lr = get_lr(optimizer)
+                print(
+                    f"Fold {fold} - Epoch[{epoch + 1:3}/{args.epochs}]({idx + 1:>3}/{len(train_loader)}) || "
+                    f"training loss {train_loss:4.4f} || "
+                    f"training f1 score {train_f1:4.4f} || origin f1 score {origin_f1:4.4f} || "
+                    f"training accuracy {train_acc:4.2%} || origin accuracy {real_acc:4.2%} || "
+                    f"lr {current_lr:4.6f} || step time {step_time:4.1f}ms"
+                )
+
+                loss_value.zero_()
+                matches.zero_()
+                origin_matches.zero_()
+
+        scheduler.step()
+
+        with torch.no_grad():
+            print("Calculating validation results...")
+            model.eval()
+            val_loss_items = []
+            val_metric = ConfusionMatrix(num_classes, device=device)
+            val_origin_metric = ConfusionMatrix(3, device=device)
+            diff_images = []
+
+            for val_batch in val_loader:
+                inputs, val_origin_age, val_age = val_batch
+                inputs, val_origin_age, val_age = inputs.to(device), val_origin_age.to(device), val_age.to(device)
+
+                val_outputs = model(inputs)
+                val_preds = torch.argmax(val_outputs, dim=-1)
+                val_real_preds = AgeBaseDataset.encode_original_age(val_preds)
+
+                loss_item = criterion(val_outputs, val_age)
+
+                val_loss_items.append(loss_item)
+                val_metric.update(val_preds, val_age)
+                val_origin_metric.update(val_real_preds, val_origin_age)
+
+            val_loss = np.sum(val_loss_items) / len(val_loader)
+            val_acc = val_metric.accuracy()
+            val_f1 = val_metric.f1()
+            val_origin_f1 = val_origin_metric.f1()
+            best_val_loss = min(best_val_loss, val_loss)
+            best_val_acc = max(best_val_acc, val_acc)
+
+            if args.wandb:
+                total_train_acc = train_metric.accuracy()
+                avg_train_loss = avg_train_loss.item() / len(train_loader)
+                val_label_array, val_pred_array = val_metric.expand()
+                wandb.log({
+                    f"Fold {fold + 1}": {"Avg Loss": {"train loss": avg_train_loss, "val loss": val_loss},
+                                         "F1 Score": {"train f1 score": train_f1, "val f1 score": val_f1},
+                                         "Accuracy": {"train acc": total_train_acc, "val acc": val_acc}},
+                    "confusion mat": wandb.plot.confusion_matrix(preds=val_pred_array,
+                                                                 y_true=val_label_array)
+                    # "Wrong Images": diff_images
+                })
+
+            if checkpoints.update(model, val_f1, tag=f"fold_{fold}_epoch_{epoch:03}"):
+                print(f"New best model for val f1 score : {val_f1:4.4f}! saving the best model..")
+                best_val_f1 = val_f1
+                counter = 0
+            else:
+                counter += 1
+
+            if counter > patience:
+                print("Early Stopping....")
+                break
+
+            checkpoints.save(model, f"fold{fold}_last.pth")
+            print(
+                f"[Val] f1: {val_f1:4.4f}, origin f1: {val_origin_f1:4.4f}, acc : {val_acc:4.2%}, loss: {val_loss:4.2} || "
+                f"best f1: {best_val_f1:4.4f}, best acc : {best_val_acc:4.2%}, best loss: {best_val_loss:4.4f}"
+            )
+            print()
+
+
+
+    checkpoints.close()
+    checkpoints.load_best(model)
+
+    print("Evaluation Start!")
+    predictor, test_device = model, device
+    if args.backend == 'onnxruntime':
+        # best model 을 fold 별 ONNX 로 export (parity 확인) 해 onnxruntime CPU 로 예측합니다
+        predictor = onnx_backend(model, os.path.join(save_dir, f"fold{fold}.onnx"), test_store.array.shape[-2:],
+                                 args.onnx_threads)
+        test_device = torch.device('cpu')
+    tta = TTA(args.tta, args.tta_reduce)  # views 는 batch 하나로 쌓아 forward 한 번
+    all_predictions = []
+    with torch.no_grad():
+        for images in test_store.batches(32, test_device):  # decode 없이 한 번 만들어 둔 test tensor
+            pred = tta(predictor, images)
+            all_predictions.extend(pred.cpu().numpy())
+
+        fold_pred = np.array(all_predictions)
+    views_per_sec, images_per_sec = tta.report()
+    print(f"{tta} : {views_per_sec:.1f} views/s, {images_per_sec:.1f} images/s")
+
+    # -- out-of-fold logit : best model 로 validation set 을 순서대로 (drop_last 없이) 한 번 더 예측해 test logit 과 같이 저장합니다
+    # validation batch 는 --resize 크기라 test 크기로 export 한 ONNX 가 아닌 PyTorch model 로 예측합니다
+    oof_loader = DataLoader(val_set, batch_size=args.valid_batch_size, num_workers=num_workers,
+                            shuffle=False, pin_memory=use_cuda)
+    oof_logits, oof_labels = [], []
+    with torch.no_grad():
+        for inputs, *_, labels in oof_loader:
+            oof_logits.append(tta(model, inputs.to(device)).cpu().numpy())
+            oof_labels.append(labels.numpy())
+    LogitStore(args.logit_dir).save(
+        LogitKey(os.path.basename(save_dir), model_name(args), "age", fold), tta.output_kind,
+        test=fold_pred, oof=np.concatenate(oof_logits),
+        oof_index=np.asarray(val_set.indices), oof_label=np.concatenate(oof_labels),
+    )
+
+    if args.wandb and args.fold_workers > 1:
+        wandb.finish()
+    print("Evaluation End")
+    print()
+    return fold_pred, {"f1": best_val_f1, "acc": best_val_acc, "loss": best_val_loss}
+
+
+def main(args):
+    if args.wandb and args.fold_workers <= 1:
+        init_wandb(args)
+
+    seed_everything(args.seed)
+    save_dir = increment_path(os.path.join(args.model_dir, args.name), args)
+
     # -- dataset
     dataset = AgeBaseDataset(data_dir=args.data_dir)
     num_classes = 10
@@ -70,226 +306,22 @@ def main(args):
     submission = pd.read_csv(info_path)
     image_paths = [os.path.join(image_dir, img_id) for img_id in submission.ImageID]
     test_dataset = TestDataset(image_paths, resize=(512, 384))
+    test_store = test_dataset.store(args.cache_dir)  # 모든 fold 가 같이 쓰도록 test set 은 한 번만 decode
 
-    test_loader = DataLoader(
-        test_dataset,
-        shuffle=False,
-        batch_size=32
-    )
+    fold_list = dataset.k_fold_split(args.n_split, args.seed)
+    dataset.set_transform(transform)
+    if args.cache_dir:
+        dataset.enable_cache(args.cache_dir)
+    jobs = [(args, fold, *fold_list[fold], test_store, num_classes, save_dir) for fold in range(args.n_split)]
+    results = run_folds(train_fold, jobs, n_jobs=args.fold_workers)
 
-    fold_list = dataset.k_fold_split()
     oof_pred = None
-
-    for fold in range(5):
-        train_set, val_set = fold_list[fold]
-        train_set.dataset.set_transform(transform)
-        val_set.dataset.set_transform(transform)
-        train_loader = DataLoader(
-            train_set,
-            batch_size=args.batch_size,
-            num_workers=multiprocessing.cpu_count()//2,
-            shuffle=True,
-            pin_memory=use_cuda,
-            drop_last=True
-        )
-        val_loader = DataLoader(
-            val_set,
-            batch_size=args.valid_batch_size,
-            num_workers=multiprocessing.cpu_count() // 2,
-            shuffle=True,
-            pin_memory=use_cuda,
-            drop_last=True
-        )
-
-        model_module = getattr(import_module('model'), args.model)
-        model = model_module(num_classes=num_classes, version=args.version).to(device)
-
-        # -- criterion / optimizer
-        criterion = create_criterion(args.criterion)
-        # opt_module = getattr(import_module('torch.optim'), args.optimizer)
-        optimizer = AdamP(
-            params=model.parameters(),
-            lr=args.lr,
-            weight_decay=1e-5
-        )
-        sch_module = getattr(import_module('torch.optim.lr_scheduler'), args.scheduler)
-        scheduler = sch_module(
-            optimizer,
-            **args.sch_params
-        )
-
-        # -- logging
-        logger = SummaryWriter(log_dir=save_dir)
-        with open(os.path.join(save_dir, 'config.json'), 'w', encoding='utf-8') as f:
-            json.dump(vars(args), f, ensure_ascii=True, indent=4)
-
-        if args.wandb:
-            wandb.watch(model, log='all', log_freq=args.log_interval,
-                        log_graph=False)
-
-        best_val_acc = 0
-        best_val_loss = np.inf
-        best_val_f1 = 0
-        best_model = None
-        patience = 10
-        counter = 0
-        real_use = 0
-
-        print(f"Fold {fold + 1} Start!")
-        for epoch in range(args.epochs):
-            model.train()
-            loss_value = 0
-            matches = 0
-            origin_matches = 0
-
-            pred_list = []
-            label_list = []
-            origin_list = []
-            origin_label_list = []
-
-            train_f1 = 0
-            origin_f1 = 0
-            avg_train_loss = 0
-            for idx, batch in enumerate(train_loader):
-                inputs, origin_age, age = batch
-                inputs, origin_age, age = inputs.to(device), origin_age.to(device), age.to(device)
-
-                optimizer.zero_grad()
-
-                outputs = model(inputs)
-                preds = torch.argmax(outputs, dim=-1)
-                real_preds = AgeBaseDataset.encode_original_age(preds)
-
-                pred_list.extend(preds.cpu().numpy())
-                label_list.extend(age.cpu().numpy())
-                origin_list.extend(real_preds.cpu().numpy())
-                origin_label_list.extend(origin_age.cpu().numpy())
-
-                loss = criterion(outputs, age)
-
-                loss.backward()
-                optimizer.step()
-
-                avg_train_loss += loss.item()
-                loss_value += loss.item()
-                matches += (preds == age).sum().item()
-                origin_matches += (origin_age == real_preds).sum().item()
-
-                if (idx + 1) % args.log_interval == 0:
-                    train_loss = loss_value / args.log_interval
-                    train_acc = matches / args.batch_size / args.log_interval
-                    real_acc = origin_matches / args.batch_size / args.log_interval
-                    train_f1 = f1_score(pred_list, label_list, average="macro")
-                    origin_f1 = f1_score(origin_list, origin_label_list, average="macro")
-                    current_lr = get_lr(optimizer)
-                    print(
-                        f"Fold {fold} - Epoch[{epoch + 1:3}/{args.epochs}]({idx + 1:>3}/{len(train_loader)}) || "
-                        f"training loss {train_loss:4.4f} || "
-                        f"training f1 score {train_f1:4.4f} || origin f1 score {origin_f1:4.4f} || "
-                        f"training accuracy {train_acc:4.2%} || origin accuracy {real_acc:4.2%} || "
-                        f"lr {current_lr:4.6f}"
-                    )
-
-                    loss_value = 0
-                    matches = 0
-                    origin_matches = 0
-
-            scheduler.step()
-
-            with torch.no_grad():
-                print("Calculating validation results...")
-                model.eval()
-                val_loss_items = []
-                val_acc_items = []
-                val_origin_acc_items = []
-                val_pred_list = []
-                val_origin_pred_list = []
-                val_label_list = []
-                val_origin_label_list = []
-                diff_images = []
-
-                for val_batch in val_loader:
-                    inputs, val_origin_age, val_age = val_batch
-                    inputs, val_origin_age, val_age = inputs.to(device), val_origin_age.to(device), val_age.to(device)
-
-                    val_outputs = model(inputs)
-                    val_preds = torch.argmax(val_outputs, dim=-1)
-                    val_real_preds = AgeBaseDataset.encode_original_age(val_preds)
-
-                    loss_item = criterion(val_outputs, val_age)
-                    acc_item = (val_age == val_preds).sum().item()
-                    origin_acc_item = (val_origin_age == val_real_preds).sum().item()
-
-                    val_loss_items.append(loss_item)
-
-                    val_acc_items.append(acc_item)
-                    val_origin_acc_items.append(origin_acc_item)
-
-                    val_pred_list.extend(val_preds.cpu().numpy())
-                    val_label_list.extend(val_age.cpu().numpy())
-                    val_origin_pred_list.extend(val_real_preds.cpu().numpy())
-                    val_origin_label_list.extend(val_origin_age.cpu().numpy())
-
-                val_loss = np.sum(val_loss_items) / len(val_loader)
-                val_acc = np.sum(val_acc_items) / len(val_set)
-                val_f1 = f1_score(val_pred_list, val_label_list, average='macro')
-                val_origin_f1 = f1_score(val_origin_pred_list, val_origin_label_list, average='macro')
-                best_val_loss = min(best_val_loss, val_loss)
-                best_val_acc = max(best_val_acc, val_acc)
-
-                if args.wandb:
-                    total_train_acc = matches / len(train_set)
-                    avg_train_loss = avg_train_loss / len(train_loader)
-                    wandb.log({
-                        f"Fold {fold + 1}": {"Avg Loss": {"train loss": avg_train_loss, "val loss": val_loss},
-                                             "F1 Score": {"train f1 score": train_f1, "val f1 score": val_f1},
-                                             "Accuracy": {"train acc": total_train_acc, "val acc": val_acc}},
-                        "confusion mat": wandb.plot.confusion_matrix(preds=np.array(val_pred_list),
-                                                                     y_true=np.array(val_label_list))
-                        # "Wrong Images": diff_images
-                    })
-
-                if val_f1 > best_val_f1:
-                    print(f"New best model for val f1 score : {val_f1:4.4f}! saving the best model..")
-                    torch.save(model.state_dict(), f"{save_dir}/best.pth")
-                    torch.save(model.state_dict(), f"{save_dir}/fold_{fold}_epoch_{epoch:03}_f1_{val_f1}.pth")
-                    best_val_f1 = val_f1
-                    best_model = model
-                    counter = 0
-                else:
-                    counter += 1
-
-                if counter > patience:
-                    print("Early Stopping....")
-                    break
-
-                torch.save(model.state_dict(), f"{save_dir}/last.pth")
-                print(
-                    f"[Val] f1: {val_f1:4.4f}, origin f1: {val_origin_f1:4.4f}, acc : {val_acc:4.2%}, loss: {val_loss:4.2} || "
-                    f"best f1: {best_val_f1:4.4f}, best acc : {best_val_acc:4.2%}, best loss: {best_val_loss:4.4f}"
-                )
-                print()
-
-
-
-        print("Evaluation Start!")
-        all_predictions = []
-        with torch.no_grad():
-            for images in test_loader:
-                images = images.to(device)
-
-                pred = model(images)
-                # pred += best_model(torch.flip(images, dims=(-1,))) / 2
-                all_predictions.extend(pred.cpu().numpy())
-
-            fold_pred = np.array(all_predictions)
-
+    for fold, (fold_pred, best) in enumerate(results):
+        print(f"Fold {fold + 1} best f1: {best['f1']:4.4f}, best acc : {best['acc']:4.2%}, best loss: {best['loss']:4.4f}")
         if oof_pred is None:
-            oof_pred = fold_pred / 5
+            oof_pred = fold_pred / args.n_split
         else:
-            oof_pred += fold_pred / 5
-        print("Evaluation End")
-        print()
+            oof_pred += fold_pred / args.n_split
 
     submission['ans'] = np.argmax(oof_pred, axis=1)
     submission.to_csv(os.path.join(args.output_dir, f'submission_age_prediction_{args.model}_{args.version}.csv'), index=False)
@@ -0,0 +1,299 @@
+import json
+import multiprocessing
+import os
+from importlib import import_module
+
+import pandas as pd
+import wandb
+from adamp import AdamP
+from torch.utils.data import DataLoader
+from torch.utils.tensorboard import SummaryWriter
+
+from utils import *
+
+from dataset import MultiTaskDataset, TestDataset
+from checkpoint import CheckpointManager
+from parallel import run_folds
+from loss import *
+from metrics import StepTimer
+from multitask import TaskTrainer, task_inputs
+from tta import TTA
+from logits import LogitKey, LogitStore, model_name
+from export import onnx_backend
+
+# main_mask.py / main_gender.py / main_age.py 의 task 를 decode 한 번으로 같이 학습합니다
+# task: (label column, num_classes)
+TASKS = {
+    "mask": ("mask", 3),
+    "gender": ("gender", 2),
+    "age": ("age", 10),
+}
+# task 별 test resize: main_mask.py / main_age.py 는 (512, 384) 고정, main_gender.py 는 --resize (None)
+TEST_RESIZE = {
+    "mask": (512, 384),
+    "gender": None,
+    "age": (512, 384),
+}
+
+
+def get_lr(optimizer):
+    for param_group in optimizer.param_groups:
+        return param_group['lr']
+
+
+def parse_size(size):
+    """ "256x192" -> (256, 192) """
+    if size is None:
+        return None
+    height, width = str(size).split('x')
+    return int(height), int(width)
+
+
+def init_wandb(args, name=None):
+    log_list = ['epochs', 'lr', 'batch_size', 'criterion', 'optimizer', 'scheduler',
+                'augmentation', 'tasks', 'task_resize']  # if add log hyperparameter args, add at this list
+    config = {k: v for k, v in vars(args).items() if k in log_list}
+    wandb.init(project='Ensembles', entity='kbp0237', name=name or args.name, config=config)
+
+
+def build_trainers(args, device, save_dir, fold):
+    trainers = []
+    for task in args.tasks:
+        label, num_classes = TASKS[task]
+        model_module = getattr(import_module('model'), args.model)
+        model = model_module(num_classes=num_classes, version=args.version).to(device)
+        optimizer = AdamP(
+            params=model.parameters(),
+            lr=args.lr,
+            weight_decay=1e-5
+        )
+        sch_module = getattr(import_module('torch.optim.lr_scheduler'), args.scheduler)
+        trainers.append(TaskTrainer(
+            task, model, label, num_classes,
+            criterion=create_criterion(args.criterion),
+            optimizer=optimizer,
+            scheduler=sch_module(optimizer, **args.sch_params),
+            size=parse_size(args.task_resize.get(task)),
+            checkpoints=CheckpointManager(save_dir, top_k=args.save_top_k, prefix=f"{task}_",
+                                          best_name=f"fold{fold}_{task}_best.pth"),
+            patience=args.patience,
+        ))
+    return trainers
+
+
+def train_fold(args, fold, train_set, val_set, test_stores, save_dir, num_workers=None):
+    """ fold 하나에서 모든 task 를 학습하고 task 별 test logit 과 best f1 을 돌려줍니다. (parallel.run_folds) """
+    if args.fold_workers > 1:
+        # fold 마다 따로 뜬 process 이므로 seed / wandb run 을 fold 별로 잡습니다
+        seed_everything(args.seed + fold)
+        if args.wandb:
+            init_wandb(args, name=f"{args.name}_fold{fold + 1}")
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count() // 2
+
+    use_cuda = torch.cuda.is_available()
+    device = torch.device('cuda' if use_cuda else 'cpu')
+
+    train_loader = DataLoader(
+        train_set,
+        batch_size=args.batch_size,
+        num_workers=num_workers,
+        shuffle=True,
+        pin_memory=use_cuda,
+        drop_last=True
+    )
+    val_loader = DataLoader(
+        val_set,
+        batch_size=args.valid_batch_size,
+        num_workers=num_workers,
+        shuffle=False,
+        pin_memory=use_cuda,
+        drop_last=True
+    )
+
+    trainers = build_trainers(args, device, save_dir, fold)
+
+    # -- logging
+    logger = SummaryWriter(log_dir=save_dir)
+    with open(os.path.join(save_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(vars(args), f, ensure_ascii=True, indent=4)
+
+    print(f"Fold {fold + 1} Start! tasks: {[trainer.name for trainer in trainers]}")
+    for epoch in range(args.epochs):
+        active = [trainer for trainer in trainers if trainer.active]
+        if not active:
+            print("Early Stopping....")
+            break
+
+        for trainer in active:
+            trainer.start_epoch(device)
+        step_timer = StepTimer(device)
+        for idx, (inputs, labels) in enumerate(train_loader):
+            # decode / augmentation 한 batch 를 모든 task 가 같이 씁니다
+            inputs = inputs.to(device)
+            labels = {key: value.to(device) for key, value in labels.items()}
+            for trainer, images in zip(active, task_inputs(inputs, active)):
+                trainer.train_step(images, labels)
+
+            step_timer.step()
+
+            if (idx + 1) % args.log_interval == 0:
+                step_time = step_timer.read()
+                results = []
+                for trainer in active:
+                    train_loss = trainer.loss_value.item() / args.log_interval
+                    results.append(f"{trainer.name} loss {train_loss:4.4f} f1 {trainer.metric.f1():4.4f}")
+                    trainer.loss_value.zero_()
+                print(
+                    f"Fold {fold + 1} - Epoch[{epoch + 1:3}/{args.epochs}]({idx + 1:>3}/{len(train_loader)}) || "
+                    f"{' || '.join(results)} || "
+                    f"lr {get_lr(active[0].optimizer):4.6f} || step time {step_time:4.1f}ms"
+                )
+
+        for trainer in active:
+            trainer.end_epoch()
+
+        print("Calculating validation results...")
+        for trainer in active:
+            trainer.start_validation(device)
+        with torch.no_grad():
+            for inputs, labels in val_loader:
+                inputs = inputs.to(device)
+                labels = {key: value.to(device) for key, value in labels.items()}
+                for trainer, images in zip(active, task_inputs(inputs, active)):
+                    trainer.val_step(images, labels)
+
+        log = {}
+        for trainer in active:
+            val_loss = trainer.val_loss.item() / max(trainer.val_batches, 1)
+            val_f1 = trainer.val_metric.f1()
+            val_acc = trainer.val_metric.accuracy()
+            trainer.checkpoints.save(trainer.model, f"fold{fold}_{trainer.name}_last.pth")
+            if trainer.update_best(val_f1, tag=f"fold_{fold}_epoch_{epoch:03}"):
+                print(f"[{trainer.name}] New best model for val f1 score : {val_f1:4.4f}! saving the best model..")
+            print(
+                f"[Val][{trainer.name}] f1: {val_f1:4.4f}, acc : {val_acc:4.2%}, loss: {val_loss:4.2} || "
+                f"best f1: {trainer.best_f1:4.4f}"
+            )
+            logger.add_scalar(f"Val/{trainer.name}_loss", val_loss, epoch)
+            logger.add_scalar(f"Val/{trainer.name}_f1", val_f1, epoch)
+            log[trainer.name] = {"val loss": val_loss, "val f1 score": val_f1, "val acc": val_acc}
+        if args.wandb:
+            wandb.log({f"Fold {fold + 1}": log})
+        print()
+
+    for trainer in trainers:
+        trainer.checkpoints.close()
+        trainer.checkpoints.load_best(trainer.model)
+        trainer.model.eval()
+
+    print("Evaluation Start!")
+    predictors = {trainer.name: trainer.model for trainer in trainers}
+    test_device = device
+    if args.backend == 'onnxruntime':
+        # task 별 best model 을 fold 별 ONNX 로 export (parity 확인) 해 onnxruntime CPU 로 예측합니다
+        test_device = torch.device('cpu')
+        for trainer in trainers:
+            predictors[trainer.name] = onnx_backend(
+                trainer.model, os.path.join(save_dir, f"fold{fold}_{trainer.name}.onnx"),
+                trainer.size or test_stores[trainer.name].array.shape[-2:], args.onnx_threads,
+            )
+    tta = TTA(args.tta, args.tta_reduce)  # views 는 batch 하나로 쌓아 forward 한 번
+    all_predictions = {trainer.name: [] for trainer in trainers}
+    groups = {}  # 같은 test store 를 쓰는 task 는 batch 를 같이 읽습니다
+    for trainer in trainers:
+        store = test_stores[trainer.name]
+        groups.setdefault(id(store), (store, []))[1].append(trainer)
+    with torch.no_grad():
+        for store, group in groups.values():
+            for images in store.batches(args.valid_batch_size, test_device):  # decode 없이 한 번 만들어 둔 test tensor
+                for trainer, task_images in zip(group, task_inputs(images, group)):
+                    all_predictions[trainer.name].append(tta(predictors[trainer.name], task_images).cpu().numpy())
+
+    fold_preds = {task: np.concatenate(preds) for task, preds in all_predictions.items()}
+    views_per_sec, images_per_sec = tta.report()
+    print(f"{tta} : {views_per_sec:.1f} views/s, {images_per_sec:.1f} images/s (all tasks)")
+
+    # -- out-of-fold logit : task 마다 best model 로 validation set 을 순서대로 (drop_last 없이) 한 번 더 예측합니다
+    # validation batch 는 --resize 크기라 test 크기로 export 한 ONNX 가 아닌 PyTorch model 로 예측합니다
+    oof_loader = DataLoader(val_set, batch_size=args.valid_batch_size, num_workers=num_workers,
+                            shuffle=False, pin_memory=use_cuda)
+    oof_logits = {trainer.name: [] for trainer in trainers}
+    oof_labels = {trainer.name: [] for trainer in trainers}
+    with torch.no_grad():
+        for inputs, labels in oof_loader:
+            inputs = inputs.to(device)
+            for trainer, task_images in zip(trainers, task_inputs(inputs, trainers)):
+                oof_logits[trainer.name].append(tta(trainer.model, task_images).cpu().numpy())
+                oof_labels[trainer.name].append(labels[trainer.label].numpy())
+    store = LogitStore(args.logit_dir)
+    for trainer in trainers:
+        store.save(
+            LogitKey(os.path.basename(save_dir), model_name(args), trainer.name, fold), tta.output_kind,
+            test=fold_preds[trainer.name], oof=np.concatenate(oof_logits[trainer.name]),
+            oof_index=np.asarray(val_set.indices), oof_label=np.concatenate(oof_labels[trainer.name]),
+        )
+
+    if args.wandb and args.fold_workers > 1:
+        wandb.finish()
+    print("Evaluation End")
+    print()
+    return fold_preds, {trainer.name: trainer.best_f1 for trainer in trainers}
+
+
+def main(args):
+    if args.wandb and args.fold_workers <= 1:
+        init_wandb(args)
+
+    seed_everything(args.seed)
+    save_dir = increment_path(os.path.join(args.model_dir, args.name), args)
+
+    # -- dataset
+    dataset = MultiTaskDataset(args.data_dir)
+
+    # -- augmentation : 가장 큰 해상도로 한 번만 decode 하고, 작은 해상도 task 는 batch 를 downsample 해서 씁니다
+    transform_module = getattr(import_module('augmentation'), args.augmentation)  # default: BaseAugmentation
+    transform = transform_module(
+        resize=args.resize,
+        mean=dataset.mean,
+        std=dataset.std,
+        p=args.flip_ratio
+    )
+
+    image_dir = os.path.join(args.test_data_dir, 'images')
+    info_path = os.path.join(args.test_data_dir, 'info.csv')
+    submission = pd.read_csv(info_path)
+    image_paths = [os.path.join(image_dir, img_id) for img_id in submission.ImageID]
+    # test 전처리는 task 별 단독 script 와 같게 맞추고, 같은 resize 끼리는 store 를 같이 씁니다
+    test_sizes = {task: tuple(TEST_RESIZE[task] or args.resize) for task in args.tasks}
+    stores = {
+        size: TestDataset(image_paths, resize=size).store(args.cache_dir)  # 모든 fold 가 같이 쓰도록 한 번만 decode
+        for size in set(test_sizes.values())
+    }
+    test_stores = {task: stores[size] for task, size in test_sizes.items()}
+
+    fold_list = dataset.k_fold_split(args.n_split, args.seed)
+    dataset.set_transform(transform)
+    if args.cache_dir:
+        dataset.enable_cache(args.cache_dir)
+    jobs = [(args, fold, *fold_list[fold], test_stores, save_dir) for fold in range(args.n_split)]
+    results = run_folds(train_fold, jobs, n_jobs=args.fold_workers)
+
+    oof_pred = {}
+    for fold, (fold_preds, best) in enumerate(results):
+        print(f"Fold {fold + 1} best f1: " + ", ".join(f"{task} {f1:4.4f}" for task, f1 in best.items()))
+        for task, fold_pred in fold_preds.items():
+            if task not in oof_pred:
+                oof_pred[task] = fold_pred / args.n_split
+            else:
+                oof_pred[task] += fold_pred / args.n_split
+
+    for task, pred in oof_pred.items():
+        submission['ans'] = np.argmax(pred, axis=1)
+        submission.to_csv(os.path.join(args.output_dir, f'submission_{task}_prediction_{args.model}_{args.version}.csv'), index=False)
+
+
+if __name__ == '__main__':
+    args = args_getter()
+
+    main(args)
@@ -1,3 +1,8 @@
+import argparse
+import copy
+import glob
+import os
+
 import numpy as np
 import torch
 import torch.nn as nn
@@ -71,28 +76,75 @@ class MyModel(nn.Module):
         return x
 
 
+WEIGHTS_DIR = os.environ.get("SM_WEIGHTS_DIR")  # 없으면 torch hub 의 checkpoints 폴더
+
+# import 할 때는 factory 만 등록하고, network 는 처음 쓸 때 만듭니다
 _model_version = {
     "resnet": {
-        18: torchvision.models.resnet18(pretrained=True),
-        34: torchvision.models.resnet34(pretrained=True),
-        50: torchvision.models.resnet50(pretrained=True),
-        152: torchvision.models.resnet152(pretrained=True)
+        18: torchvision.models.resnet18,
+        34: torchvision.models.resnet34,
+        50: torchvision.models.resnet50,
+        152: torchvision.models.resnet152
     },
     "efficientnet": {
-        0: torchvision.models.efficientnet_b0(pretrained=True),
-        1: torchvision.models.efficientnet_b1(pretrained=True),
-        2: torchvision.models.efficientnet_b2(pretrained=True),
-        3: torchvision.models.efficientnet_b3(pretrained=True),
-        4: torchvision.models.efficientnet_b4(pretrained=True),
-        5: torchvision.models.efficientnet_b5(pretrained=True),
+        0: torchvision.models.efficientnet_b0,
+        1: torchvision.models.efficientnet_b1,
+        2: torchvision.models.efficientnet_b2,
+        3: torchvision.models.efficientnet_b3,
+        4: torchvision.models.efficientnet_b4,
+        5: torchvision.models.efficientnet_b5,
     }
 }
+_pristine = {}  # (family, version) -> pretrained weight 를 올린 CPU network 원본
+
+
+def weights_path(factory, weights_dir=None):
+    """
+    local weight store 에서 `{name}.pth` 를 찾고, 없으면 torch hub 가 받아둔 `{name}-<hash>.pth` 를 찾습니다.
+    network 에서 받지 않으므로 없으면 FileNotFoundError 를 냅니다. (`python model.py --fetch resnet:18` 로 미리 받아둡니다)
+    """
+    weights_dir = weights_dir or WEIGHTS_DIR or os.path.join(torch.hub.get_dir(), "checkpoints")
+    name = factory.__name__
+    candidates = [os.path.join(weights_dir, f"{name}.pth")]
+    candidates += sorted(glob.glob(os.path.join(weights_dir, f"{name}[-_]*.pth")))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"no local weights for {name} in {weights_dir}")
+
+
+def pretrained_net(family, version, pretrained=True):
+    """
+    pretrained network 를 새로 하나 만들어 돌려줍니다.
+    weight 는 처음 쓸 때 한 번만 disk 에서 읽어 CPU 원본으로 남겨두고, 이후에는 (e.g. fold 마다) 원본을 복사하므로
+    매번 같은 초기 weight 에서 시작하며 disk 를 다시 읽지 않습니다.
+    pretrained=False 면 weight 없이 torchvision 구조만 만듭니다. (학습한 state_dict 를 바로 올리는 export / inference)
+    """
+    if not pretrained:
+        return _model_version[family][version](pretrained=False)
+    key = (family, version)
+    if key not in _pristine:
+        factory = _model_version[family][version]
+        net = factory(pretrained=False)
+        net.load_state_dict(torch.load(weights_path(factory), map_location="cpu"))
+        _pristine[key] = net
+    return copy.deepcopy(_pristine[key])
+
+
+def fetch_weights(family, version, weights_dir=None):
+    """ pretrained weight 를 받아 local weight store 에 `{name}.pth` 로 저장합니다. (network 사용) """
+    factory = _model_version[family][version]
+    weights_dir = weights_dir or WEIGHTS_DIR or os.path.join(torch.hub.get_dir(), "checkpoints")
+    os.makedirs(weights_dir, exist_ok=True)
+    path = os.path.join(weights_dir, f"{factory.__name__}.pth")
+    torch.save(factory(pretrained=True).state_dict(), path)
+    return path
 
 
 class ResNet(nn.Module):
-    def __init__(self, num_classes, version=18):
+    def __init__(self, num_classes, version=18, pretrained=True):
         super(ResNet, self).__init__()
-        self.net = _model_version['resnet'][version]
+        self.net = pretrained_net('resnet', version, pretrained)
         self.net.fc = nn.Linear(in_features=self.net.fc.in_features, out_features=num_classes, bias=True)
 
     def forward(self, x):
@@ -100,11 +152,23 @@ class ResNet(nn.Module):
 
 
 class EfficientNet(nn.Module):
-    def __init__(self, num_classes, version=3):
+    def __init__(self, num_classes, version=3, pretrained=True):
         super(EfficientNet, self).__init__()
-        self.net = _model_version['efficientnet'][version]
+        self.net = pretrained_net('efficientnet', version, pretrained)
         self.net.classifier[1] = nn.Linear(in_features=self.net.classifier[1].in_features,
                                            out_features=num_classes, bias=True)
 
     def forward(self, x):
         return self.net(x)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fetch', nargs='+', default=[], metavar='FAMILY:VERSION',
+                        help='download pretrained weights to the local weight store (e.g. resnet:18 efficientnet:3)')
+    parser.add_argument('--weights_dir', type=str, default=WEIGHTS_DIR)
+    args = parser.parse_args()
+
+    for item in args.fetch:
+        family, version = item.split(':')
+        print(fetch_weights(family, int(version), args.weights_dir))
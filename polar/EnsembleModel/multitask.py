@@ -0,0 +1,101 @@
+"""
+decode / augmentation 한 번으로 여러 task model 을 같이 학습하기 위한 도구입니다.
+
+data pipeline 하나가 (image, label dict) batch 를 만들면 `TaskTrainer` 마다 자기 label column 과
+입력 해상도로 같은 batch 를 씁니다. 해상도가 다른 trainer 는 decode 된 batch 를 GPU 위에서 downsample 해서 받으며,
+같은 해상도를 쓰는 trainer 끼리는 downsample 도 한 번만 합니다.
+"""
+import torch
+import torch.nn.functional as F
+
+from metrics import ConfusionMatrix
+
+
+def downsample(images, size):
+    """ (N, C, H, W) batch 를 size (height, width) 로 줄입니다. (area 평균이라 aliasing 이 적습니다) """
+    if size is None or tuple(images.shape[-2:]) == tuple(size):
+        return images
+    return F.interpolate(images, size=tuple(size), mode="area")
+
+
+def task_inputs(images, trainers):
+    """ trainer 별 입력 batch. 해상도별로 한 번만 downsample 합니다. """
+    resized = {}
+    for trainer in trainers:
+        key = None if trainer.size is None else tuple(trainer.size)
+        if key not in resized:
+            resized[key] = downsample(images, key)
+    return [resized[None if trainer.size is None else tuple(trainer.size)] for trainer in trainers]
+
+
+class TaskTrainer:
+    """
+    label column 하나를 학습하는 (model, criterion, optimizer, scheduler) 묶음입니다.
+    epoch 통계는 device 위에서 누적하며, `patience` epoch 동안 f1 이 오르지 않으면 `active` 가 False 가 되어
+    나머지 trainer 가 끝날 때까지 학습을 멈춥니다.
+    """
+
+    def __init__(self, name, model, label, num_classes, criterion, optimizer, scheduler=None, size=None,
+                 checkpoints=None, patience=10):
+        self.name = name
+        self.model = model
+        self.label = label
+        self.num_classes = num_classes
+        self.criterion = criterion
+        self.optimizer = optimizer
+        self.scheduler = scheduler
+        self.size = size
+        self.checkpoints = checkpoints
+        self.patience = patience
+
+        self.active = True
+        self.counter = 0
+        self.best_f1 = 0
+
+    def start_epoch(self, device):
+        self.model.train()
+        self.loss_value = torch.zeros((), device=device)
+        self.metric = ConfusionMatrix(self.num_classes, device=device)
+
+    def train_step(self, images, labels):
+        target = labels[self.label]
+
+        self.optimizer.zero_grad()
+        outputs = self.model(images)
+        loss = self.criterion(outputs, target)
+        loss.backward()
+        self.optimizer.step()
+
+        self.loss_value += loss.detach()
+        self.metric.update(torch.argmax(outputs, dim=-1), target)
+
+    def end_epoch(self):
+        if self.scheduler is not None:
+            self.scheduler.step()
+
+    def start_validation(self, device):
+        self.model.eval()
+        self.val_loss = torch.zeros((), device=device)
+        self.val_metric = ConfusionMatrix(self.num_classes, device=device)
+        self.val_batches = 0
+
+    @torch.no_grad()
+    def val_step(self, images, labels):
+        target = labels[self.label]
+        outputs = self.model(images)
+        self.val_loss += self.criterion(outputs, target)
+        self.val_metric.update(torch.argmax(outputs, dim=-1), target)
+        self.val_batches += 1
+        return outputs
+
+    def update_best(self, f1, tag=""):
+        """ f1 기준으로 checkpoint 를 갱신하고 early stopping counter 를 셉니다. 최고 기록이면 True """
+        is_best = self.checkpoints.update(self.model, f1, tag=tag) if self.checkpoints else f1 > self.best_f1
+        if is_best:
+            self.best_f1 = f1
+            self.counter = 0
+        else:
+            self.counter += 1
+            if self.counter > self.patience:
+                self.active = False
+        return is_best
@@ -0,0 +1,169 @@
+"""
+학습한 model 을 CPU 배포용 int8 로 post-training quantization 하는 모듈입니다.
+
+- dynamic : nn.Linear 의 weight 만 int8 로 바꾸고 activation 은 실행 중에 quantize 합니다. (calibration 없음)
+- static  : FX graph mode 로 Conv / BN / ReLU 를 fuse 한 뒤 train 이미지 `--num_calibration` 장으로
+            activation 범위를 calibration 해 conv / linear 를 모두 int8 로 실행합니다. (ResNet, MobileNet 등)
+
+결과는 export.py 와 같은 TorchScript artifact (전처리 설정 포함) 로 저장되어 inference.py `--model_file` 로 바로 씁니다.
+calibration 에 쓰지 않은 train 이미지 `--num_eval` 장으로 float model 과 저장한 int8 artifact 의
+macro F1 / argmax 일치율, state_dict 크기, batch 크기별 latency 를 비교한 report 를 출력합니다.
+
+e.g. python quantize.py --model ResNet --model_kwargs version=18 --weights ./model/exp/best.pth --output ./model/exp/model_int8.ts
+     python quantize.py --module_dir ../Code --module Models --model MobileNet --weights best.pth --output mobilenet_int8.ts
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import sys
+from importlib import import_module
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torch.utils.data import DataLoader, Subset
+
+from export import build_model, load_exported, parse_kwargs, save_exported, time_model
+from metrics import ConfusionMatrix
+
+METHODS = ("dynamic", "static")
+
+
+def quantize(net, method="static", calibration_loader=None, example=None, backend="x86"):
+    """ float eager model -> int8 model. net 은 그대로 두고 복사본을 quantize 합니다. """
+    assert method in METHODS, f"method should be one of {METHODS}, {method}"
+    torch.backends.quantized.engine = backend
+    net = copy.deepcopy(net).eval()
+    if method == "dynamic":
+        return quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8)
+
+    prepared = prepare_fx(net, get_default_qconfig_mapping(backend), example_inputs=(example,))
+    with torch.no_grad():
+        for images, *_ in calibration_loader:
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def model_size(net):
+    """ state_dict 를 저장했을 때의 byte 수 """
+    buffer = io.BytesIO()
+    torch.save(net.state_dict(), buffer)
+    return buffer.tell()
+
+
+@torch.no_grad()
+def evaluate(net, loader, num_classes):
+    """ (macro F1, 예측 array) """
+    metric = ConfusionMatrix(num_classes)
+    preds = []
+    for images, *_, labels in loader:
+        pred = net(images).argmax(dim=-1)
+        metric.update(pred, labels)
+        preds.append(pred.numpy())
+    return metric.f1(), np.concatenate(preds)
+
+
+def report(net, quantized, module, config, loader, batch_sizes=(1, 8, 32)):
+    """ float eager model 과 int8 model (quantized : 크기, module : 저장한 artifact) 비교 """
+    float_f1, float_preds = evaluate(net, loader, config["num_classes"])
+    int8_f1, int8_preds = evaluate(module, loader, config["num_classes"])
+    result = {
+        "method": config["quantization"],
+        "images": len(float_preds),
+        "float_f1": float_f1,
+        "int8_f1": int8_f1,
+        "f1_delta": int8_f1 - float_f1,
+        "argmax_agreement": float(np.mean(float_preds == int8_preds)),
+        "float_bytes": model_size(net),
+        "int8_bytes": model_size(quantized),
+        "latency": [],
+    }
+    for batch_size in batch_sizes:
+        images = torch.randn(batch_size, 3, *config["resize"])
+        result["latency"].append({
+            "batch_size": batch_size, "float_ms": time_model(net, images), "int8_ms": time_model(module, images),
+        })
+
+    print(f"[{result['method']}] macro F1 float {float_f1:4.4f} -> int8 {int8_f1:4.4f} ({result['f1_delta']:+.4f}), "
+          f"argmax agreement {result['argmax_agreement']:.2%} ({result['images']} images)")
+    print(f"state_dict size : float {result['float_bytes'] / 2 ** 20:.1f}MB -> int8 {result['int8_bytes'] / 2 ** 20:.1f}MB "
+          f"(x{result['float_bytes'] / result['int8_bytes']:.2f} smaller)")
+    print(f"{'batch':>6}{'float ms':>12}{'int8 ms':>12}{'speedup':>10}")
+    for row in result["latency"]:
+        print(f"{row['batch_size']:>6}{row['float_ms']:>12.2f}{row['int8_ms']:>12.2f}{row['float_ms'] / row['int8_ms']:>9.2f}x")
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module_dir', type=str, default=None, help='directory to import --module from (e.g. ../Code)')
+    parser.add_argument('--module', type=str, default='model', help='python module defining the model (default: model)')
+    parser.add_argument('--model', type=str, default='BaseModel', help='model type (default: BaseModel)')
+    parser.add_argument('--model_kwargs', nargs='*', default=[], metavar='KEY=VALUE',
+                        help='extra model constructor arguments, e.g. version=18')
+    parser.add_argument('--num_classes', type=int, default=18)
+    parser.add_argument('--weights', type=str, default=None, help='trained state_dict (e.g. ./model/exp/best.pth)')
+    parser.add_argument('--method', type=str, default='static', choices=METHODS)
+    parser.add_argument('--backend', type=str, default='x86', choices=['x86', 'fbgemm', 'qnnpack'],
+                        help='quantized engine (default: x86, qnnpack for ARM)')
+    parser.add_argument('--dataset', type=str, default='MaskBaseDataset',
+                        help='labeled dataset for calibration / evaluation, its last item is the label (default: MaskBaseDataset)')
+    parser.add_argument('--num_calibration', type=int, default=300, help='train images for calibration (default: 300)')
+    parser.add_argument('--num_eval', type=int, default=1000, help='other train images for the F1 report (default: 1000)')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--resize', nargs=2, type=int, default=[512, 384], help='input size (default: 512 384)')
+    parser.add_argument('--batch_sizes', nargs='*', type=int, default=[1, 8, 32],
+                        help='batch sizes for the float vs int8 latency table (default: 1 8 32)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=str, default='./model/model_int8.ts')
+    parser.add_argument('--report', type=str, default=None, help='also write the report as json')
+
+    # Container environment
+    parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN'))
+
+    args = parser.parse_args()
+    print(args)
+
+    if args.module_dir:
+        sys.path.append(os.path.abspath(args.module_dir))  # dataset / metrics 는 이 폴더의 것을 씁니다
+
+    # -- calibration / evaluation 이미지 : train set 에서 겹치지 않게 뽑습니다
+    dataset_module = import_module('dataset')
+    dataset = getattr(dataset_module, args.dataset)(data_dir=args.data_dir)
+    dataset.set_transform(dataset_module.BaseAugmentation(resize=args.resize, mean=dataset.mean, std=dataset.std))
+    order = np.random.RandomState(args.seed).permutation(len(dataset))
+    calibration_loader = DataLoader(Subset(dataset, order[:args.num_calibration]), batch_size=args.batch_size)
+    eval_loader = DataLoader(Subset(dataset, order[args.num_calibration:args.num_calibration + args.num_eval]),
+                             batch_size=args.batch_size)
+
+    config = {
+        "module": args.module,
+        "model": args.model,
+        "model_kwargs": {"num_classes": args.num_classes, **parse_kwargs(args.model_kwargs)},
+        "num_classes": args.num_classes,
+        "resize": args.resize,
+        "mean": list(dataset.mean),
+        "std": list(dataset.std),
+        "method": "trace",
+        "quantization": args.method,
+        "backend": args.backend,
+    }
+    net = build_model(args.module, args.model, config["model_kwargs"], args.weights)
+    example = torch.randn(1, 3, *args.resize)
+    quantized = quantize(net, args.method, calibration_loader, example, args.backend)
+
+    with torch.no_grad():
+        module = torch.jit.freeze(torch.jit.trace(quantized, example).eval())
+    save_exported(module, config, args.output)
+    print(f"{args.method} int8 {args.model} -> {args.output}")
+
+    # inference.py 가 읽을 artifact 를 다시 읽어 float model 과 비교합니다
+    module, config = load_exported(args.output)
+    result = report(net, quantized, module, config, eval_loader, args.batch_sizes)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=4)
@@ -0,0 +1,81 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from cache import atomic_write_json, source_fingerprint
+
+STATISTICS_FILE = ".statistics.json"
+
+
+def image_moments(image_path):
+    """ 이미지 한 장의 채널별 (pixel 수, 평균, 편차 제곱합 M2) 를 [0, 1] scale 로 계산합니다. """
+    image = np.asarray(Image.open(image_path).convert("RGB"), dtype=np.float64).reshape(-1, 3) / 255
+    mean = image.mean(axis=0)
+    m2 = np.square(image - mean).sum(axis=0)
+    return image.shape[0], mean, m2
+
+
+def merge_moments(a, b):
+    """ Chan et al. 의 parallel Welford merge. 두 부분집합의 moment 를 정확하게 합칩니다. """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n_a == 0 or n_b == 0:
+        return a if n_b == 0 else b
+
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + np.square(delta) * (n_a * n_b / n)
+    return n, mean, m2
+
+
+def chunk_moments(image_paths):
+    moments = (0, np.zeros(3), np.zeros(3))
+    for image_path in image_paths:
+        moments = merge_moments(moments, image_moments(image_path))
+    return moments
+
+
+def compute_statistics(image_paths, cache_path=None, num_workers=None, chunk_size=256):
+    """
+    전체 이미지에 대해 채널별 mean / std 를 계산합니다.
+    경로를 정렬한 뒤 chunk 단위로 process pool 에 나눠 streaming 으로 merge 하므로
+    결과가 os.listdir 순서에 의존하지 않고, 메모리에는 chunk 별 moment 만 남습니다.
+    `cache_path` 가 주어지면 (path, size, mtime) 지문과 함께 저장하여 다음 실행에서는 계산을 건너뜁니다.
+    """
+    image_paths = sorted(set(image_paths))
+    fingerprint = source_fingerprint(image_paths)
+
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("fingerprint") == fingerprint:
+            return tuple(cached["mean"]), tuple(cached["std"])
+
+    print(f"[Statistics] streaming over {len(image_paths)} images...")
+    chunks = [image_paths[i:i + chunk_size] for i in range(0, len(image_paths), chunk_size)]
+    moments = (0, np.zeros(3), np.zeros(3))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for chunk in executor.map(chunk_moments, chunks):
+            moments = merge_moments(moments, chunk)
+
+    count, mean, m2 = moments
+    std = np.sqrt(m2 / count)
+    mean, std = tuple(mean.tolist()), tuple(std.tolist())
+
+    if cache_path is not None:
+        try:
+            atomic_write_json(cache_path, {
+                "fingerprint": fingerprint,
+                "num_images": len(image_paths),
+                "num_pixels": int(count),
+                "mean": mean,
+                "std": std,
+            })
+        except OSError as e:
+            print(f"[Warning] could not save statistics to {cache_path}: {e}")
+
+    return mean, std
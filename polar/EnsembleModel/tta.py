@@ -0,0 +1,109 @@
+"""
+test-time augmentation 을 forward 한 번으로 처리하는 모듈입니다.
+
+batch (N, C, H, W) 의 augmented view 들을 (V * N, C, H, W) 하나로 쌓아 model 을 한 번만 부르고,
+결과를 이미지마다 다시 모아 `reduce` 로 합칩니다. view 는 쉼표로 구분한 문자열로 고릅니다.
+
+- orig          : 원본
+- hflip / vflip : 좌우 / 상하 반전
+- crop:R        : 가운데 R 비율 crop 을 원래 크기로 확대 (e.g. crop:0.9)
+- corners:R     : 네 모서리 R 비율 crop 4 장
+- scale:S       : S 배 축소 후 가장자리 replicate padding 으로 원래 크기 (S < 1, e.g. scale:0.9)
+
+reduce : mean (softmax 평균), max (softmax 최대), logit_mean (logit 평균)
+"""
+import time
+
+import torch
+import torch.nn.functional as F
+
+REDUCTIONS = ("mean", "max", "logit_mean")
+
+
+def _resize(images, size):
+    return F.interpolate(images, size=size, mode="bilinear", align_corners=False)
+
+
+def _crop(images, top, left, height, width):
+    return _resize(images[..., top:top + height, left:left + width], images.shape[-2:])
+
+
+def _view(images, spec):
+    name, _, value = spec.partition(":")
+    height, width = images.shape[-2:]
+    if name == "orig":
+        return [images]
+    if name == "hflip":
+        return [torch.flip(images, dims=(-1,))]
+    if name == "vflip":
+        return [torch.flip(images, dims=(-2,))]
+    if name in ("crop", "corners"):
+        ratio = float(value or 0.9)
+        h, w = int(height * ratio), int(width * ratio)
+        if name == "crop":
+            return [_crop(images, (height - h) // 2, (width - w) // 2, h, w)]
+        return [_crop(images, top, left, h, w) for top in (0, height - h) for left in (0, width - w)]
+    if name == "scale":
+        ratio = float(value or 0.9)
+        h, w = int(height * ratio), int(width * ratio)
+        top, left = (height - h) // 2, (width - w) // 2
+        small = _resize(images, (h, w))
+        return [F.pad(small, (left, width - w - left, top, height - h - top), mode="replicate")]
+    raise ValueError(f"unknown TTA view: {spec}")
+
+
+class TTA:
+    """
+    `TTA("orig,hflip,crop:0.9", reduce="mean")(model, images)` -> 이미지별 (N, num_classes) 결과.
+    view 수 / 처리 시간을 누적해 `report` 로 views/s, images/s 를 돌려주므로 TTA 폭과 latency 를 비교할 수 있습니다.
+    """
+
+    def __init__(self, views="orig", reduce="logit_mean"):
+        assert reduce in REDUCTIONS, f"reduce should be one of {REDUCTIONS}, {reduce}"
+        self.views = [view.strip() for view in views.split(",") if view.strip()] if isinstance(views, str) else list(views)
+        self.reduce = reduce
+        self.n_views = 0
+        self.n_images = 0
+        self.elapsed = 0.
+
+    @property
+    def output_kind(self):
+        """ 결과가 logit 인지 softmax 확률인지 ("logits" / "probs") """
+        return "logits" if self.reduce == "logit_mean" else "probs"
+
+    def expand(self, images):
+        """ (N, C, H, W) -> (V * N, C, H, W). view 순서대로 N 장씩 이어 붙입니다. """
+        return torch.cat([view for spec in self.views for view in _view(images, spec)])
+
+    def combine(self, outputs, batch_size):
+        """ (V * N, K) -> (N, K) """
+        outputs = outputs.view(-1, batch_size, outputs.shape[-1])
+        if self.reduce == "logit_mean":
+            return outputs.mean(dim=0)
+        probs = outputs.softmax(dim=-1)
+        return probs.mean(dim=0) if self.reduce == "mean" else probs.max(dim=0).values
+
+    @torch.no_grad()
+    def __call__(self, model, images):
+        if images.is_cuda:
+            torch.cuda.synchronize(images.device)
+        start = time.perf_counter()
+
+        views = self.expand(images)
+        outputs = self.combine(model(views), len(images))
+
+        if images.is_cuda:
+            torch.cuda.synchronize(images.device)
+        self.elapsed += time.perf_counter() - start
+        self.n_views += len(views)
+        self.n_images += len(images)
+        return outputs
+
+    def report(self):
+        """ 지금까지의 (views/s, images/s) """
+        if self.elapsed == 0:
+            return 0., 0.
+        return self.n_views / self.elapsed, self.n_images / self.elapsed
+
+    def __repr__(self):
+        return f"TTA(views={','.join(self.views)}, reduce={self.reduce})"
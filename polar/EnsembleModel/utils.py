@@ -65,6 +65,10 @@ def args_getter():
     parser.add_argument('--log_interval', type=int, default=20,
                         help='how many batches to wait before logging training status')
     parser.add_argument('--n_split', type=int, default=5, help='K-Fold split value')
+    parser.add_argument('--save_top_k', type=int, default=3,
+                        help='number of best checkpoints to keep per fold (default: 3)')
+    parser.add_argument('--fold_workers', type=int, default=1,
+                        help='number of folds to train concurrently in separate processes (default: 1, sequential)')
 
     # -- augmentation hp
     parser.add_argument('--augmentation', type=str, default='BaseAugmentation',
@@ -74,6 +78,18 @@ def args_getter():
     parser.add_argument('--resize', nargs='+', type=int, default=[512, 384],
                         help='resize size for image when training (default: 512 384)')
     parser.add_argument('--beta', type=float, default=1.0, help='CutMix beta value (default: 1.0)')
+    parser.add_argument('--tta', type=str, default='orig',
+                        help='test time augmentation views, e.g. orig,hflip,crop:0.9 (default: orig)')
+    parser.add_argument('--tta_reduce', type=str, default='logit_mean', choices=['mean', 'max', 'logit_mean'],
+                        help='how to combine TTA views per image (default: logit_mean)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnxruntime'],
+                        help='backend for fold test / out-of-fold prediction (default: torch)')
+    parser.add_argument('--onnx_threads', type=int, default=None, help='onnxruntime intra-op threads (default: tune)')
+    parser.add_argument('--tasks', nargs='+', default=['mask', 'gender', 'age'], choices=['mask', 'gender', 'age'],
+                        help='tasks to train together in main_multi.py (default: mask gender age)')
+    parser.add_argument('--task_resize', dest='task_resize', default={}, action=StoreDictKeyPair,
+                        metavar="TASK1=HxW,TASK2=HxW",
+                        help='per-task input size downsampled from --resize (e.g. mask=256x192, default: --resize)')
 
     # -- scheduler hp
     parser.add_argument('--sch_params', dest='sch_params', default="Step_size=20,gamma=1.0",
@@ -86,6 +102,10 @@ def args_getter():
     parser.add_argument('--output_dir', type=str, default='./outputs')
     parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_MODEL_DIR'))
     parser.add_argument('--record_dir', type=str, default=os.environ.get('SM_RECORD_DIR'))
+    parser.add_argument('--cache_dir', type=str, default=os.environ.get('SM_CACHE_DIR'),
+                        help='decoded image memmap cache dir (default: None, no cache)')
+    parser.add_argument('--logit_dir', type=str, default=os.environ.get('SM_LOGIT_DIR', './logits'),
+                        help='per run / model / task / fold test and out-of-fold logit store (default: ./logits)')
 
     # - wandb and etc
     parser.add_argument('--wandb', type=lambda x: bool(strtobool(x)), default=False,
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+
+import torch
+
+
+def cpu_state_dict(model):
+    """ model 의 state_dict 를 CPU 로 복사합니다. (DataParallel 이면 module 의 state_dict) """
+    model = getattr(model, "module", model)
+    return {key: value.detach().to("cpu", copy=True) for key, value in model.state_dict().items()}
+
+
+def atomic_save(obj, path):
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+    """
+    학습 loop 가 disk 를 기다리지 않도록 checkpoint 를 background thread 에서 저장합니다.
+
+    - `save` / `update` 는 state_dict 를 CPU 로 복사해 쓰기 대기열에 넣고 바로 돌아옵니다.
+    - 같은 파일에 대한 쓰기가 밀려 있으면 마지막 것만 씁니다. `min_interval` (초) 이 주어지면
+      같은 파일은 그 간격보다 자주 쓰지 않고, 마지막 요청은 `close` 때 반드시 씁니다.
+    - `update` 는 metric 기준 top-k 파일만 남기고 나머지는 지우며, 최고 기록은 `best_name` 으로도 저장합니다.
+    - 모든 파일은 임시 파일에 쓴 뒤 os.replace 하므로 중간에 죽어도 깨진 checkpoint 가 남지 않습니다.
+    """
+
+    def __init__(self, save_dir, top_k=1, mode="max", metric_name="f1", prefix="",
+                 best_name="best.pth", min_interval=0.):
+        assert mode in ("max", "min"), f"mode should be either 'max' or 'min', {mode}"
+        self.save_dir = save_dir
+        self.top_k = top_k
+        self.mode = mode
+        self.metric_name = metric_name
+        self.prefix = prefix
+        self.best_name = best_name
+        self.min_interval = min_interval
+
+        self.top = []  # (metric, file name), 좋은 순서
+        self.best_metric = None
+        self.best_state = None
+
+        self._pending = {}  # file name -> state_dict (None 이면 삭제)
+        self._last_write = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        os.makedirs(save_dir, exist_ok=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_better(self, metric, other):
+        if other is None:
+            return True
+        return metric > other if self.mode == "max" else metric < other
+
+    def save(self, model, name="last.pth"):
+        """ 매번 덮어쓰는 checkpoint (e.g. last.pth) """
+        self._put(name, cpu_state_dict(model))
+
+    def update(self, model, metric, tag=""):
+        """
+        metric 이 top-k 안에 들면 `{prefix}{tag}_{metric_name}_{metric:.4f}.pth` 로 저장합니다. (top_k=0 이면 best 만)
+        최고 기록이면 True 를 돌려주며, 이때 state 는 `best_state` (CPU) 에도 남습니다.
+        """
+        metric = float(metric)
+        is_best = self.is_better(metric, self.best_metric)
+        in_top = self.top_k > 0 and (len(self.top) < self.top_k or self.is_better(metric, self.top[-1][0]))
+        if not (is_best or in_top):
+            return False
+
+        state = cpu_state_dict(model)
+        if in_top:
+            name = f"{self.prefix}{tag}_{self.metric_name}_{metric:.4f}.pth"
+            self.top.append((metric, name))
+            self.top.sort(key=lambda item: item[0], reverse=self.mode == "max")
+            for _, evicted in self.top[self.top_k:]:
+                self._put(evicted, None)
+            del self.top[self.top_k:]
+            self._put(name, state)
+
+        if is_best:
+            self.best_metric = metric
+            self.best_state = state
+            if self.best_name:
+                self._put(self.best_name, state)
+        return is_best
+
+    def load_best(self, model):
+        """ 메모리에 남아 있는 최고 기록의 weight 를 model 에 올립니다. (disk 를 읽지 않습니다) """
+        if self.best_state is not None:
+            getattr(model, "module", model).load_state_dict(self.best_state)
+        return model
+
+    def _put(self, name, state):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("CheckpointManager is already closed")
+            self._pending[name] = state
+            self._condition.notify()
+
+    def _next(self):
+        """ 쓸 차례가 된 (name, state) 를 고릅니다. 없으면 기다릴 시간 (초) 을 돌려줍니다. """
+        now = time.monotonic()
+        wait = None
+        for name in self._pending:
+            ready_at = self._last_write.get(name, -float("inf")) + self.min_interval
+            if self._closed or ready_at <= now:
+                return (name, self._pending.pop(name)), None
+            wait = ready_at - now if wait is None else min(wait, ready_at - now)
+        return None, wait
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                job, wait = self._next()
+                while job is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait(timeout=wait)
+                    job, wait = self._next()
+
+            name, state = job
+            path = os.path.join(self.save_dir, name)
+            try:
+                if state is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                else:
+                    atomic_save(state, path)
+            except OSError as e:
+                print(f"[Warning] could not write checkpoint {path}: {e}")
+            with self._condition:
+                self._last_write[name] = time.monotonic()
+
+    def close(self):
+        """ 밀려 있는 쓰기를 모두 끝낼 때까지 기다립니다. """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
@@ -7,10 +7,17 @@ import torch
 from torch.utils.data import DataLoader
 
 from dataset import TestDataset, MaskBaseDataset
+from export import load_exported, onnx_backend
 
 
 def load_model(saved_model, num_classes, device):
-    model= torch.load('./results/last_ensemble/3_best.pt') # 추론에 사용할 모델 정의
+    model_cls = getattr(import_module("model"), args.model)
+    model = model_cls(
+        num_classes=num_classes
+    )
+
+    model_path = './results/last_ensemble/3_best.pth'  # 추론에 사용할 모델 (state_dict)
+    model.load_state_dict(torch.load(model_path, map_location=device))
     return model
 
 
@@ -22,21 +29,34 @@ def inference(data_dir, model_dir, output_dir, args):
     device = torch.device("cuda" if use_cuda else "cpu")
 
     num_classes = MaskBaseDataset.num_classes  # 18
-    model= load_model(model_dir, num_classes, device).to(device)
-    model.eval()
+    preprocess = {}
+    if args.model_file:
+        # export.py / quantize.py 의 TorchScript artifact (int8 포함) 는 CPU 에서 전처리 설정과 함께 읽습니다
+        device = torch.device("cpu")
+        model, config = load_exported(args.model_file, device)
+        preprocess = {"mean": config["mean"], "std": config["std"]}
+    elif args.backend == 'onnxruntime':
+        # state_dict 를 ONNX 로 export 해 PyTorch 와 parity 를 확인하고 onnxruntime CPU 로 돌립니다
+        device = torch.device("cpu")
+        model = load_model(model_dir, num_classes, device).eval()
+        model = onnx_backend(model, os.path.join(model_dir, f'{args.model}.onnx'), (512, 384),  # TestDataset 은 resize 없이 원본 크기
+                             args.onnx_threads)
+    else:
+        model = load_model(model_dir, num_classes, device).to(device)
+        model.eval()
 
     img_root = os.path.join(data_dir, 'images')
     info_path = os.path.join(data_dir, 'info.csv')
     info = pd.read_csv(info_path)
 
     img_paths = [os.path.join(img_root, img_id) for img_id in info.ImageID]
-    dataset = TestDataset(img_paths, args.resize)
+    dataset = TestDataset(img_paths, args.resize, **preprocess)
     loader = torch.utils.data.DataLoader(
         dataset,
         batch_size=args.batch_size,
         num_workers=8,
         shuffle=False,
-        pin_memory=use_cuda,
+        pin_memory=device.type == 'cuda',
         drop_last=False,
     )
 
@@ -61,6 +81,9 @@ if __name__ == '__main__':
     parser.add_argument('--batch_size', type=int, default=64, help='input batch size for validing (default: 64)')
     parser.add_argument('--resize', type=tuple, default=(256,192), help='resize size for image when you trained (default: (512, 284))')
     parser.add_argument('--model', type=str, default='resnet18', help='model type (default: BaseModel)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnxruntime'], help='inference backend (default: torch)')
+    parser.add_argument('--onnx_threads', type=int, default=None, help='onnxruntime intra-op threads (default: tune)')
+    parser.add_argument('--model_file', type=str, default=None, help='TorchScript artifact from export.py / quantize.py (CPU, ignores --model)')
 
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_EVAL', '/opt/ml/input/data/eval'))
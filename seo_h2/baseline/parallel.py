@@ -0,0 +1,77 @@
+"""
+K-fold 의 fold 들을 process pool 에서 동시에 학습시키는 scheduler 입니다.
+
+CPU core 를 `n_jobs` 개의 겹치지 않는 구간으로 나누고, pool 의 worker process 하나가 구간 하나를 맡아
+(sched_setaffinity) torch intra-op thread 와 DataLoader worker 를 그 구간 안에서만 씁니다.
+GPU 가 있으면 worker 마다 round-robin 으로 하나씩 배정합니다.
+결과는 fold 가 끝난 순서와 관계없이 job 순서대로 돌려주므로 oof 집계는 순차 실행과 같습니다.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+_num_workers = None  # worker process 마다 initializer 에서 정해지는 DataLoader worker 수
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def core_slices(n_jobs, cores=None):
+    """ core 목록을 n_jobs 개의 연속된 구간으로 나눕니다. (core 가 job 보다 적으면 core 를 나눠 씁니다) """
+    cores = available_cores() if cores is None else list(cores)
+    if n_jobs >= len(cores):
+        return [[cores[job % len(cores)]] for job in range(n_jobs)]
+    bounds = [len(cores) * job // n_jobs for job in range(n_jobs + 1)]
+    return [cores[bounds[job]:bounds[job + 1]] for job in range(n_jobs)]
+
+
+def split_cores(n_cores):
+    """ core 구간 하나를 (DataLoader worker 수, torch intra-op thread 수) 로 반씩 나눕니다. """
+    num_workers = n_cores // 2
+    return num_workers, max(n_cores - num_workers, 1)
+
+
+def _init_worker(slots, slices, devices):
+    global _num_workers
+    slot = slots.get()
+    cores = slices[slot]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)  # DataLoader worker 도 이 affinity 를 물려받습니다
+    _num_workers, num_threads = split_cores(len(cores))
+    torch.set_num_threads(num_threads)
+    if devices:
+        torch.cuda.set_device(devices[slot % len(devices)])
+
+
+def _run_job(fn, job):
+    return fn(*job, num_workers=_num_workers)
+
+
+def run_folds(fn, jobs, n_jobs=1, num_workers=None):
+    """
+    job 마다 `fn(*job, num_workers=...)` 를 실행하고 결과를 jobs 순서대로 list 로 돌려줍니다.
+
+    - n_jobs <= 1 : 지금 process 에서 차례로 실행하며 num_workers 를 그대로 넘깁니다.
+    - n_jobs > 1  : spawn process pool 에서 동시에 실행하고 num_workers 는 core 구간에서 정합니다.
+                    fn 은 module top-level 함수, job 은 pickle 가능한 값이어야 합니다.
+    """
+    jobs = list(jobs)
+    if n_jobs <= 1:
+        return [fn(*job, num_workers=num_workers) for job in jobs]
+
+    n_jobs = min(n_jobs, len(jobs))
+    context = multiprocessing.get_context("spawn")  # fork 된 process 에서는 CUDA 를 쓸 수 없습니다
+    slots = context.Queue()
+    for slot in range(n_jobs):
+        slots.put(slot)
+    devices = list(range(torch.cuda.device_count()))
+
+    with ProcessPoolExecutor(n_jobs, mp_context=context, initializer=_init_worker,
+                             initargs=(slots, core_slices(n_jobs), devices)) as pool:
+        futures = [pool.submit(_run_job, fn, job) for job in jobs]
+        return [future.result() for future in futures]
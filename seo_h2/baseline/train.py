@@ -7,7 +7,6 @@ import random
 import re
 from importlib import import_module
 from pathlib import Path
-from sklearn.metrics import f1_score
 from utils import *
 
 import torchvision.models
@@ -24,7 +23,9 @@ from torch.utils.tensorboard import SummaryWriter
 import wandb
 
 from dataset import MaskBaseDataset
+from checkpoint import CheckpointManager
 from loss import create_criterion
+from metrics import ConfusionMatrix
 import copy
 import pickle
 
@@ -95,6 +96,8 @@ def train(data_dir, model_dir, args):
         std=dataset.std,
     )
     dataset.set_transform(transform)
+    if args.cache_dir:
+        dataset.enable_cache(args.cache_dir)
 
     # -- data_loader
     train_set, val_set = dataset.split_dataset()
@@ -149,13 +152,13 @@ def train(data_dir, model_dir, args):
     best_val_acc = 0
     best_val_f1 = 0
     best_val_loss = np.inf
+    checkpoints = CheckpointManager(model_dir, top_k=0, best_name='{}.pth'.format(args.name))
     for epoch in range(args.epochs):
         # train loop
         model.train()
         loss_value = 0
         matches = 0
-        pred_lst= []
-        label_lst=[]
+        train_metric = ConfusionMatrix(num_classes, device=device)
         for idx, train_batch in enumerate(train_loader):
             inputs, labels = train_batch
             inputs = inputs.to(device)
@@ -164,8 +167,7 @@ def train(data_dir, model_dir, args):
 
             outs = model(inputs)
             preds = torch.argmax(outs, dim=-1)
-            pred_lst.extend(preds.cpu().numpy())
-            label_lst.extend(labels.cpu().numpy())
+            train_metric.update(preds, labels)
             loss = criterion(outs, labels)
 
             loss.backward()
@@ -176,7 +178,7 @@ def train(data_dir, model_dir, args):
             if (idx + 1) % args.log_interval == 0:
                 train_loss = loss_value / args.log_interval
                 train_acc = matches / args.batch_size / args.log_interval
-                train_f1= f1_score(pred_lst, label_lst, average='macro')
+                train_f1 = train_metric.f1()
                 current_lr = get_lr(optimizer)
                 print(
                     f"Epoch[{epoch}/{args.epochs}]({idx + 1}/{len(train_loader)}) || "
@@ -198,9 +200,7 @@ def train(data_dir, model_dir, args):
             print("Calculating validation results...")
             model.eval()
             val_loss_items = []
-            val_acc_items = []
-            pred_lst=[]
-            label_lst=[]
+            val_metric = ConfusionMatrix(num_classes, device=device)
             figure = None
             for val_batch in val_loader:
                 inputs, labels = val_batch
@@ -211,16 +211,12 @@ def train(data_dir, model_dir, args):
                 preds = torch.argmax(outs, dim=-1)
 
                 loss_item = criterion(outs, labels).item()
-                acc_item = (labels == preds).sum().item()
                 val_loss_items.append(loss_item)
-                val_acc_items.append(acc_item)
-
-                pred_lst.extend(preds.cpu().numpy())
-                label_lst.extend(labels.cpu().numpy())
+                val_metric.update(preds, labels)
 
             val_loss = np.sum(val_loss_items) / len(val_loader)
-            val_acc = np.sum(val_acc_items) / len(val_set)
-            val_f1= f1_score(pred_lst, label_lst, average='macro')
+            val_acc = val_metric.accuracy()
+            val_f1 = val_metric.f1()
             best_val_loss = min(best_val_loss, val_loss)
             # if val_acc > best_val_acc:
             #     print(f"New best model for val accuracy : {val_acc:4.2%}! saving the best model..")
@@ -229,12 +225,10 @@ def train(data_dir, model_dir, args):
             #     best_val_acc = val_acc
             # model.load_state_dict(model_save)
             
-            if val_f1 > best_val_f1:   
+            if checkpoints.update(model, val_f1):
                 print(f"New best model for val f1 score : {val_f1:4.2%}! saving the best model..")
-                torch.save(model, os.path.join(model_dir, '{}.pt'.format(args.name)))
-    
                 best_val_f1 = val_f1
-            torch.save(model, os.path.join(model_dir, '{}_last.pt'.format(args.name)))
+            checkpoints.save(model, '{}_last.pth'.format(args.name))
           
             print(
                 f"[Val] acc : {val_acc:4.2%}, f1: {val_f1:4.2%} , loss: {val_loss:4.2}|| "
@@ -253,17 +247,19 @@ def train(data_dir, model_dir, args):
                     })
                 
         if args.name != 'test':
+            label_lst, pred_lst = val_metric.expand()
             wandb.log({
-                    "confusion_mat": wandb.plot.confusion_matrix(preds=np.array(pred_lst),y_true=np.array(label_lst))
+                    "confusion_mat": wandb.plot.confusion_matrix(preds=pred_lst,y_true=label_lst)
                     })
             wandb.log({
-                "confusion_matrix": wandb.sklearn.plot_confusion_matrix(np.array(label_lst),np.array(pred_lst))
+                "confusion_matrix": wandb.sklearn.plot_confusion_matrix(label_lst,pred_lst)
             })
         # early stopping
         if current_lr < 1e-8:
             print("too small learning rate! early stop!!!")
             break
 
+    checkpoints.close()
     record_expr(args.name, train_loss, val_loss, val_f1, best_val_f1, args)
     print('record experiments!!!')
 
@@ -293,6 +289,7 @@ if __name__ == '__main__':
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images2'))
     parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_MODEL_DIR', './model'))
+    parser.add_argument('--cache_dir', type=str, default=os.environ.get('SM_CACHE_DIR'), help='decoded image memmap cache dir (default: None, no cache)')
 
 
     args = parser.parse_args()
@@ -8,7 +8,6 @@ import re
 from importlib import import_module
 from pathlib import Path
 from sklearn import ensemble
-from sklearn.metrics import f1_score
 from utils import *
 
 from sklearn.model_selection import StratifiedKFold
@@ -24,8 +23,14 @@ from torch.utils.data import DataLoader
 from torch.utils.tensorboard import SummaryWriter
 import wandb
 
+from checkpoint import CheckpointManager
+from codec import encode_multi_class
 from dataset import MaskBaseDataset
 from loss import create_criterion
+from metrics import ConfusionMatrix
+from parallel import run_folds
+from tta import TTA
+from export import onnx_backend
 import copy
 from model import *
 
@@ -91,25 +96,221 @@ def increment_path(path, exist_ok=False):
         return f"{path}{n}"
 
 
-def train_ensemble(data_dir, model_dir, args):
+def init_wandb(args, name=None):
+    wandb.init(project= 'mask-project', reinit=True,
+                config={"batch_size": args.batch_size,
+                "lr"        : args.lr,
+                "epochs"    : args.epochs,
+                "name"      : args.name,
+                "criterion_name" : args.criterion
+                    })
+
+    wandb.run.name = name or args.name
+
+
+def train_fold(args, i, dataset, train_idx, valid_idx, test_store, save_dir, num_workers=None):
+    """ i 번째 fold 를 학습하고 best model 의 test 예측값과 마지막 기록을 돌려줍니다. (parallel.run_folds) """
+    if args.fold_workers > 1:
+        # fold 마다 따로 뜬 process 이므로 seed / wandb run 을 fold 별로 잡습니다
+        seed_everything(args.seed + i)
+        if args.name != 'test':
+            init_wandb(args, name=f'{args.name}_fold{i}')
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count() // 2
+
+    use_cuda = torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+    num_classes = dataset.num_classes  # 18
+
+    counter = 0
+    accumulation_steps = 2
+
+    print(f'{i} k-fold start!!!')
+    # -- model 모델선언
+    model_module = getattr(import_module("model"), args.model)  # default: resnet18
+    model = model_module(
+        num_classes=num_classes
+    ).to(device)
+        # -- loss & metric
+    criterion = create_criterion(args.criterion)  # default: focal
+    opt_module = getattr(import_module("torch.optim"), args.optimizer)  # default: adam
+    optimizer = opt_module(
+        filter(lambda p: p.requires_grad, model.parameters()),
+        lr=args.lr,
+        weight_decay=5e-4
+    )
+
+
+    scheduler= CosineAnnealingLR(optimizer, T_max=50, eta_min=0)
+
+    best_val_f1 = 0
+    best_val_loss = np.inf
+    checkpoints = CheckpointManager(f'./results/{args.name}/', top_k=0, best_name=f'{i}_best.pth')
+
+    train_loader, val_loader = getDataloader(dataset, train_idx, valid_idx, args.batch_size, num_workers=num_workers)
+    logger = SummaryWriter(log_dir=save_dir)
+    # -- logging
+    with open(os.path.join(save_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(vars(args), f, ensure_ascii=False, indent=4)
+
     if args.name != 'test':
-        wandb.init(project= 'mask-project', reinit=True,
-                    config={"batch_size": args.batch_size,
-                    "lr"        : args.lr,
-                    "epochs"    : args.epochs,
-                    "name"      : args.name,
-                    "criterion_name" : args.criterion
-                        })
+        wandb.watch(model,log='gradients',log_freq= args.log_interval)
+
+    for epoch in range(args.epochs):
+        # train loop
+        model.train()
+        loss_value = 0
+        matches = 0
+        train_metric = ConfusionMatrix(num_classes, device=device)
+        for idx, train_batch in enumerate(train_loader):
+            inputs, labels = train_batch
+            inputs = inputs.to(device)
+            labels = labels.to(device)
+            optimizer.zero_grad()
+
+            outs = model(inputs)
+            preds = torch.argmax(outs, dim=-1)
+            train_metric.update(preds, labels)
+            loss = criterion(outs, labels)
+
+            loss.backward()
+        
+            # -- Gradient Accumulation
+            if (idx+1) % accumulation_steps == 0:
+                optimizer.step()
+                optimizer.zero_grad()
+
+            loss_value += loss.item()
+            matches += (preds == labels).sum().item()
+
+            # 기록
+            if (idx + 1) % args.log_interval == 0:
+                train_loss = loss_value / args.log_interval
+                train_acc = matches / args.batch_size / args.log_interval
+                train_f1 = train_metric.f1()
+                current_lr = scheduler.get_last_lr()
+                print(
+                    f"KFold[{i}] Epoch[{epoch}/{args.epochs}]({idx + 1}/{len(train_loader)}) || "
+                    f"training loss {train_loss:4.4} || training accuracy {train_acc:4.2%} || lr {current_lr}"
+                )
+
+
+                logger.add_scalar("Train/loss", train_loss, epoch * len(train_loader) + idx)
+                logger.add_scalar("Train/accuracy", train_acc, epoch * len(train_loader) + idx)
+                logger.add_scalar("Train/f1-score", train_f1, epoch * len(train_loader) + idx)
+                loss_value = 0
+                matches = 0
+                if args.name != 'test':    
+                    wandb.log({'train_loss':train_loss,
+                'train_f1':train_f1})
+
+        # scheduler.step(loss)
+        scheduler.step()
+
+
+
+        # val loop
+        with torch.no_grad():
+            print("Calculating validation results...")
+            model.eval()
+            val_loss_items = []
+            val_metric = ConfusionMatrix(num_classes, device=device)
+        
+            for val_batch in val_loader:
+                inputs, labels = val_batch
+                inputs = inputs.to(device)
+                labels = labels.to(device)
 
-        wandb.run.name = args.name
+                outs = model(inputs)
+                preds = torch.argmax(outs, dim=-1)
+
+                loss_item = criterion(outs, labels).item()
+                val_loss_items.append(loss_item)
+                val_metric.update(preds, labels)
+
+            val_loss = np.sum(val_loss_items) / len(val_loader)
+            val_acc = val_metric.accuracy()
+
+            val_f1 = val_metric.f1()
+            best_val_loss = min(best_val_loss, val_loss)
+
+            if checkpoints.update(model, val_f1):
+                print(f"New best model for val f1 score : {val_f1:4.2%}! saving the best model..")
+                best_val_f1 = val_f1
+                counter=0
+            else:
+                counter +=1 
+            checkpoints.save(model, f'{i}_last.pth')
+            
+
+            print(
+                f"[Val] acc : {val_acc:4.2%}, f1: {val_f1:4.2%} , loss: {val_loss:4.2}|| "
+                f"best f1 : {best_val_f1:4.2%}, best loss: {best_val_loss:4.2}")
+            # f"best acc : {best_val_acc:4.2%}, best loss: {best_val_loss:4.2} || "
+            logger.add_scalar("Val/loss", val_loss, epoch)
+            logger.add_scalar("Val/accuracy", val_acc, epoch)
+            logger.add_scalar("Val/f1-score", val_f1, epoch)
+            # logger.add_figure("results", figure, epoch)
+            print()
+            if args.name != 'test':
+                wandb.log({
+                    "Valid loss": val_loss,
+                    "Valid acc" : val_acc,
+                    "Valid f1" : val_f1
+                    })
+                
+        if args.name != 'test':
+            label_lst, pred_lst = val_metric.expand()
+            wandb.log({
+                    "confusion_mat": wandb.plot.confusion_matrix(preds=pred_lst,y_true=label_lst)
+                    })
+            wandb.log({
+                "confusion_matrix": wandb.sklearn.plot_confusion_matrix(label_lst,pred_lst)
+            })
+        # # early stopping
+        # if counter > patience:
+        #     print("too small improvement!! early stop!!!")
+        #     break
+
+
+    # -- test inference
+    # 각 fold에서 생성된 모델을 사용해 Test 데이터를 예측합니다. 
+    print('test inference start!')
+    tta = TTA(args.tta, args.tta_reduce)
+    all_predictions = []
+    with torch.no_grad():
+        # epoch에서의 bestmodel 불러오기
+        checkpoints.close()
+        checkpoints.load_best(model)
+        model.eval()
+        predictor, test_device = model, device
+        if args.backend == 'onnxruntime':
+            # best model 을 fold 별 ONNX 로 export (parity 확인) 해 onnxruntime CPU 로 예측합니다
+            predictor = onnx_backend(model, os.path.join(save_dir, f"fold{i}.onnx"), test_store.array.shape[-2:],
+                                     args.onnx_threads)
+            test_device = torch.device('cpu')
+        for images in test_store.batches(args.valid_batch_size, test_device):  # decode 없이 한 번 만들어 둔 test tensor
+            # Test Time Augmentation : 원본 / horizontal_flip 등 view 들을 batch 하나로 쌓아 한 번에 예측합니다.
+            pred = tta(predictor, images)
+            all_predictions.extend(pred.cpu().numpy())
+
+        fold_pred = np.array(all_predictions)
+    views_per_sec, images_per_sec = tta.report()
+    print(f'{tta} : {views_per_sec:.1f} views/s, {images_per_sec:.1f} images/s')
+
+    if args.name != 'test' and args.fold_workers > 1:
+        wandb.finish()
+    return fold_pred, {"train_loss": train_loss, "val_loss": val_loss, "val_f1": val_f1, "best_val_f1": best_val_f1}
+
+
+def train_ensemble(data_dir, model_dir, args):
+    if args.name != 'test' and args.fold_workers <= 1:
+        init_wandb(args)
 
     seed_everything(args.seed)
 
     save_dir = increment_path(os.path.join(model_dir, args.log_name))
 
-    # -- settings
-    use_cuda = torch.cuda.is_available()
-    device = torch.device("cuda" if use_cuda else "cpu")
     # -- test dataset
     
     from dataset import TestDataset
@@ -121,20 +322,16 @@ def train_ensemble(data_dir, model_dir, args):
     submission = pd.read_csv(os.path.join(test_img_root, 'info.csv'))
     image_dir = os.path.join(test_img_root, 'images')
 
-    # Test Dataset 클래스 객체를 생성하고 DataLoader를 만듭니다.
+    # Test Dataset 클래스 객체를 생성하고 한 번만 decode 한 TensorStore 를 만듭니다.
     image_paths = [os.path.join(image_dir, img_id) for img_id in submission.ImageID]
     test_dataset = TestDataset(image_paths, resize=args.resize)
+    test_store = test_dataset.store(args.cache_dir)  # 모든 fold 가 같이 쓰도록 test set 은 한 번만 decode
 
-    test_loader = DataLoader(
-        test_dataset,
-        shuffle=False
-    )
     # -- dataset
     dataset_module = getattr(import_module("dataset"), args.dataset)  # default: BaseAugmentation
     dataset = dataset_module(
         data_dir=data_dir,
     )
-    num_classes = dataset.num_classes  # 18
 
     # -- augmentation
     transform_module = getattr(import_module("dataset"), args.augmentation)  # default: BaseAugmentation
@@ -144,14 +341,11 @@ def train_ensemble(data_dir, model_dir, args):
         std=dataset.std,
     )
     dataset.set_transform(transform)
+    if args.cache_dir:
+        dataset.enable_cache(args.cache_dir)
 
   
 
-    best_val_acc = 0
-    counter = 0
-    patience = 10
-    accumulation_steps = 2
-
     oof_pred = None
 
     os.makedirs(os.path.join(os.getcwd(), 'results', args.name), exist_ok=True)
@@ -161,188 +355,18 @@ def train_ensemble(data_dir, model_dir, args):
     skf = StratifiedKFold(n_splits=n_splits)
 
 
-    labels = [dataset.encode_multi_class(mask, gender, age) for mask, gender, age in zip(dataset.mask_labels, dataset.gender_labels, dataset.age_labels)]
-
-    for i, (train_idx, valid_idx) in enumerate(skf.split(dataset.image_paths, labels)):
-        print(f'{i} k-fold start!!!')
-        # -- model 모델선언
-        model_module = getattr(import_module("model"), args.model)  # default: resnet18
-        model = model_module(
-            num_classes=num_classes
-        ).to(device)
-            # -- loss & metric
-        criterion = create_criterion(args.criterion)  # default: focal
-        opt_module = getattr(import_module("torch.optim"), args.optimizer)  # default: adam
-        optimizer = opt_module(
-            filter(lambda p: p.requires_grad, model.parameters()),
-            lr=args.lr,
-            weight_decay=5e-4
-        )
-
-
-        scheduler= CosineAnnealingLR(optimizer, T_max=50, eta_min=0)
-
-        best_val_f1 = 0
-        best_val_loss = np.inf
-
-        train_loader, val_loader = getDataloader(dataset, train_idx, valid_idx, args.batch_size, num_workers=multiprocessing.cpu_count()//2)
-        logger = SummaryWriter(log_dir=save_dir)
-        # -- logging
-        with open(os.path.join(save_dir, 'config.json'), 'w', encoding='utf-8') as f:
-            json.dump(vars(args), f, ensure_ascii=False, indent=4)
-
-        if args.name != 'test':
-            wandb.watch(model,log='gradients',log_freq= args.log_interval)
-
-        for epoch in range(args.epochs):
-            # train loop
-            model.train()
-            loss_value = 0
-            matches = 0
-            pred_lst= []
-            label_lst=[]
-            for idx, train_batch in enumerate(train_loader):
-                inputs, labels = train_batch
-                inputs = inputs.to(device)
-                labels = labels.to(device)
-                optimizer.zero_grad()
-
-                outs = model(inputs)
-                preds = torch.argmax(outs, dim=-1)
-                pred_lst.extend(preds.cpu().numpy())
-                label_lst.extend(labels.cpu().numpy())
-                loss = criterion(outs, labels)
-
-                loss.backward()
-            
-                # -- Gradient Accumulation
-                if (idx+1) % accumulation_steps == 0:
-                    optimizer.step()
-                    optimizer.zero_grad()
-
-                loss_value += loss.item()
-                matches += (preds == labels).sum().item()
-
-                # 기록
-                if (idx + 1) % args.log_interval == 0:
-                    train_loss = loss_value / args.log_interval
-                    train_acc = matches / args.batch_size / args.log_interval
-                    train_f1= f1_score(pred_lst, label_lst, average='macro')
-                    current_lr = scheduler.get_last_lr()
-                    print(
-                        f"KFold[{i}] Epoch[{epoch}/{args.epochs}]({idx + 1}/{len(train_loader)}) || "
-                        f"training loss {train_loss:4.4} || training accuracy {train_acc:4.2%} || lr {current_lr}"
-                    )
-
-
-                    logger.add_scalar("Train/loss", train_loss, epoch * len(train_loader) + idx)
-                    logger.add_scalar("Train/accuracy", train_acc, epoch * len(train_loader) + idx)
-                    logger.add_scalar("Train/f1-score", train_f1, epoch * len(train_loader) + idx)
-                    loss_value = 0
-                    matches = 0
-                    if args.name != 'test':    
-                        wandb.log({'train_loss':train_loss,
-                    'train_f1':train_f1})
-
-            # scheduler.step(loss)
-            scheduler.step()
-
-
-
-            # val loop
-            with torch.no_grad():
-                print("Calculating validation results...")
-                model.eval()
-                val_loss_items = []
-                val_acc_items = []
-                pred_lst=[]
-                label_lst=[]
-            
-                for val_batch in val_loader:
-                    inputs, labels = val_batch
-                    inputs = inputs.to(device)
-                    labels = labels.to(device)
-
-                    outs = model(inputs)
-                    preds = torch.argmax(outs, dim=-1)
-
-                    loss_item = criterion(outs, labels).item()
-                    acc_item = (labels == preds).sum().item()
-                    val_loss_items.append(loss_item)
-                    val_acc_items.append(acc_item)
-                    pred_lst.extend(preds.cpu().numpy())
-                    label_lst.extend(labels.cpu().numpy())
-
-                val_loss = np.sum(val_loss_items) / len(val_loader)
-                val_acc = np.sum(val_acc_items) / len(valid_idx)
-
-                val_f1= f1_score(pred_lst, label_lst, average='macro')
-                best_val_loss = min(best_val_loss, val_loss)
-
-                if val_f1 > best_val_f1:   
-                    print(f"New best model for val f1 score : {val_f1:4.2%}! saving the best model..")
-            
-                    torch.save(model, os.path.join(f'./results/{args.name}/', f'{i}_best.pt'))
-                    
-                    best_val_f1 = val_f1
-                    counter=0
-                else:
-                    counter +=1 
-                torch.save(model, os.path.join(f'./results/{args.name}/', f'{i}_last.pt'))
-                
-
-                print(
-                    f"[Val] acc : {val_acc:4.2%}, f1: {val_f1:4.2%} , loss: {val_loss:4.2}|| "
-                    f"best f1 : {best_val_f1:4.2%}, best loss: {best_val_loss:4.2}")
-                # f"best acc : {best_val_acc:4.2%}, best loss: {best_val_loss:4.2} || "
-                logger.add_scalar("Val/loss", val_loss, epoch)
-                logger.add_scalar("Val/accuracy", val_acc, epoch)
-                logger.add_scalar("Val/f1-score", val_f1, epoch)
-                # logger.add_figure("results", figure, epoch)
-                print()
-                if args.name != 'test':
-                    wandb.log({
-                        "Valid loss": val_loss,
-                        "Valid acc" : val_acc,
-                        "Valid f1" : val_f1
-                        })
-                    
-            if args.name != 'test':
-                wandb.log({
-                        "confusion_mat": wandb.plot.confusion_matrix(preds=np.array(pred_lst),y_true=np.array(label_lst))
-                        })
-                wandb.log({
-                    "confusion_matrix": wandb.sklearn.plot_confusion_matrix(np.array(label_lst),np.array(pred_lst))
-                })
-            # # early stopping
-            # if counter > patience:
-            #     print("too small improvement!! early stop!!!")
-            #     break
-
-
-        # -- test inference
-        # 각 fold에서 생성된 모델을 사용해 Test 데이터를 예측합니다. 
-        print('test inference start!')
-        all_predictions = []
-        with torch.no_grad():
-            # epoch에서의 bestmodel 불러오기
-            model= torch.load(os.path.join(f'./results/{args.name}/', f'{i}_best.pt')).to(device)
-            model.eval()
-            for images in test_loader:
-                images = images.to(device)
-
-                # Test Time Augmentation
-                pred = model(images) / 2 # 원본 이미지를 예측하고
-                pred += model(torch.flip(images, dims=(-1,))) / 2 # horizontal_flip으로 뒤집어 예측합니다. 
-                all_predictions.extend(pred.cpu().numpy())
+    labels = encode_multi_class(dataset.mask_labels, dataset.gender_labels, dataset.age_labels)
 
-            fold_pred = np.array(all_predictions)
+    folds = list(skf.split(dataset.image_paths, labels))
+    jobs = [(args, i, dataset, train_idx, valid_idx, test_store, save_dir) for i, (train_idx, valid_idx) in enumerate(folds)]
+    results = run_folds(train_fold, jobs, n_jobs=args.fold_workers)
 
+    for fold_pred, last in results:
         if oof_pred is None:
             oof_pred = fold_pred / n_splits
         else:
             oof_pred += fold_pred / n_splits
-    record_expr(args.name, train_loss, val_loss, val_f1, best_val_f1, args)
+    record_expr(args.name, last["train_loss"], last["val_loss"], last["val_f1"], last["best_val_f1"], args)
 
     # submission 파일
     submission['ans'] = np.argmax(oof_pred, axis=1)
@@ -378,6 +402,12 @@ if __name__ == '__main__':
     # Container environment
     parser.add_argument('--data_dir', type=str, default=os.environ.get('SM_CHANNEL_TRAIN', '/opt/ml/input/data/train/images2'))
     parser.add_argument('--model_dir', type=str, default=os.environ.get('SM_MODEL_DIR', './model'))
+    parser.add_argument('--cache_dir', type=str, default=os.environ.get('SM_CACHE_DIR'), help='decoded image memmap cache dir (default: None, no cache)')
+    parser.add_argument('--tta', type=str, default='orig,hflip', help='test time augmentation views, e.g. orig,hflip,crop:0.9 (default: orig,hflip)')
+    parser.add_argument('--tta_reduce', type=str, default='logit_mean', choices=['mean', 'max', 'logit_mean'], help='how to combine TTA views per image (default: logit_mean)')
+    parser.add_argument('--backend', type=str, default='torch', choices=['torch', 'onnxruntime'], help='backend for fold test prediction (default: torch)')
+    parser.add_argument('--onnx_threads', type=int, default=None, help='onnxruntime intra-op threads (default: tune)')
+    parser.add_argument('--fold_workers', type=int, default=1, help='number of folds to train concurrently in separate processes (default: 1, sequential)')
 
 
     args = parser.parse_args()